@@ -1,6 +1,7 @@
 import torch
 import pandas as pd
 from tqdm import tqdm
+from AutoCleanse.dataloader import iterate_full
 
 def anonymize(encoder,test_df,test_loader,batch_size,device):
     """
@@ -13,14 +14,19 @@ def anonymize(encoder,test_df,test_loader,batch_size,device):
     """
     encoder.eval()
     encoder.to(device)
-    anonymize_progress = tqdm(test_loader, desc=f'Anonymize progress', position=0, leave=True)
+    anonymize_progress = tqdm(iterate_full(test_loader), desc=f'Anonymize progress', total=len(test_loader), position=0, leave=True)
 
-    anonymized_outputs = torch.empty(0).to(device)
+    # Preallocated output covering every row of the dataset, including a partial last batch
+    anonymized_outputs = None
     with torch.no_grad():
-        for inputs,_ in anonymize_progress:
-            inputs = inputs.to(device)
+        for inputs,indices in anonymize_progress:
+            inputs = inputs[0].to(device)
             outputs = encoder(inputs)
-            anonymized_outputs = torch.cat((anonymized_outputs,outputs),dim=0)
-    
-    anonymized_data = pd.DataFrame(anonymized_outputs.detach().cpu().numpy(),index=test_df.index[:(test_df.shape[0] // batch_size) * batch_size])
+            if (anonymized_outputs is None):
+                anonymized_outputs = torch.empty((len(test_loader.dataset),outputs.shape[1]), device=device)
+            anonymized_outputs[indices.to(device)] = outputs
+    if (anonymized_outputs is None):
+        anonymized_outputs = torch.empty((0,0), device=device)
+
+    anonymized_data = pd.DataFrame(anonymized_outputs.detach().cpu().numpy(),index=test_df.index)
     return anonymized_data
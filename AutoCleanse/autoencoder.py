@@ -1,24 +1,44 @@
 import io
 import os
+import copy
+import functools
+import inspect
+import math
+import time
+import warnings
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
 from tqdm import tqdm
+from torch.nn.utils.fusion import fuse_linear_bn_eval
 from torch.optim.lr_scheduler import *
 from AutoCleanse.bucketfs_client import bucketfs_client
 from AutoCleanse.utils import *
 from AutoCleanse.loss_model import loss_CEMSE
+from AutoCleanse.dataloader import iterate_full, rebatch_dataloader, stratified_subsample
+from AutoCleanse.layout import ColumnLayout
+from AutoCleanse.checkpoint import Checkpointer, snapshot_state_dict, get_rng_state, set_rng_state
+from AutoCleanse.inference import InferenceGraph, compile_graph
+from AutoCleanse.profiler import NULL_PROFILER
 
 
 class Autoencoder(nn.Module):
     
     def __init__(self, layers, batch_norm, dropout_enc=None, dropout_dec=None, l1_strength=0.0, l2_strength=0.0,
-                 learning_rate=1e-3, weight_decay=0):
+                 learning_rate=1e-3, weight_decay=0, cardinalities=None, embedding_dims=None):
         """
          @brief Initialize Autoencoder with given layer sizes and dropout. This is the base constructor for Autoencoder. You can override it in your subclass if you want to customize the layers.
          @param layers: List of size of layers to use
          @param dropout: List of ( drop_layer, drop_chance )
+         @param cardinalities: Number of categories of each categorical column. If given, the model takes continous columns
+                               followed by integer category codes (see Preprocessor.transform_codes) and embeds every
+                               categorical column with its own nn.Embedding instead of reading one-hot columns.
+                               layers[0] stays the one-hot width, which is the width of the decoder output.
+                               Must be preprocessor.layout.sizes, not the lengths of encoder.categories_, which count
+                               the NaN category the one-hot output drops. train_model checks them against the layout.
+         @param embedding_dims: Embedding size per categorical column, a single int for all columns, or None for
+                                min(50, (cardinality + 1) // 2)
         """
         super(Autoencoder, self).__init__()
         self.layers = layers
@@ -27,15 +47,37 @@ class Autoencoder(nn.Module):
         self.l1_strength = l1_strength
         self.l2_strength = l2_strength
         self.best_state_dict = None
+        self.layout = None
+        self.quantized = False
+        # Compiled inference graphs by output, see compile_inference
+        self._inference_graphs = {}
+        # Batch size, gradient accumulation and learning rate chosen by train_model, saved with the weights
+        self.training_config = {}
+        # Rows per optimizer step the learning rate of the optimizer is scaled for, see train_model
+        self._lr_batch_size = None
+
+        # Categorical embeddings
+        self.cardinalities = list(cardinalities) if cardinalities is not None else None
+        self.embeddings = None
+        input_size = layers[0]
+        if (self.cardinalities is not None):
+            if (embedding_dims is None):
+                embedding_dims = [min(50, (cardinality + 1) // 2) for cardinality in self.cardinalities]
+            elif isinstance(embedding_dims, int):
+                embedding_dims = [embedding_dims] * len(self.cardinalities)
+            self.num_continous = layers[0] - sum(self.cardinalities)
+            # The extra row at index `cardinality` is a zero vector for unknown categories
+            self.embeddings = nn.ModuleList([nn.Embedding(cardinality + 1, dim, padding_idx=cardinality)
+                                             for cardinality, dim in zip(self.cardinalities, embedding_dims)])
+            input_size = self.num_continous + sum(embedding_dims)
 
         # Encoder layers
         encoder_layers = []
         for i in range(self.num_layers - 1):
-            encoder_layers.append(nn.Linear(layers[i], layers[i + 1]))
+            encoder_layers.append(nn.Linear(input_size if i == 0 else layers[i], layers[i + 1]))
             if batch_norm == True:
                 encoder_layers.append(nn.BatchNorm1d(layers[i + 1]))
             encoder_layers.append(nn.ReLU())
-            encoder_layers[-1].register_forward_hook(self.add_regularization_hook) 
             if dropout_enc is not None:
                 for drop_layer, drop_chance in dropout_enc:
                     if i == drop_layer:
@@ -60,20 +102,291 @@ class Autoencoder(nn.Module):
         self.optimizer = torch.optim.AdamW(self.parameters(), lr=learning_rate, weight_decay=weight_decay)
         self.scheduler = StepLR(self.optimizer, step_size=25, gamma=0.1)     
 
-    def add_regularization_hook(self, module, input, output):
-        l1_reg = self.l1_strength * F.l1_loss(output, torch.zeros_like(output))
-        l2_reg = self.l2_strength * F.mse_loss(output, torch.zeros_like(output))
-        module.register_forward_hook(None)  
-        module._forward_hooks.clear()
-        return output + l1_reg + l2_reg 
+    def get_extra_state(self):
+        return dict(self.training_config)
 
-    def forward(self, x):
-        x = self.encoder(x)
+    def set_extra_state(self, state):
+        self.training_config = dict(state)
+
+    def embed(self, x):
+        """
+         @brief Replaces the category codes of an input batch with their embeddings
+         @param x: Batch of continous columns followed by category codes
+        """
+        codes = x[:, self.num_continous:].long()
+        embedded = [embedding(codes[:, i]) for i, embedding in enumerate(self.embeddings)]
+        return torch.cat([x[:, :self.num_continous]] + embedded, dim=1)
+
+    def expand_codes(self, x):
+        """
+         @brief Converts a batch of continous columns and category codes to the one-hot layout of the decoder output
+         @param x: Batch of continous columns followed by category codes
+        """
+        onehot = torch.zeros((x.shape[0], self.layers[0]), dtype=x.dtype, device=x.device)
+        onehot[:, :self.num_continous] = x[:, :self.num_continous]
+        offset = self.num_continous
+        for i, cardinality in enumerate(self.cardinalities):
+            codes = x[:, self.num_continous + i].long()
+            known = codes < cardinality
+            onehot[known.nonzero().squeeze(1), offset + codes[known]] = 1
+            offset += cardinality
+        return onehot
+
+    def encode(self, x, return_penalty=False):
+        """
+         @brief Maps a batch to its latent representation
+         @param x: The input batch
+         @param return_penalty: Whether to also return the L1/L2 activation penalty of the encoder ReLUs, which is
+                                0.0 outside training or without l1_strength and l2_strength. It is returned instead of
+                                kept on the module, so no autograd graph outlives the training step
+        """
+        if (self.embeddings is not None):
+            x = self.embed(x)
+        if (not return_penalty):
+            return self.encoder(x)
+        if (self.training and (self.l1_strength != 0 or self.l2_strength != 0)):
+            return activation_penalty_forward(self.encoder, x, self.l1_strength, self.l2_strength)
+        return self.encoder(x), 0.0
+
+    def forward(self, x, return_penalty=False):
+        if (return_penalty):
+            x, penalty = self.encode(x, return_penalty=True)
+            return self.decoder(x), penalty
+        x = self.encode(x)
         x = self.decoder(x)
         return x
 
-    def train_model(self,num_epochs,batch_size,patience,train_loader,val_loader,categories, \
-                    device,continous_columns,categorical_columns,wlc=(1,1)):
+    def autocast(self,device,precision="float32"):
+        """
+         @brief Returns the autocast context for the given precision
+         @param device: can be "cpu" or "cuda"
+         @param precision: "float32" (autocast disabled) or "bfloat16"
+        """
+        if (precision not in ("float32","bfloat16")):
+            raise ValueError(f"Unsupported precision {precision}, expected 'float32' or 'bfloat16'")
+        return torch.autocast(device_type=torch.device(device).type, dtype=torch.bfloat16, enabled=precision=="bfloat16")
+
+    def _train_epoch(self,model,batches,device,wlc,precision,accumulation_steps=1,step_callback=None,profiler=NULL_PROFILER):
+        """
+         @brief Runs one training epoch over the given batches
+         @param model: The module to call for the forward pass, the model itself or a DistributedDataParallel wrapper of it
+         @param batches: Iterable of (inputs, indices) batches
+         @param accumulation_steps: Number of batches whose gradients are accumulated into one optimizer step
+         @param step_callback: Optional function called with the number of batches done after every batch
+         @param profiler: The Profiler timing the data, to_device, forward, loss, backward and optimizer phases
+         @return Sums of loss, loss comp, CE and MSE weighted by batch size, kept on the device, and the sample count
+        """
+        running_metrics = torch.zeros(4, device=device)
+        running_sample_count = 0
+        pending_steps = 0
+        self.optimizer.zero_grad()
+        for step, (inputs, _) in enumerate(profiler.iterate(batches), start=1):
+            # Forward pass
+            with profiler.phase("to_device"):
+                inputs = inputs.to(device)
+            with self.autocast(device,precision):
+                with profiler.phase("forward"):
+                    outputs, penalty = model(inputs, return_penalty=True)
+                    outputs = outputs.float()
+                with profiler.phase("loss"):
+                    CEloss,MSEloss = loss_CEMSE(inputs, outputs, categorical_codes=self.embeddings is not None, layout=self.layout)
+            loss = wlc[0]*CEloss + wlc[1]*MSEloss
+            loss_comp = CEloss + MSEloss
+
+            # Backward pass, with the activation penalty of this forward pass, averaged over the accumulated batches
+            with profiler.phase("backward"):
+                ((loss + penalty) / accumulation_steps).backward()
+            pending_steps += 1
+            if (pending_steps == accumulation_steps):
+                with profiler.phase("optimizer"):
+                    self.optimizer.step()
+                    self.optimizer.zero_grad()
+                profiler.count("optimizer_steps")
+                pending_steps = 0
+
+            running_metrics += torch.stack((loss, loss_comp, CEloss, MSEloss)).detach()*inputs.shape[0]
+            running_sample_count += inputs.shape[0]
+            profiler.count("batches")
+            profiler.count("rows", inputs.shape[0])
+            if (step_callback is not None):
+                step_callback(step)
+        # Step on the gradients of the last incomplete accumulation, averaged over its pending_steps batches
+        # instead of accumulation_steps
+        if (pending_steps > 0):
+            with profiler.phase("optimizer"):
+                if (pending_steps != accumulation_steps):
+                    for parameter in self.parameters():
+                        if (parameter.grad is not None):
+                            parameter.grad.mul_(accumulation_steps / pending_steps)
+                self.optimizer.step()
+                self.optimizer.zero_grad()
+            profiler.count("optimizer_steps")
+        return running_metrics, running_sample_count
+
+    def _validate(self,batches,device,wlc,precision):
+        """
+         @brief Computes the validation metrics in eval and inference mode
+         @param batches: Iterable of (inputs, indices) batches
+         @return Sums of loss, loss comp, CE and MSE weighted by batch size, kept on the device, and the sample count
+        """
+        val_running_metrics = torch.zeros(4, device=device)
+        val_running_sample_count = 0
+        self.eval()
+        with torch.inference_mode():
+            for val_inputs, _ in batches:
+                val_inputs = val_inputs.to(device)
+                with self.autocast(device,precision):
+                    val_outputs = self(val_inputs).float()
+                    val_CEloss,val_MSEloss = loss_CEMSE(val_inputs, val_outputs, categorical_codes=self.embeddings is not None, layout=self.layout)
+                val_loss = wlc[0]*val_CEloss + wlc[1]*val_MSEloss
+                val_loss_comp = val_CEloss + val_MSEloss
+
+                val_running_metrics += torch.stack((val_loss, val_loss_comp, val_CEloss, val_MSEloss))*val_inputs.shape[0]
+                val_running_sample_count += val_inputs.shape[0]
+        self.train()
+        return val_running_metrics, val_running_sample_count
+
+    def _print_epoch(self,epoch,num_epochs,train_metrics,val_metrics):
+        # val_metrics is None for epochs without validation
+        for name, index in (("Loss", 0), ("CE Loss", 2), ("MSE Loss", 3), ("Loss Comp", 1)):
+            print(f"Epoch [{epoch+1}/{num_epochs}], Training {name}: {train_metrics[index]:.8f}")
+            if (val_metrics is not None):
+                print(f"Epoch [{epoch+1}/{num_epochs}], Validation {name}: {val_metrics[index]:.8f}")
+
+    def _validation_subsample(self,dataset,val_subsample,layout):
+        """
+         @brief Draws the fixed validation subsample of train_model, stratified by the categories of the categorical
+                columns (the first categorical column first)
+         @param dataset: The validation dataset
+         @param val_subsample: Fraction (float up to 1) or number of rows (int) to draw
+         @param layout: The ColumnLayout of the data
+         @return Tensor with the subsampled rows
+        """
+        data = dataset.data
+        size = round(val_subsample * len(dataset)) if isinstance(val_subsample, float) and val_subsample <= 1 else int(val_subsample)
+        if (size < 1):
+            raise ValueError(f"val_subsample {val_subsample} selects no validation rows")
+        layout = layout.to("cpu")
+        categorical = torch.as_tensor(data[:, layout.num_continous:])
+        if (layout.num_categorical == 0):
+            strata = torch.zeros(len(dataset), dtype=torch.long)
+        elif (self.embeddings is not None):
+            strata = categorical.long()
+        else:
+            strata = segment_argmax(categorical, layout.group_ids, layout.num_categorical)
+        indices = stratified_subsample(strata, size, generator=torch.Generator().manual_seed(0))
+        return data[indices]
+
+    def _activation_bytes_per_row(self,inputs):
+        """
+         @brief Estimates the training memory per batch row: the input row and the output of every layer,
+                kept for the backward pass, plus its gradient
+         @param inputs: A small example batch on the device of the model
+        """
+        numels = []
+        hooks = [module.register_forward_hook(lambda module, args, output: numels.append(output.numel()))
+                 for module in self.modules() if len(list(module.children())) == 0]
+        try:
+            with torch.no_grad():
+                self(inputs)
+        finally:
+            for hook in hooks:
+                hook.remove()
+        element_size = inputs.element_size()
+        return (inputs[0].numel() + 2 * sum(numels) // inputs.shape[0]) * element_size
+
+    def find_batch_size(self,dataset,device="cpu",memory_budget=None,candidates=None,steps=3,wlc=(1,1),layout=None,precision="float32"):
+        """
+        Find the training batch size with the best throughput that fits a memory budget. Every candidate is probed
+        with a few training steps on a copy of the model, so the weights and optimizer state of this model are not
+        changed. Candidates whose memory exceeds the budget are skipped: on CUDA the measured peak allocation counts,
+        on CPU an estimate of the weights, gradients, AdamW moments and the per-row activations of the batch.
+
+        Args:
+            dataset (PlainDataset): The preprocessed training set.
+            device (str, optional): The device to probe on. Defaults to "cpu".
+            memory_budget (int, optional): The memory budget in bytes. Defaults to no limit on CPU and the free
+                                           memory of the GPU on CUDA.
+            candidates (list, optional): The batch sizes to probe. Defaults to the powers of two from 32 up to the
+                                         size of the dataset, at most 65536.
+            steps (int, optional): The timed training steps per candidate, after one warmup step. Defaults to 3.
+            wlc (tuple, optional): The weighted loss coefficients for CE and MSE losses. Defaults to (1, 1).
+            layout (ColumnLayout, optional): The column layout of the data. Defaults to the layout stored by train_model.
+            precision (str, optional): "float32" or "bfloat16", see train_model. Defaults to "float32".
+
+        Returns:
+            dict: 'batch_size' with the fastest batch size within the budget, 'samples_per_sec' with its throughput,
+                  'memory_bytes' with its (estimated) memory and 'probes' mapping every probed batch size to its
+                  throughput.
+        """
+        layout = layout if layout is not None else self.layout
+        if (layout is None):
+            raise ValueError("find_batch_size needs a layout, pass one or train the model first")
+        if (self.quantized):
+            raise RuntimeError("A quantized Autoencoder cannot be trained, train the float model and quantize it again")
+        device = torch.device(device)
+        if (candidates is None):
+            candidates = [2**k for k in range(5, 17) if 2**k <= len(dataset)] or [len(dataset)]
+        if (memory_budget is None and device.type == "cuda"):
+            memory_budget = torch.cuda.mem_get_info(device)[0]
+
+        inference_graphs, self._inference_graphs = self._inference_graphs, {}
+        try:
+            probe = copy.deepcopy(self)
+        finally:
+            self._inference_graphs = inference_graphs
+        probe.to(device)
+        probe.layout = layout.to(device)
+        probe.train()
+        # Weights, gradients and the two AdamW moments
+        fixed_bytes = 4 * sum(parameter.numel() * parameter.element_size() for parameter in probe.parameters())
+        bytes_per_row = probe._activation_bytes_per_row(dataset.data[:2].to(device))
+
+        probes = {}
+        memory = {}
+        for batch_size in sorted(candidates):
+            estimated_bytes = fixed_bytes + batch_size * bytes_per_row
+            if (memory_budget is not None and estimated_bytes > memory_budget):
+                break
+            batches = [(dataset.data[:batch_size].to(device), None)]
+            try:
+                if (device.type == "cuda"):
+                    torch.cuda.reset_peak_memory_stats(device)
+                probe._train_epoch(probe, batches, device, wlc, precision)
+                if (device.type == "cuda"):
+                    torch.cuda.synchronize(device)
+                start = time.perf_counter()
+                probe._train_epoch(probe, batches * steps, device, wlc, precision)
+                if (device.type == "cuda"):
+                    torch.cuda.synchronize(device)
+                    estimated_bytes = torch.cuda.max_memory_allocated(device)
+            except torch.cuda.OutOfMemoryError:
+                break
+            if (memory_budget is not None and estimated_bytes > memory_budget):
+                break
+            probes[batch_size] = batch_size * steps / (time.perf_counter() - start)
+            memory[batch_size] = estimated_bytes
+        del probe
+        if (not probes):
+            raise RuntimeError(f"No batch size out of {sorted(candidates)} fits the memory budget of {memory_budget} bytes")
+        best = sorted(probes, key=probes.get)[-1]
+        return {'batch_size': best, 'samples_per_sec': probes[best], 'memory_bytes': memory[best], 'probes': probes}
+
+    def _scale_learning_rate(self,factor):
+        # Scales the current and the scheduler base learning rate, keeping the decay steps taken so far
+        for group in self.optimizer.param_groups:
+            group['lr'] *= factor
+            if ('initial_lr' in group):
+                group['initial_lr'] *= factor
+        self.scheduler.base_lrs = [lr * factor for lr in self.scheduler.base_lrs]
+        self.scheduler._last_lr = [group['lr'] for group in self.optimizer.param_groups]
+
+    def train_model(self,num_epochs,batch_size,patience,train_loader,val_loader,categories=None, \
+                    device="cpu",continous_columns=None,categorical_columns=None,wlc=(1,1),layout=None,precision="float32", \
+                    checkpoint_every=0,checkpoint_location="local",checkpoint_name=None,resume=False, \
+                    auto_batch_size=False,memory_budget=None,effective_batch_size=None,scale_lr=True, \
+                    validate_every=1,validate_every_steps=None,val_subsample=None,val_subsample_tolerance=0.05, \
+                    profiler=None):
         """
         Train the model using the specified parameters and data loaders.
 
@@ -88,118 +401,231 @@ class Autoencoder(nn.Module):
             continous_columns (list): The list of names of the continuous columns.
             categorical_columns (list): The list of names of the categorical columns.
             wlc (tuple, optional): The weighted loss coefficients for CE and MSE losses. Defaults to (1, 1).
+            layout (ColumnLayout, optional): The column layout of the data, e.g. preprocessor.layout. Replaces categories
+                                             and the column lists, and is stored on the model for clean.
+            precision (str, optional): "float32", or "bfloat16" to run forward and loss under autocast while weights,
+                                       optimizer state and loss reductions stay in float32. Defaults to "float32".
+            checkpoint_every (int, optional): Save a checkpoint of model, optimizer, scheduler, early stopping state and
+                                              RNG state every this many epochs, written on a background thread.
+                                              0 disables checkpoints. Defaults to 0.
+            checkpoint_location (str, optional): "local" or "bucketfs". Defaults to "local".
+            checkpoint_name (str, optional): Checkpoint name, saved as autoencoder_{name}_checkpoint.pth. Defaults to
+                                             the layer sizes and wlc, like save.
+            resume (bool, optional): Continue from the checkpoint if it exists, with the same num_epochs as the
+                                     interrupted run. Defaults to False.
+            auto_batch_size (bool, optional): Pick the batch size of the loaders with find_batch_size and rebuild
+                                              them (they must come from create_dataloader). Defaults to False.
+            memory_budget (int, optional): The memory budget in bytes for auto_batch_size. Defaults to None.
+            effective_batch_size (int, optional): Accumulate gradients over enough batches per optimizer step to
+                                                  reach this many rows. Defaults to one batch per step.
+            scale_lr (bool, optional): With auto_batch_size or effective_batch_size, scale the learning rate linearly
+                                       with the rows per optimizer step, relative to the rows per step it was last
+                                       scaled for, or else to the batch size of the given loaders, which the learning
+                                       rate was chosen for. Without them the learning rate is left as is. Defaults to True.
+            validate_every (int, optional): Validate after every this many epochs, and after the last epoch.
+                                            Defaults to 1.
+            validate_every_steps (int, optional): Also validate after every this many training batches within an
+                                                  epoch. Defaults to None.
+            val_subsample (float or int, optional): Screen every validation on a fixed random subsample of the
+                                                    validation set, stratified by the categorical columns, given as
+                                                    a fraction (float up to 1) or a number of rows (int). The full
+                                                    validation set is only evaluated when the subsample loss is
+                                                    within val_subsample_tolerance of the subsample loss of the best
+                                                    model, and best_state_dict is only updated from a full
+                                                    validation. Defaults to None, always validating on the full set.
+            val_subsample_tolerance (float, optional): Relative margin above the subsample loss of the best model
+                                                       within which the full validation set is still evaluated, so
+                                                       that subsample noise does not screen out a real improvement.
+                                                       Defaults to 0.05.
+            profiler (Profiler, optional): Collects per-phase timings and counters, one record per epoch, see
+                                           AutoCleanse.profiler. Defaults to None, no profiling.
+            Early stopping counts validations without improvement, which are epochs with the defaults.
 
         Returns:
             None
         """
         
+        if (self.quantized):
+            raise RuntimeError("A quantized Autoencoder cannot be trained, train the float model and quantize it again")
+        profiler = profiler if profiler is not None else NULL_PROFILER
         self.wlc =  wlc
+        self._inference_graphs = {}
+        if (layout is None):
+            layout = ColumnLayout(continous_columns, categorical_columns, categories)
+        self.layout = layout.to(device)
+        if (self.cardinalities is not None and (self.cardinalities != list(self.layout.sizes)
+                                                or self.num_continous != self.layout.num_continous)):
+            raise ValueError(f"The embeddings were built for cardinalities {self.cardinalities} and {self.num_continous} "
+                             f"continous columns, but the layout has sizes {list(self.layout.sizes)} and "
+                             f"{self.layout.num_continous} continous columns. Pass cardinalities=preprocessor.layout.sizes")
         best_loss = float('inf')
+        # Subsample loss of the best model, for the val_subsample screen
+        best_estimate = None
         self.to(device)
+        self.train()
         counter = 0
-        # Training loop
-        for epoch in range(num_epochs):
-            train_progress = tqdm(train_loader, desc=f'Epoch [{epoch+1}/{num_epochs}], Training Progress', position=0, leave=True)
-
-            running_loss = 0.0
-            running_loss_comp = 0.0
-            running_CEloss = 0.0
-            running_MSEloss = 0.0
-            running_sample_count = 0.0
-            for inputs, _  in train_progress:
-                # Forward pass
-                inputs = inputs.to(device)
-                outputs = self(inputs)
+        start_epoch = 0
+
+        # Batch size, gradient accumulation and learning rate scaling
+        loader_batch_size = getattr(train_loader.sampler, 'batch_size', None) or train_loader.batch_size or batch_size
+        # The learning rate of the optimizer belongs to the batch size of the given loaders until it is scaled
+        lr_batch_size = self._lr_batch_size if self._lr_batch_size is not None else loader_batch_size
+        samples_per_sec = None
+        if (auto_batch_size):
+            probe = self.find_batch_size(train_loader.dataset, device=device, memory_budget=memory_budget, wlc=wlc,
+                                         layout=self.layout, precision=precision)
+            loader_batch_size, samples_per_sec = probe['batch_size'], probe['samples_per_sec']
+            print(f"Batch size {loader_batch_size}: {samples_per_sec:.0f} samples/sec")
+            train_loader = rebatch_dataloader(train_loader, loader_batch_size)
+            val_loader = rebatch_dataloader(val_loader, loader_batch_size)
+        accumulation_steps = 1
+        if (effective_batch_size is not None):
+            # At least effective_batch_size rows per optimizer step
+            accumulation_steps = math.ceil(effective_batch_size / loader_batch_size)
+        step_batch_size = loader_batch_size * accumulation_steps
+        # Only a batch size or accumulation asked for here rescales, not the batch size of other loaders
+        if (scale_lr and (auto_batch_size or effective_batch_size is not None)):
+            if (step_batch_size != lr_batch_size):
+                self._scale_learning_rate(step_batch_size / lr_batch_size)
+                lr_batch_size = step_batch_size
+            self._lr_batch_size = lr_batch_size
+        training_config = {
+            'batch_size': loader_batch_size,
+            'accumulation_steps': accumulation_steps,
+            'effective_batch_size': step_batch_size,
+            'learning_rate': self.optimizer.param_groups[0]['lr'],
+            'lr_batch_size': lr_batch_size,
+            'auto_batch_size': auto_batch_size,
+            'samples_per_sec': samples_per_sec,
+        }
+
+        checkpointer = None
+        generator = getattr(getattr(train_loader, 'sampler', None), 'generator', None)
+        if (checkpoint_every > 0 or resume):
+            if (checkpoint_name is None):
+                layers_str = '_'.join(str(item) for item in self.layers)
+                checkpoint_name = f'{layers_str}_{wlc}'
+            checkpointer = Checkpointer(checkpoint_location, f'autoencoder_{checkpoint_name}_checkpoint.pth')
+        if (resume):
+            checkpoint = checkpointer.load()
+            if (checkpoint is None):
+                print(f"No checkpoint {checkpointer.name} found, training from scratch")
+            else:
+                checkpoint['model'].setdefault('_extra_state', {})
+                self.load_state_dict(checkpoint['model'])
+                self.optimizer.load_state_dict(checkpoint['optimizer'])
+                self.scheduler.load_state_dict(checkpoint['scheduler'])
+                self.best_state_dict = snapshot_state_dict(checkpoint['best_state_dict'], device)
+                best_loss = checkpoint['best_loss']
+                best_estimate = checkpoint.get('best_estimate')
+                counter = checkpoint['counter']
+                start_epoch = checkpoint['epoch']
+                set_rng_state(checkpoint['rng_state'], generator)
+                print(f"Resumed from {checkpointer.name} after epoch {start_epoch}")
+                if (counter >= patience):
+                    print("Early stopping was triggered before the checkpoint. Stopping training.")
+                    return
+        training_config['learning_rate'] = self.optimizer.param_groups[0]['lr']
+        self.training_config = training_config
+
+        # Fixed validation subsample, batched like the validation loader
+        val_estimate = None
+        if (val_subsample is not None):
+            val_batch_size = getattr(val_loader.sampler, 'batch_size', None) or val_loader.batch_size or loader_batch_size
+            val_estimate = self._validation_subsample(val_loader.dataset, val_subsample, self.layout).to(device).split(val_batch_size)
+
+        def validate(desc):
+            # Updates early stopping and best_state_dict, only from a full validation pass
+            nonlocal best_loss, best_estimate, counter
+            if (val_estimate is not None):
+                with profiler.phase("validation_subsample"):
+                    estimate_metrics, estimate_count = self._validate(((inputs, None) for inputs in val_estimate), device, wlc, precision)
+                estimate_metrics = (estimate_metrics / estimate_count).tolist()
+                # Compare subsample with subsample loss, the full-set best loss is not on the same scale
+                if (best_estimate is not None and estimate_metrics[0] >= best_estimate * (1 + val_subsample_tolerance)):
+                    counter += 1
+                    return estimate_metrics
+            val_progress = tqdm(val_loader, desc=desc, position=0, leave=True)
+            with profiler.phase("validation"):
+                val_running_metrics, val_running_sample_count = self._validate(val_progress, device, wlc, precision)
+                val_metrics = (val_running_metrics / val_running_sample_count).tolist()
+            val_progress.set_postfix({"Validation Loss": val_metrics[0]})
+            val_progress.update()
+            val_progress.close()
 
-                CEloss,MSEloss = loss_CEMSE(inputs, outputs, categories, continous_columns, categorical_columns)
-                loss = wlc[0]*CEloss + wlc[1]*MSEloss
-                loss_comp = CEloss + MSEloss
+            # Check if validation loss has improved
+            if val_metrics[0] < best_loss - 0.001:
+                best_loss = val_metrics[0]
+                if (val_estimate is not None):
+                    best_estimate = estimate_metrics[0]
+                self.best_state_dict = snapshot_state_dict(self.state_dict(), device)
+                counter = 0
+            else:
+                counter += 1
+            return val_metrics
 
-                # Backward pass and optimization
-                self.optimizer.zero_grad()
-                loss.backward()
-                self.optimizer.step()
+        def validate_step(step, epoch):
+            if (step % validate_every_steps == 0 and step < len(train_loader)):
+                validate(f'Epoch [{epoch+1}/{num_epochs}], Step {step}, Validation Progress')
 
-                running_loss += loss.item()*batch_size
-                running_loss_comp += loss_comp.item()*batch_size
-                running_CEloss += CEloss.item()*batch_size
-                running_MSEloss += MSEloss.item()*batch_size
-                running_sample_count += inputs.shape[0]
+        # Training loop
+        for epoch in range(start_epoch, num_epochs):
+            train_progress = tqdm(train_loader, desc=f'Epoch [{epoch+1}/{num_epochs}], Training Progress', position=0, leave=True)
 
-            average_loss = running_loss / running_sample_count      # Final loss: multiply by batch size then averaged over all samples
-            average_loss_comp = running_loss_comp / running_sample_count
-            average_CEloss = running_CEloss / running_sample_count
-            average_MSEloss = running_MSEloss / running_sample_count
+            step_callback = functools.partial(validate_step, epoch=epoch) if validate_every_steps else None
+            running_metrics, running_sample_count = self._train_epoch(self, train_progress, device, wlc, precision,
+                                                                      accumulation_steps, step_callback, profiler)
+            average_loss, average_loss_comp, average_CEloss, average_MSEloss = (running_metrics / running_sample_count).tolist()
             train_progress.set_postfix({"Training Loss": average_loss})
             train_progress.update()
             train_progress.close()
 
             # Calculate validation loss
-            val_progress = tqdm(val_loader, desc=f'Epoch [{epoch+1}/{num_epochs}], Validation Progress', position=0, leave=True)
-
-            val_running_loss = 0.0
-            val_running_loss_comp = 0.0
-            val_running_CEloss = 0.0
-            val_running_MSEloss = 0.0
-            val_running_sample_count = 0.0
-            for val_inputs, _ in val_progress:
-                val_inputs = val_inputs.to(device)
-                val_outputs = self(val_inputs)
-
-                val_CEloss,val_MSEloss = loss_CEMSE(val_inputs, val_outputs, categories, continous_columns, categorical_columns)
-                val_loss = wlc[0]*val_CEloss + wlc[1]*val_MSEloss
-                val_loss_comp = val_CEloss + val_MSEloss
-
-                val_running_loss += val_loss.item()*batch_size
-                val_running_loss_comp += val_loss_comp.item()*batch_size
-                val_running_CEloss += val_CEloss.item()*batch_size
-                val_running_MSEloss += val_MSEloss.item()*batch_size
-                val_running_sample_count += val_inputs.shape[0]
-
-            val_avg_loss = val_running_loss / val_running_sample_count
-            val_avg_loss_comp = val_running_loss_comp / val_running_sample_count
-            val_average_CEloss = val_running_CEloss / val_running_sample_count
-            val_average_MSEloss = val_running_MSEloss / val_running_sample_count
-            val_progress.set_postfix({"Validation Loss": val_avg_loss})
-            val_progress.update()
-            val_progress.close()
+            val_metrics = None
+            if ((epoch+1) % validate_every == 0 or epoch+1 == num_epochs):
+                val_metrics = validate(f'Epoch [{epoch+1}/{num_epochs}], Validation Progress')
 
-            # Check if validation loss has improved
-            if val_avg_loss < best_loss - 0.001:
-                best_loss = val_avg_loss
-                self.best_state_dict = self.state_dict()
-                counter = 0
-            else:
-                counter += 1
-
-            print(f"Epoch [{epoch+1}/{num_epochs}], Training Loss: {average_loss:.8f}")
-            print(f"Epoch [{epoch+1}/{num_epochs}], Validation Loss: {val_avg_loss:.8f}")
-            print(f"Epoch [{epoch+1}/{num_epochs}], Training CE Loss: {average_CEloss:.8f}")
-            print(f"Epoch [{epoch+1}/{num_epochs}], Validation CE Loss: {val_average_CEloss:.8f}")
-            print(f"Epoch [{epoch+1}/{num_epochs}], Training MSE Loss: {average_MSEloss:.8f}")
-            print(f"Epoch [{epoch+1}/{num_epochs}], Validation MSE Loss: {val_average_MSEloss:.8f}")
-            print(f"Epoch [{epoch+1}/{num_epochs}], Training Loss Comp: {average_loss_comp:.8f}")
-            print(f"Epoch [{epoch+1}/{num_epochs}], Validation Loss Comp: {val_avg_loss_comp:.8f}")
+            self._print_epoch(epoch, num_epochs, (average_loss, average_loss_comp, average_CEloss, average_MSEloss), val_metrics)
 
             # Update the learning rate
             self.scheduler.step()
             print(f"Epoch [{epoch+1}/{num_epochs}]: Learning Rate = {self.scheduler.get_last_lr()}\n")
 
+            if (checkpoint_every > 0 and ((epoch+1) % checkpoint_every == 0 or epoch+1 == num_epochs or counter >= patience)):
+                with profiler.phase("checkpoint"):
+                    checkpointer.save({
+                        'epoch': epoch+1,
+                        'model': snapshot_state_dict(self.state_dict()),
+                        'optimizer': snapshot_state_dict(self.optimizer.state_dict()),
+                        'scheduler': self.scheduler.state_dict(),
+                        'best_state_dict': snapshot_state_dict(self.best_state_dict),
+                        'best_loss': best_loss,
+                        'best_estimate': best_estimate,
+                        'counter': counter,
+                        'rng_state': get_rng_state(generator),
+                    })
+            profiler.end_record(f'epoch_{epoch+1}')
+
             # Early stopping condition
             if counter >= patience:
                 print("Early stopping triggered. Stopping training.")
                 break
             train_progress.close()
-            val_progress.close()
+
+        if (checkpointer is not None):
+            checkpointer.wait()
         
     def save(self,location,name=None):
-        self.load_state_dict(self.best_state_dict)
+        # A quantized copy is saved as is, its best_state_dict belongs to the float model
+        suffix = '_int8' if self.quantized else ''
+        if (not self.quantized):
+            self.load_state_dict(self.best_state_dict)
         if (name is None):
             layers_str = '_'.join(str(item) for item in self.layers) 
             wlc_str = str(self.wlc)
-            name = f'autoencoder_{layers_str}_{wlc_str}.pth'
+            name = f'autoencoder_{layers_str}_{wlc_str}{suffix}.pth'
         else:
-            name = f'autoencoder_{name}.pth'
+            name = f'autoencoder_{name}{suffix}.pth'
         if (location=="bucketfs"):
             buffer = io.BytesIO()
             torch.save(self.state_dict(), buffer)
@@ -215,9 +641,15 @@ class Autoencoder(nn.Module):
                 raise RuntimeError(f"Failed saving {name} to local") from e
             print(f'Saved weight to {name}')
 
-    def load(self,location,name=None):
+    def load(self,location,name=None,quantized=False):
+        """
+        Load weights saved by save. With quantized=True the int8 weights saved from a quantize() copy are loaded,
+        converting this model (built with the same arguments as the float model) to the quantized structure first.
+        """
         weight = None 
-        name = f"autoencoder_{name}.pth"           
+        if (quantized and not self.quantized):
+            self._quantize_modules()
+        name = f"autoencoder_{name}_int8.pth" if quantized else f"autoencoder_{name}.pth"
         if (location=="bucketfs"):
             try:
                 weight = bucketfs_client().download(f'autoencoder/{name}')
@@ -231,97 +663,246 @@ class Autoencoder(nn.Module):
             except Exception as e:
                 raise RuntimeError(f"Failed loading {name} from local") from e
             print(f'Loaded weight from {name}')
-        self.load_state_dict(torch.load(weight))
+        state_dict = torch.load(weight)
+        # Weights saved before the training settings were stored with them
+        state_dict.setdefault('_extra_state', {})
+        self.load_state_dict(state_dict)
 
-    def clean(self,dirty_loader,df,batch_size,onehotencoder,scaler,device,\
-              og_columns,continous_columns=None,categorical_columns=None,test_loader=None):
+    def _quantize_modules(self):
+        # Folds every BatchNorm1d into the preceding Linear, then swaps every Linear for a dynamic int8 Linear
+        self.eval()
+        self.to("cpu")
+        self._inference_graphs = {}
+        for sequential_name in ("encoder", "decoder"):
+            folded = []
+            for module in getattr(self, sequential_name):
+                if (isinstance(module, nn.BatchNorm1d) and folded and isinstance(folded[-1], nn.Linear)):
+                    folded[-1] = fuse_linear_bn_eval(folded[-1], module)
+                else:
+                    folded.append(module)
+            setattr(self, sequential_name, nn.Sequential(*folded))
+        with warnings.catch_warnings():
+            # torch.ao.quantization is deprecated in recent PyTorch releases in favour of torchao
+            warnings.simplefilter("ignore", DeprecationWarning)
+            warnings.simplefilter("ignore", UserWarning)
+            torch.ao.quantization.quantize_dynamic(self, {nn.Linear}, dtype=torch.qint8, inplace=True)
+        self.requires_grad_(False)
+        self.quantized = True
+
+    def quantize(self):
+        """
+        Return a dynamically quantized int8 copy of the trained model for CPU inference. BatchNorm layers are folded
+        into the preceding Linear layers, then every Linear layer stores int8 weights and quantizes its activations
+        on the fly. Categorical embeddings stay float. The copy is for clean, anonymize and compile_inference only,
+        it cannot be trained further. save stores it as autoencoder_{name}_int8.pth, load it with load(..., quantized=True).
+
+        Returns:
+            Autoencoder: The quantized copy.
+        """
+        if (self.quantized):
+            return self
+        inference_graphs, self._inference_graphs = self._inference_graphs, {}
+        try:
+            quantized = copy.deepcopy(self)
+        finally:
+            self._inference_graphs = inference_graphs
+        quantized.best_state_dict = None
+        quantized._quantize_modules()
+        return quantized
+
+    def compile_inference(self,layout=None,output="clean",backend="auto",precision="float32",device="cpu",example_batch_size=256):
+        """
+        Build a frozen, hook-free, eval-mode inference graph of the trained model and compile it. The graph is cached
+        and used by clean (output="clean") and anonymize (output="encode") when they are called with compiled=True.
+        Compile again after further training, train_model drops the cached graphs.
+
+        Args:
+            layout (ColumnLayout, optional): The column layout of the data. Defaults to the layout stored by train_model.
+            output (str, optional): "clean" for encoder, decoder and group-wise argmax, or "encode" for the encoder
+                                    only. Defaults to "clean".
+            backend (str, optional): "compile" (torch.compile), "torchscript" (trace and freeze), "eager", or "auto"
+                                     to use the first of them that works. Defaults to "auto".
+            precision (str, optional): "float32", or "bfloat16" to run the layers under autocast. Defaults to "float32".
+            device (str, optional): The device to compile for. Defaults to "cpu".
+            example_batch_size (int, optional): The batch size of the warmup input. Defaults to 256.
+
+        Returns:
+            The compiled graph, a callable mapping an input batch to cleaned rows or latent vectors.
+        """
+        layout = layout if layout is not None else self.layout
+        if (layout is None):
+            raise ValueError("compile_inference needs a layout, pass one or train the model first")
+        self.autocast(device,precision)     # Raises on an unsupported precision
+        self.eval()
+        self.to(device)
+        layout = layout.to(device)
+        graph = InferenceGraph(self, layout, output, precision)
+        input_width = layout.num_continous + layout.num_categorical if self.embeddings is not None else self.layers[0]
+        example_inputs = torch.zeros((example_batch_size, input_width), device=device)
+        compiled, backend = compile_graph(graph, example_inputs, backend)
+        self._inference_graphs[output] = {'graph': compiled, 'backend': backend, 'layout': layout,
+                                          'precision': precision, 'device': torch.device(device)}
+        return compiled
+
+    def export_onnx(self,path,layout=None,output="clean",opset_version=18):
+        """
+        Export the inference graph (see compile_inference) to ONNX, with a dynamic batch dimension. The column
+        layout and the graph output are stored in the model metadata, so AutoCleanse.onnx_backend.OnnxCleaner can
+        run and decode the model with onnxruntime, without PyTorch. Uses the TorchScript-based exporter, which
+        torch 2.1 ships, and requires the onnx package (pip install AutoCleanse[onnx]).
+
+        Args:
+            path (str): The path of the .onnx file.
+            layout (ColumnLayout, optional): The column layout of the data. Defaults to the layout stored by train_model.
+            output (str, optional): "clean" for encoder, decoder and group-wise argmax onehot, or "encode" for the
+                                    encoder only. Defaults to "clean".
+            opset_version (int, optional): The ONNX opset. Defaults to 18.
+
+        Returns:
+            None
+        """
+        try:
+            import onnx
+        except ImportError as e:
+            raise ImportError("Exporting to ONNX requires onnx, install it with 'pip install onnx onnxruntime'") from e
+        layout = layout if layout is not None else self.layout
+        if (layout is None):
+            raise ValueError("export_onnx needs a layout, pass one or train the model first")
+        self.eval()
+        self.to("cpu")
+        layout = layout.to("cpu")
+        graph = InferenceGraph(self, layout, output)
+        input_width = layout.num_continous + layout.num_categorical if self.embeddings is not None else self.layers[0]
+        example_inputs = torch.zeros((2, input_width))
+        # Newer torch defaults to the dynamo exporter, which torch 2.1 does not have
+        exporter = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+        try:
+            torch.onnx.export(graph, (example_inputs,), path, input_names=["input"], output_names=["output"],
+                              dynamic_axes={"input": {0: "batch"}, "output": {0: "batch"}}, opset_version=opset_version,
+                              **exporter)
+            model = onnx.load(path)
+            onnx.helper.set_model_props(model, {'autocleanse_output': output,
+                                                'autocleanse_input_width': str(input_width),
+                                                'autocleanse_layout': layout.to_json()})
+            onnx.save(model, path)
+        except Exception as e:
+            raise RuntimeError(f"Failed exporting {path} to ONNX") from e
+        print(f'Exported {output} graph to {path}')
+
+    def _inference_graph(self,output,layout,precision,device):
+        # Reuses the cached graph when it was compiled for the same layout, precision and device
+        cached = self._inference_graphs.get(output)
+        if (cached is not None and cached['layout'] == layout and cached['precision'] == precision
+                and cached['device'] == torch.device(device)):
+            return cached['graph']
+        return self.compile_inference(layout=layout, output=output, precision=precision, device=device)
+
+    def clean(self,dirty_loader,df,batch_size,onehotencoder=None,scaler=None,device="cpu",\
+              og_columns=None,continous_columns=None,categorical_columns=None,test_loader=None,progress=True,layout=None,precision="float32",compiled=False,profiler=None):
         """
         Clean the test data using the trained model and return the cleaned data.
 
+        The model outputs of all rows and the decoded DataFrame are held in memory, also when dirty_loader reads a
+        MemmapDataset, so memory grows with the table size. Tables larger than memory are cleaned in bounded memory
+        chunk by chunk with AutoCleanse.stream.clean_csv.
+
         Parameters:
             df (DataFrame): The dataframe to be cleaned.
             dirty_loader (DataLoader): The DataLoader for the dirty data. Dirty data is data that actually need to be cleaned.
             test_loader (DataLoader): The DataLoader for the test data. Test data is the original clean version of dirty data. 
                                       This is only used to test the performance of the model agaisnt artificial dirty data.
+                                      Only its dataset is used, its rows are matched to the dirty rows by index.
             batch_size (int): The batch size for processing the data.
-            onehotencoder (OneHotEncoder): The one-hot encoder for categorical columns.
+            onehotencoder (OneHotEncoder, optional): The one-hot encoder for categorical columns. Only needed when neither
+                                                     layout nor the layout stored by train_model is available.
             scaler (Scaler): The scaler for continuous columns.
             device (str): The device to be used for processing (e.g., 'cpu' or 'cuda').
-            og_columns (List): The original columns of the test dataset.
+            og_columns (List, optional): The original columns of the test dataset. Defaults to the layout column order.
             continous_columns (List, optional): The list of continuous columns. Defaults to None.
             categorical_columns (List, optional): The list of categorical columns. Defaults to None.
+            progress (bool, optional): Whether to show the progress bar. Defaults to True.
+            layout (ColumnLayout, optional): The column layout of the data. Defaults to the layout stored by train_model.
+            precision (str, optional): "float32", or "bfloat16" to run the forward pass under autocast. Defaults to "float32".
+            compiled (bool, optional): Whether to run the compiled inference graph, see compile_inference. It is
+                                       compiled on first use unless compile_inference was called before. Defaults to False.
+            profiler (Profiler, optional): Collects per-phase timings and counters as one "clean" record, see
+                                           AutoCleanse.profiler. Defaults to None, no profiling.
 
         Returns:
             clean_data (DataFrame): The cleaned test data.
         """
         
+        profiler = profiler if profiler is not None else NULL_PROFILER
         self.eval()
         self.to(device)
-        clean_outputs = torch.empty(0, device=device)
+        if (layout is None):
+            layout = self.layout if self.layout is not None else ColumnLayout(continous_columns, categorical_columns, onehotencoder.categories_)
+        layout = layout.to(device)
+        continous_columns = list(layout.continous_columns)
+        categorical_columns = list(layout.categorical_columns)
+        og_columns = og_columns if og_columns is not None else continous_columns + categorical_columns
+        graph = self._inference_graph("clean", layout, precision, device) if compiled else None
+        # The clean rows are fetched by the indices of the dirty batches, so a shuffled dirty_loader stays aligned
+        datasets = () if test_loader is None else (test_loader.dataset,)
+        clean_progress = tqdm(iterate_full(dirty_loader,*datasets), desc=f'Clean progress', total=len(dirty_loader), position=0, leave=True, disable=not progress)
+
+        # Preallocated output covering every row of the dirty dataset, including a partial last batch
+        clean_outputs = torch.empty((len(dirty_loader.dataset),self.layers[0]), device=device)
+        MAE = torch.zeros((), device=device)
+        MSE = torch.zeros((), device=device)
+        with torch.inference_mode():
+            for inputs,indices in profiler.iterate(clean_progress):
+                with profiler.phase("to_device"):
+                    inputs_dirty = inputs[0].to(device)
+                # Decode straight into the output rows when the batch is a contiguous block of them
+                contiguous = len(indices) > 0 and bool((indices[1:] - indices[:-1] == 1).all())
+                if (graph is not None):
+                    with profiler.phase("forward"):
+                        outputs_final = graph(inputs_dirty)
+                    with profiler.phase("write_output"):
+                        if (contiguous):
+                            clean_outputs[int(indices[0]):int(indices[0])+len(indices)] = outputs_final
+                        else:
+                            clean_outputs[indices.to(device)] = outputs_final
+                else:
+                    with profiler.phase("forward"):
+                        with self.autocast(device,precision):
+                            outputs = self(inputs_dirty).float()
+
+                    with profiler.phase("argmax"):
+                        if (contiguous):
+                            outputs_final = clean_outputs[int(indices[0]):int(indices[0])+len(indices)]
+                        else:
+                            outputs_final = torch.empty_like(outputs)
+                        outputs_final[:,:len(continous_columns)] = outputs[:,:len(continous_columns)]
+                        if (len(categorical_columns)!=0):
+                            argmax(outputs[:,len(continous_columns):], layout=layout, out=outputs_final[:,len(continous_columns):])
+                    if (not contiguous):
+                        with profiler.phase("write_output"):
+                            clean_outputs[indices.to(device)] = outputs_final
+                profiler.count("batches")
+                profiler.count("rows", len(indices))
+
+                if (test_loader is not None):
+                    inputs_test = inputs[1].to(device)
+                    if (self.embeddings is not None):
+                        inputs_test = self.expand_codes(inputs_test)
+                    MAE += F.l1_loss(outputs_final,inputs_test,reduction='sum')
+                    MSE += F.mse_loss(outputs_final,inputs_test,reduction='sum')
+
         if (test_loader is not None):
-            clean_progress = tqdm(zip(dirty_loader,test_loader), desc=f'Clean progress', total=len(dirty_loader), position=0, leave=True)
-            MAE = torch.empty(0, device=device)
-            MSE = torch.empty(0, device=device)
-            with torch.no_grad():
-                for batch_dirty,batch_test in clean_progress:
-                    inputs_dirty,_ = batch_dirty
-                    inputs_test,_ = batch_test
-                    inputs_dirty = inputs_dirty.to(device)
-                    inputs_test = inputs_test.to(device)
-
-                    outputs = self(inputs_dirty)
-                    outputs_final = torch.empty(0, device=device)                
-                    if (continous_columns is not None and categorical_columns is not None):
-                        outputs_con = outputs[:,:len(continous_columns)]
-                        outputs_cat = outputs[:,len(continous_columns):]
-                        outputs_cat = argmax(outputs_cat, onehotencoder, continous_columns, categorical_columns, device)
-                        outputs_final = torch.cat((outputs_con,outputs_cat),dim=1)
-                    elif (continous_columns is None):                
-                        outputs_final = argmax(outputs, onehotencoder, continous_columns, categorical_columns, device)
-                    elif (categorical_columns is None):
-                        outputs_final = outputs
-
-                    clean_outputs = torch.cat((clean_outputs,outputs_final),dim=0)
-
-                    MAEloss = torch.unsqueeze(F.l1_loss(outputs_final,inputs_test),dim=0)
-                    MSEloss = torch.unsqueeze(F.mse_loss(outputs_final,inputs_test),dim=0)
-
-                    MAE = torch.cat((MAE,MAEloss),dim=0)
-                    MSE = torch.cat((MSE,MSEloss),dim=0)
-            MAEavg = torch.mean(MAE)
-            MSEavg = torch.mean(MSE)
+            MAEavg = MAE / clean_outputs.numel()
+            MSEavg = MSE / clean_outputs.numel()
             print(f'\nMAE: {MAEavg:.8f}')
             print(f'\nMSE: {MSEavg:.8f}')
-        else:
-            clean_progress = tqdm(dirty_loader, desc=f'Clean progress', total=len(dirty_loader), position=0, leave=True)            
-            with torch.no_grad():
-                for inputs,_ in clean_progress:
-                    inputs = inputs.to(device)
-                    outputs = self(inputs)
-                    if (continous_columns is not None and categorical_columns is not None):
-                        outputs_con = outputs[:,:len(continous_columns)]
-                        outputs_cat = outputs[:,len(continous_columns):]
-                        outputs_cat = argmax(outputs_cat, onehotencoder, continous_columns, categorical_columns, device)
-                        outputs_final = torch.cat((outputs_con,outputs_cat),dim=1)
-                    elif (continous_columns is None):                
-                        outputs_final = argmax(outputs, onehotencoder, continous_columns, categorical_columns, device)
-                    elif (categorical_columns is None):
-                        outputs_final = outputs
-                    clean_outputs = torch.cat((clean_outputs,outputs_final),dim=0)
-
-        clean_data = pd.DataFrame(clean_outputs.detach().cpu().numpy(),columns=df.columns,index=df.index[:(df.shape[0] // batch_size) * batch_size])
-        if (len(continous_columns)!=0 and len(categorical_columns)!=0):
-            decoded_cat_cols = pd.DataFrame(onehotencoder.inverse_transform(clean_data.iloc[:,len(continous_columns):]),index=clean_data.index,columns=categorical_columns)
-            decoded_con_cols = pd.DataFrame(scaler.inverse_transform(clean_data.iloc[:,:len(continous_columns)]),index=clean_data.index,columns=continous_columns).round(0)
-            clean_data = pd.concat([decoded_con_cols,decoded_cat_cols],axis=1).reindex(columns=og_columns)
-        elif (len(continous_columns)==0):
-            clean_data = pd.DataFrame(onehotencoder.inverse_transform(clean_data),index=clean_data.index,columns=categorical_columns)
-        elif (len(categorical_columns)==0):
-            clean_data = pd.DataFrame(scaler.inverse_transform(clean_data),index=clean_data.index,columns=continous_columns).round(0)
+
+        with profiler.phase("decode"):
+            clean_data = layout.decode(clean_outputs.detach().cpu().numpy(), scaler, df.index, og_columns)
+        profiler.end_record("clean")
         
         return clean_data
 
-    def anonymize(self,df,data_loader,batch_size,device):
+    def anonymize(self,df,data_loader,batch_size,device,precision="float32",compiled=False,layout=None,profiler=None):
         """
         Anonymizes input data using the encoder model and returns the anonymized data as a DataFrame.
 
@@ -330,23 +911,43 @@ class Autoencoder(nn.Module):
             test_loader (DataLoader): The data loader for the test data.
             batch_size (int): The batch size for processing the data.
             device (str): The device to be used for processing.
+            precision (str, optional): "float32", or "bfloat16" to run the encoder under autocast. Defaults to "float32".
+            compiled (bool, optional): Whether to run the compiled encoder graph, see compile_inference. Defaults to False.
+            layout (ColumnLayout, optional): The column layout of the data for compiled=True. Defaults to the layout
+                                             stored by train_model.
+            profiler (Profiler, optional): Collects per-phase timings and counters as one "anonymize" record, see
+                                           AutoCleanse.profiler. Defaults to None, no profiling.
 
         Returns:
             DataFrame: The anonymized data as a DataFrame.
         """
         
-        self.encoder.eval()
-        self.encoder.to(device)
-        anonymize_progress = tqdm(data_loader, desc=f'Anonymize progress', position=0, leave=True)
-
-        anonymized_outputs = torch.empty(0).to(device)
-        with torch.no_grad():
-            for inputs,_ in anonymize_progress:
-                inputs = inputs.to(device)
-                outputs = self.encoder(inputs)
-                anonymized_outputs = torch.cat((anonymized_outputs,outputs),dim=0)
+        profiler = profiler if profiler is not None else NULL_PROFILER
+        self.eval()
+        self.to(device)
+        graph = self._inference_graph("encode", layout if layout is not None else self.layout, precision, device) if compiled else None
+        anonymize_progress = tqdm(iterate_full(data_loader), desc=f'Anonymize progress', total=len(data_loader), position=0, leave=True)
+
+        # Preallocated output covering every row of the dataset, including a partial last batch
+        anonymized_outputs = torch.empty((len(data_loader.dataset),self.layers[-1]), device=device)
+        with torch.inference_mode():
+            for inputs,indices in profiler.iterate(anonymize_progress):
+                with profiler.phase("to_device"):
+                    inputs = inputs[0].to(device)
+                with profiler.phase("forward"):
+                    if (graph is not None):
+                        outputs = graph(inputs)
+                    else:
+                        with self.autocast(device,precision):
+                            outputs = self.encode(inputs).float()
+                with profiler.phase("write_output"):
+                    anonymized_outputs[indices.to(device)] = outputs
+                profiler.count("batches")
+                profiler.count("rows", len(indices))
         
-        anonymized_data = pd.DataFrame(anonymized_outputs.detach().cpu().numpy(),index=df.index[:(df.shape[0] // batch_size) * batch_size])
+        with profiler.phase("decode"):
+            anonymized_data = pd.DataFrame(anonymized_outputs.detach().cpu().numpy(),index=df.index)
+        profiler.end_record("anonymize")
         return anonymized_data
 
 
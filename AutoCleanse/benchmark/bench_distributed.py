@@ -0,0 +1,47 @@
+import argparse
+import torch
+from AutoCleanse.autoencoder import Autoencoder
+from AutoCleanse.distributed import train_distributed
+from AutoCleanse.benchmark.common import *
+
+# Scaling of data-parallel training over local processes on the adult dataset:
+#   python -m AutoCleanse.benchmark.bench_distributed --processes 1,2,4,8,16 --output distributed.json
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=str, default='1,2,4,8,16')
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=512)
+    parser.add_argument('--layers', type=str, default='1024,128', help='Hidden layer sizes')
+    parser.add_argument('--threads-per-process', type=int, default=None)
+    parser.add_argument('--output', type=str, default=None, help='Optional json file for the results')
+    args = parser.parse_args()
+
+    data = prepare_adult(args.batch_size)
+    layout = data['preprocessor'].layout
+    num_train = len(data['datasets']['train'])
+    layers = [layout.num_features] + [int(size) for size in args.layers.split(',')]
+
+    results = []
+    for num_processes in (int(n) for n in args.processes.split(',')):
+        seed_everything(42)
+        autoencoder = Autoencoder(layers=layers, dropout_enc=[(0,0.0)], dropout_dec=[(0,0.1)], batch_norm=True,
+                                  learning_rate=1e-3, weight_decay=1e-5)
+        with Timer() as train_timer:
+            train_distributed(autoencoder, num_processes, data['datasets']['train'], data['datasets']['val'],
+                              num_epochs=args.epochs, batch_size=args.batch_size, patience=args.epochs, layout=layout,
+                              wlc=(1,5), threads_per_process=args.threads_per_process)
+        autoencoder.load_state_dict(autoencoder.best_state_dict)
+        val_metrics, val_count = autoencoder._validate(data['val_loader'], torch.device("cpu"), (1,5), "float32")
+        val_loss, _, val_CEloss, val_MSEloss = (val_metrics / val_count).tolist()
+        results.append({'processes': num_processes,
+                        'train_samples_per_sec': num_train * args.epochs / train_timer.seconds,
+                        'val_loss': val_loss,
+                        'val_CE_loss': val_CEloss,
+                        'val_MSE_loss': val_MSEloss})
+
+    baseline = results[0]['train_samples_per_sec']
+    for row in results:
+        row['speedup'] = row['train_samples_per_sec'] / baseline
+    print_results(results)
+    if (args.output is not None):
+        write_results(results, args.output)
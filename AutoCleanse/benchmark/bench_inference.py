@@ -0,0 +1,90 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+import torch
+from AutoCleanse.autoencoder import Autoencoder
+from AutoCleanse.dataloader import PlainDataset, create_dataloader
+from AutoCleanse.benchmark.common import *
+
+def latency_ms(forward, inputs, runs):
+    times = []
+    with torch.inference_mode():
+        for _ in range(10):
+            forward(inputs)
+        for _ in range(runs):
+            start = time.perf_counter()
+            forward(inputs)
+            times.append(time.perf_counter() - start)
+    return 1000 * float(np.median(times)), 1000 * float(np.percentile(times, 99))
+
+# Latency and throughput of clean/anonymize on the eager model and on the compiled inference graphs:
+#   python -m AutoCleanse.benchmark.bench_inference --backends eager,torchscript,compile --output inference.json
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', type=str, default='eager,torchscript,compile')
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--rows', type=int, default=100000, help='Rows cleaned for the throughput measurement')
+    parser.add_argument('--latency-runs', type=int, default=200, help='Single-row forward passes for the latency measurement')
+    parser.add_argument('--layers', type=str, default='1024,128', help='Hidden layer sizes')
+    parser.add_argument('--output', type=str, default=None, help='Optional json file for the results')
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    seed_everything(42)
+    data = prepare_adult(args.batch_size)
+    layout = data['preprocessor'].layout
+    layers = [layout.num_features] + [int(size) for size in args.layers.split(',')]
+    autoencoder = Autoencoder(layers=layers, dropout_enc=[(0,0.0)], dropout_dec=[(0,0.1)], batch_norm=True,
+                              learning_rate=1e-3, weight_decay=1e-5)
+    autoencoder.train_model(num_epochs=args.epochs, batch_size=args.batch_size, patience=args.epochs,
+                            train_loader=data['train_loader'], val_loader=data['val_loader'],
+                            device=device, wlc=(1,5), layout=layout)
+    autoencoder.load_state_dict(autoencoder.best_state_dict)
+
+    # Repeat the test set up to the requested number of rows
+    X_test = data['X_test']
+    X_rows = pd.concat([X_test] * (args.rows // len(X_test) + 1), ignore_index=True).iloc[:args.rows]
+    rows_loader = create_dataloader(PlainDataset(X_rows), batch_size=args.batch_size)
+    single_row = PlainDataset(X_test).data[:1]
+
+    results = []
+    for backend in args.backends.split(','):
+        with Timer() as compile_timer:
+            clean_graph = autoencoder.compile_inference(layout=layout, backend=backend, device=device)
+            autoencoder.compile_inference(layout=layout, output="encode", backend=backend, device=device)
+        with Timer() as clean_timer:
+            cleaned = autoencoder.clean(dirty_loader=rows_loader, df=X_rows, batch_size=args.batch_size,
+                                        scaler=data['preprocessor'].scaler, device=device, layout=layout,
+                                        progress=False, compiled=True)
+        with Timer() as anonymize_timer:
+            autoencoder.anonymize(df=X_rows, data_loader=rows_loader, batch_size=args.batch_size, device=device,
+                                  compiled=True, layout=layout)
+        median, p99 = latency_ms(clean_graph, single_row, args.latency_runs)
+        results.append({'backend': backend,
+                        'compile_seconds': compile_timer.seconds,
+                        'latency_ms_p50': median,
+                        'latency_ms_p99': p99,
+                        'clean_rows_per_sec': args.rows / clean_timer.seconds,
+                        'anonymize_rows_per_sec': args.rows / anonymize_timer.seconds})
+
+    # Reference: the uncompiled clean and anonymize paths
+    with Timer() as clean_timer:
+        reference = autoencoder.clean(dirty_loader=rows_loader, df=X_rows, batch_size=args.batch_size,
+                                      scaler=data['preprocessor'].scaler, device=device, layout=layout, progress=False)
+    with Timer() as anonymize_timer:
+        autoencoder.anonymize(df=X_rows, data_loader=rows_loader, batch_size=args.batch_size, device=device)
+    autoencoder.eval()
+    # Latency of the plain forward pass, without the argmax decode the graphs include
+    median, p99 = latency_ms(autoencoder, single_row, args.latency_runs)
+    results.insert(0, {'backend': 'model',
+                       'compile_seconds': 0.0,
+                       'latency_ms_p50': median,
+                       'latency_ms_p99': p99,
+                       'clean_rows_per_sec': args.rows / clean_timer.seconds,
+                       'anonymize_rows_per_sec': args.rows / anonymize_timer.seconds})
+
+    print_results(results)
+    if (args.output is not None):
+        write_results(results, args.output)
@@ -0,0 +1,73 @@
+import argparse
+import os
+import tempfile
+import pandas as pd
+import torch
+from AutoCleanse.autoencoder import Autoencoder
+from AutoCleanse.dataloader import PlainDataset, create_dataloader
+from AutoCleanse.onnx_backend import OnnxCleaner
+from AutoCleanse.benchmark.common import *
+
+# Clean/anonymize throughput of the PyTorch model against the exported ONNX model on onnxruntime:
+#   python -m AutoCleanse.benchmark.bench_onnx --threads 1,4 --output onnx.json
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=str, default='1', help='Intra-op thread counts to measure')
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--rows', type=int, default=100000, help='Rows cleaned for the throughput measurement')
+    parser.add_argument('--layers', type=str, default='1024,128', help='Hidden layer sizes')
+    parser.add_argument('--output', type=str, default=None, help='Optional json file for the results')
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    seed_everything(42)
+    data = prepare_adult(args.batch_size)
+    layout = data['preprocessor'].layout
+    scaler = data['preprocessor'].scaler
+    layers = [layout.num_features] + [int(size) for size in args.layers.split(',')]
+    autoencoder = Autoencoder(layers=layers, dropout_enc=[(0,0.0)], dropout_dec=[(0,0.1)], batch_norm=True,
+                              learning_rate=1e-3, weight_decay=1e-5)
+    autoencoder.train_model(num_epochs=args.epochs, batch_size=args.batch_size, patience=args.epochs,
+                            train_loader=data['train_loader'], val_loader=data['val_loader'],
+                            device=device, wlc=(1,5), layout=layout)
+    autoencoder.load_state_dict(autoencoder.best_state_dict)
+
+    # Repeat the test set up to the requested number of rows
+    X_test = data['X_test']
+    X_rows = pd.concat([X_test] * (args.rows // len(X_test) + 1), ignore_index=True).iloc[:args.rows]
+    rows_loader = create_dataloader(PlainDataset(X_rows), batch_size=args.batch_size)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        clean_path = os.path.join(directory, 'clean.onnx')
+        encode_path = os.path.join(directory, 'encode.onnx')
+        autoencoder.export_onnx(clean_path, layout=layout)
+        autoencoder.export_onnx(encode_path, layout=layout, output="encode")
+
+        for threads in (int(n) for n in args.threads.split(',')):
+            torch.set_num_threads(threads)
+            with Timer() as clean_timer:
+                reference = autoencoder.clean(dirty_loader=rows_loader, df=X_rows, batch_size=args.batch_size, scaler=scaler,
+                                              device=device, layout=layout, progress=False)
+            with Timer() as anonymize_timer:
+                autoencoder.anonymize(df=X_rows, data_loader=rows_loader, batch_size=args.batch_size, device=device)
+            results.append({'backend': 'torch', 'threads': threads,
+                            'clean_rows_per_sec': args.rows / clean_timer.seconds,
+                            'anonymize_rows_per_sec': args.rows / anonymize_timer.seconds,
+                            'clean_match_rate': 1.0})
+
+            clean_session = OnnxCleaner(clean_path, num_threads=threads)
+            encode_session = OnnxCleaner(encode_path, num_threads=threads)
+            with Timer() as clean_timer:
+                cleaned = clean_session.clean(X_rows, scaler, batch_size=args.batch_size, progress=False)
+            with Timer() as anonymize_timer:
+                encode_session.anonymize(X_rows, batch_size=args.batch_size, progress=False)
+            results.append({'backend': 'onnxruntime', 'threads': threads,
+                            'clean_rows_per_sec': args.rows / clean_timer.seconds,
+                            'anonymize_rows_per_sec': args.rows / anonymize_timer.seconds,
+                            'clean_match_rate': float((cleaned.astype(str).values == reference.astype(str).values).mean())})
+
+    print_results(results)
+    if (args.output is not None):
+        write_results(results, args.output)
@@ -0,0 +1,55 @@
+import argparse
+import joblib
+from contextlib import nullcontext
+from AutoCleanse.benchmark.common import *
+from AutoCleanse.benchmark.synthetic import synthetic_adult
+
+# Wall-clock time of Preprocessor.fit and transform_array with and without n_jobs on a wide synthetic table, the
+# categorical columns of adult repeated --copies times, checking that the outputs are identical:
+#   python -m AutoCleanse.benchmark.bench_parallel_preprocess --rows 200000 --copies 20 --n-jobs 4
+#   python -m AutoCleanse.benchmark.bench_parallel_preprocess --backend loky
+# fit uses threads by default, which share the blocks instead of pickling them. On one CPU (100k rows, 45 categorical
+# columns) n_jobs=2 gives no speedup: fit takes 0.81 s vs 0.75 s serial, 6.4 s with loky, mostly worker start-up and
+# pickling the blocks; transform_array 0.97 s vs 1.16 s. The gains need several cores.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--copies', type=int, default=10, help='Number of copies of every categorical column')
+    parser.add_argument('--n-jobs', type=int, default=os.cpu_count())
+    parser.add_argument('--block-size', type=int, default=8)
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--backend', type=str, default=None, help='joblib backend of fit, e.g. loky, threads by default')
+    parser.add_argument('--output', type=str, default=None, help='Optional json file for the results')
+    args = parser.parse_args()
+
+    df = synthetic_adult(args.rows, seed=42)
+    categorical_columns = []
+    for copy in range(args.copies):
+        for column in CATEGORICAL_COLUMNS:
+            df[f'{column}_{copy}'] = df[column]
+            categorical_columns.append(f'{column}_{copy}')
+    df = df[CONTINOUS_COLUMNS + categorical_columns]
+
+    results = []
+    outputs = {}
+    for n_jobs in (None, args.n_jobs):
+        preprocessor = Preprocessor(MinMaxScaler(), OneHotEncoder(sparse_output=False, handle_unknown='ignore'), seed=42)
+        with joblib.parallel_config(backend=args.backend) if args.backend is not None else nullcontext():
+            with Timer() as fit_timer:
+                preprocessor.fit(df, CONTINOUS_COLUMNS, categorical_columns, n_jobs=n_jobs, block_size=args.block_size)
+        with Timer() as transform_timer:
+            values, names = preprocessor.transform_array(df, CONTINOUS_COLUMNS, categorical_columns, n_jobs=n_jobs,
+                                                         chunk_size=args.chunk_size)
+        outputs[n_jobs] = (values, names)
+        results.append({'n_jobs': n_jobs or 1,
+                        'columns': len(categorical_columns),
+                        'features': len(names),
+                        'fit_s': fit_timer.seconds,
+                        'transform_s': transform_timer.seconds,
+                        'transform_rows_per_sec': args.rows / transform_timer.seconds})
+
+    (serial, serial_names), (parallel, parallel_names) = outputs.values()
+    assert serial_names == parallel_names and np.array_equal(serial, parallel), "parallel output differs"
+    print_results(results)
+    if (args.output is not None):
+        write_results(results, args.output)
@@ -0,0 +1,45 @@
+import argparse
+import torch
+from AutoCleanse.autoencoder import Autoencoder
+from AutoCleanse.benchmark.common import *
+
+# Compares float32 and bfloat16 autocast training and inference on the adult dataset:
+#   python -m AutoCleanse.benchmark.bench_precision --epochs 5 --output precision.json
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--layers', type=str, default='1024,128', help='Hidden layer sizes')
+    parser.add_argument('--output', type=str, default=None, help='Optional json file for the results')
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    data = prepare_adult(args.batch_size)
+    num_train = len(data['datasets']['train'])
+    num_test = len(data['datasets']['test'])
+    layers = [data['X_test'].shape[1]] + [int(size) for size in args.layers.split(',')]
+
+    results = []
+    for precision in ("float32", "bfloat16"):
+        seed_everything(42)
+        data['train_loader'].sampler.generator.manual_seed(42)
+        autoencoder = Autoencoder(layers=layers, dropout_enc=[(0,0.0)], dropout_dec=[(0,0.1)], batch_norm=True,
+                                  learning_rate=1e-3, weight_decay=1e-5)
+        with Timer() as train_timer:
+            autoencoder.train_model(num_epochs=args.epochs, batch_size=args.batch_size, patience=args.epochs,
+                                    train_loader=data['train_loader'], val_loader=data['val_loader'],
+                                    device=device, wlc=(1,5), layout=data['preprocessor'].layout, precision=precision)
+        autoencoder.load_state_dict(autoencoder.best_state_dict)
+        with Timer() as clean_timer:
+            df_cleaned = autoencoder.clean(dirty_loader=data['test_loader'], df=data['X_test'], batch_size=args.batch_size,
+                                           scaler=data['preprocessor'].scaler, device=device, progress=False, precision=precision)
+        exact_match, mae = reconstruction_error(data['df_test'], df_cleaned)
+        results.append({'precision': precision,
+                        'train_samples_per_sec': num_train * args.epochs / train_timer.seconds,
+                        'clean_rows_per_sec': num_test / clean_timer.seconds,
+                        'cat_exact_match': exact_match,
+                        'con_mae': mae})
+
+    print_results(results)
+    if (args.output is not None):
+        write_results(results, args.output)
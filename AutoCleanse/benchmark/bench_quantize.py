@@ -0,0 +1,54 @@
+import argparse
+import torch
+from AutoCleanse.autoencoder import Autoencoder
+from AutoCleanse.benchmark.common import *
+
+# Accuracy-vs-speed report of the int8 quantized model against the float model on the held-out adult test set:
+#   python -m AutoCleanse.benchmark.bench_quantize --epochs 5 --output quantize.json
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--repeats', type=int, default=5, help='Timed clean passes over the test set per model')
+    parser.add_argument('--layers', type=str, default='1024,128', help='Hidden layer sizes')
+    parser.add_argument('--output', type=str, default=None, help='Optional json file for the results')
+    args = parser.parse_args()
+
+    device = torch.device("cpu")
+    seed_everything(42)
+    data = prepare_adult(args.batch_size)
+    layout = data['preprocessor'].layout
+    layers = [layout.num_features] + [int(size) for size in args.layers.split(',')]
+    autoencoder = Autoencoder(layers=layers, dropout_enc=[(0,0.0)], dropout_dec=[(0,0.1)], batch_norm=True,
+                              learning_rate=1e-3, weight_decay=1e-5)
+    autoencoder.train_model(num_epochs=args.epochs, batch_size=args.batch_size, patience=args.epochs,
+                            train_loader=data['train_loader'], val_loader=data['val_loader'],
+                            device=device, wlc=(1,5), layout=layout)
+    autoencoder.load_state_dict(autoencoder.best_state_dict)
+    models = {'float32': autoencoder, 'int8': autoencoder.quantize()}
+
+    num_test = len(data['datasets']['test'])
+    cleaned = {}
+    results = []
+    for name, model in models.items():
+        with Timer() as clean_timer:
+            for _ in range(args.repeats):
+                cleaned[name] = model.clean(dirty_loader=data['test_loader'], df=data['X_test'], batch_size=args.batch_size,
+                                            scaler=data['preprocessor'].scaler, device=device, layout=layout, progress=False)
+        with Timer() as anonymize_timer:
+            for _ in range(args.repeats):
+                model.anonymize(df=data['X_test'], data_loader=data['test_loader'], batch_size=args.batch_size, device=device)
+        # Agreement with the float model, and reconstruction quality against the original data
+        match_float, mae_float = reconstruction_error(cleaned['float32'], cleaned[name])
+        match_original, mae_original = reconstruction_error(data['df_test'], cleaned[name])
+        results.append({'model': name,
+                        'clean_rows_per_sec': num_test * args.repeats / clean_timer.seconds,
+                        'anonymize_rows_per_sec': num_test * args.repeats / anonymize_timer.seconds,
+                        'cat_match_vs_float': match_float,
+                        'con_mae_vs_float': mae_float,
+                        'cat_match_vs_original': match_original,
+                        'con_mae_vs_original': mae_original})
+
+    print_results(results)
+    if (args.output is not None):
+        write_results(results, args.output)
@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import random
+import threading
+import numpy as np
+import pandas as pd
+import torch
+from sklearn.preprocessing import MinMaxScaler, OneHotEncoder
+from AutoCleanse.preprocessor import Preprocessor
+from AutoCleanse.dataloader import PlainDataset, create_dataloader
+
+ADULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dataset', 'adult.csv')
+CONTINOUS_COLUMNS = ['age','hours.per.week']
+CATEGORICAL_COLUMNS = ['workclass','education','education.num','marital.status','occupation','relationship','race','sex','native.country']
+
+def seed_everything(seed=42):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+def load_adult():
+    """
+     @brief Loads the bundled adult dataset with the columns used by the tutorial
+    """
+    df = pd.read_csv(ADULT_PATH)
+    return df[CONTINOUS_COLUMNS+CATEGORICAL_COLUMNS]
+
+def prepare_adult(batch_size, random_seed=42):
+    """
+     @brief Splits and preprocesses the adult dataset and builds the datasets and loaders used by the benchmarks
+     @param batch_size: Batch size of the loaders
+     @param random_seed: Seed of the split and the training shuffle
+    """
+    df = load_adult()
+    preprocessor = Preprocessor(MinMaxScaler(), OneHotEncoder(sparse_output=False, handle_unknown='ignore'))
+    df_train, df_val, df_test = preprocessor.split(df, 0.7, 0.15, 0.15, random_seed)
+    X_train = preprocessor.fit_transform(df_train.copy(), CONTINOUS_COLUMNS, CATEGORICAL_COLUMNS)
+    X_val = preprocessor.transform(df_val.copy(), CONTINOUS_COLUMNS, CATEGORICAL_COLUMNS)
+    X_test = preprocessor.transform(df_test.copy(), CONTINOUS_COLUMNS, CATEGORICAL_COLUMNS)
+    datasets = {'train': PlainDataset(X_train), 'val': PlainDataset(X_val), 'test': PlainDataset(X_test)}
+    generator = torch.Generator().manual_seed(random_seed)
+    return {
+        'preprocessor': preprocessor,
+        'df_test': df_test,
+        'X_test': X_test,
+        'datasets': datasets,
+        'train_loader': create_dataloader(datasets['train'], batch_size, shuffle=True, drop_last=True, generator=generator),
+        'val_loader': create_dataloader(datasets['val'], batch_size),
+        'test_loader': create_dataloader(datasets['test'], batch_size),
+    }
+
+def reconstruction_error(df_original, df_cleaned, continous_columns=CONTINOUS_COLUMNS, categorical_columns=CATEGORICAL_COLUMNS):
+    """
+     @brief Compares cleaned data with the original data
+     @return Categorical exact-match rate and continous mean absolute error
+    """
+    df_cleaned = df_cleaned.loc[df_original.index]
+    exact_match = float(np.mean([(df_original[column].astype(str).values == df_cleaned[column].astype(str).values).mean()
+                                 for column in categorical_columns]))
+    mae = float(np.mean(np.abs(df_original[continous_columns].values.astype(float) - df_cleaned[continous_columns].values.astype(float))))
+    return exact_match, mae
+
+class Timer():
+    """
+     @brief Context manager measuring wall-clock seconds
+    """
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds = time.perf_counter() - self.start
+
+def current_rss():
+    """
+     @brief Resident set size of this process in bytes, read from /proc on Linux. Elsewhere falls back to the
+            peak resident set size of the process so far
+    """
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class PeakMemory():
+    """
+     @brief Context manager measuring the peak resident set size of the process by sampling it on a background
+            thread, and on CUDA devices the peak allocation of PyTorch
+     @param device: The device whose CUDA peak allocation is measured
+     @param interval: Seconds between two samples
+    """
+    def __init__(self, device="cpu", interval=0.005):
+        self.device = torch.device(device)
+        self.interval = interval
+
+    def _sample(self):
+        while (not self._stop.wait(self.interval)):
+            self.peak_bytes = max(self.peak_bytes, current_rss())
+
+    def __enter__(self):
+        if (self.device.type == "cuda"):
+            torch.cuda.reset_peak_memory_stats(self.device)
+        self.start_bytes = current_rss()
+        self.peak_bytes = self.start_bytes
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, current_rss())
+        self.peak_rss_mb = self.peak_bytes / 2**20
+        self.peak_delta_mb = (self.peak_bytes - self.start_bytes) / 2**20
+        self.peak_cuda_mb = torch.cuda.max_memory_allocated(self.device) / 2**20 if self.device.type == "cuda" else None
+
+def print_results(results):
+    columns = list(results[0].keys())
+    print(" | ".join(f"{column:>16}" for column in columns))
+    for row in results:
+        print(" | ".join(f"{row[column]:>16.6g}" if isinstance(row[column], float) else f"{str(row[column]):>16}" for column in columns))
+
+def write_results(results, path):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f"Saved results to {path}")
@@ -0,0 +1,188 @@
+import gc
+import argparse
+import datetime
+import platform
+import subprocess
+import torch
+from AutoCleanse.autoencoder import Autoencoder
+from AutoCleanse.loss_model import loss_CEMSE
+from AutoCleanse.profiler import Profiler
+from AutoCleanse.utils import argmax
+from AutoCleanse.benchmark.common import *
+from AutoCleanse.benchmark.synthetic import synthetic_adult
+
+# Throughput and peak memory of the hot paths (preprocessing, loading, loss, argmax, training, clean, anonymize) on
+# synthetic tables shaped like adult.csv, written to json so runs on different commits can be compared:
+#   python -m AutoCleanse.benchmark.suite --rows 10000,100000 --output before.json
+#   python -m AutoCleanse.benchmark.suite --rows 10000,100000 --output after.json --compare before.json
+# The Preprocessor builds dense float64 frames, 1M rows need a few GB of memory and 10M rows tens of GB.
+
+TRAIN_PHASES = ("data", "to_device", "forward", "loss", "backward", "optimizer")
+
+def git_commit():
+    """
+     @brief The commit of the working tree and whether it has uncommitted changes, None outside a git checkout
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True, check=True).stdout.strip() != ''
+        return {'commit': commit, 'dirty': dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def measure(results, num_rows, phase, function, device, rows=None):
+    """
+     @brief Runs function once, appending its wall-clock time, throughput and peak memory to results
+     @param rows: Number of rows processed by function, defaults to num_rows
+     @return The return value of function
+    """
+    gc.collect()
+    with PeakMemory(device) as memory:
+        with Timer() as timer:
+            output = function()
+            if (device.type == "cuda"):
+                torch.cuda.synchronize(device)
+    rows = rows if rows is not None else num_rows
+    result = {'rows': num_rows,
+              'phase': phase,
+              'seconds': timer.seconds,
+              'rows_per_sec': rows / timer.seconds,
+              'peak_rss_mb': memory.peak_rss_mb,
+              'peak_delta_mb': memory.peak_delta_mb}
+    if (memory.peak_cuda_mb is not None):
+        result['peak_cuda_mb'] = memory.peak_cuda_mb
+    results.append(result)
+    return output
+
+def run_size(num_rows, args, device):
+    """
+     @brief Benchmarks every phase on one synthetic table
+     @return List of result dicts, one per phase
+    """
+    results = []
+    seed_everything(args.seed)
+    df = synthetic_adult(num_rows, seed=args.seed)
+    preprocessor = Preprocessor(MinMaxScaler(), OneHotEncoder(sparse_output=False, handle_unknown='ignore'))
+
+    df_copy = df.copy()
+    measure(results, num_rows, 'preprocess_fit_transform',
+            lambda: preprocessor.fit_transform(df_copy, CONTINOUS_COLUMNS, CATEGORICAL_COLUMNS), device)
+    df_copy = df.copy()
+    X = measure(results, num_rows, 'preprocess_transform',
+                lambda: preprocessor.transform(df_copy, CONTINOUS_COLUMNS, CATEGORICAL_COLUMNS), device)
+    # Straight into one float32 array, without copying or modifying df
+    measure(results, num_rows, 'preprocess_transform_array',
+            lambda: preprocessor.transform_array(df, CONTINOUS_COLUMNS, CATEGORICAL_COLUMNS), device)
+    del df, df_copy
+    layout = preprocessor.layout.to(device)
+
+    dataset = measure(results, num_rows, 'plain_dataset', lambda: PlainDataset(X), device)
+    loader = create_dataloader(dataset, args.batch_size, shuffle=True, generator=torch.Generator().manual_seed(args.seed))
+    measure(results, num_rows, 'dataloader', lambda: [inputs.to(device) for inputs, _ in loader][-1], device)
+
+    # Fixed random model outputs, so only the loss and the argmax are timed
+    outputs = torch.randn((args.batch_size, layout.num_features), device=device)
+    def compute_loss():
+        for start in range(0, num_rows, args.batch_size):
+            inputs = dataset.data[start:start + args.batch_size].to(device)
+            CEloss, MSEloss = loss_CEMSE(inputs, outputs[:inputs.shape[0]], layout=layout)
+        return CEloss + MSEloss
+    measure(results, num_rows, 'loss_CEMSE', compute_loss, device)
+    logits = outputs[:, layout.num_continous:].contiguous()
+    onehot = torch.empty_like(logits)
+    def compute_argmax():
+        for start in range(0, num_rows, args.batch_size):
+            batch_rows = min(args.batch_size, num_rows - start)
+            argmax(logits[:batch_rows], layout=layout, out=onehot[:batch_rows])
+        return onehot
+    measure(results, num_rows, 'argmax', compute_argmax, device)
+
+    # One training epoch on 90% of the rows, validating on the rest
+    num_train = int(num_rows * 0.9)
+    train_loader = create_dataloader(PlainDataset(dataset.data[:num_train]), args.batch_size, shuffle=True, drop_last=True,
+                                     generator=torch.Generator().manual_seed(args.seed))
+    val_loader = create_dataloader(PlainDataset(dataset.data[num_train:]), args.batch_size)
+    layers = [layout.num_features] + [int(size) for size in args.layers.split(',')]
+    autoencoder = Autoencoder(layers=layers, dropout_enc=[(0,0.0)], dropout_dec=[(0,0.1)], batch_norm=True,
+                              learning_rate=1e-3, weight_decay=1e-5)
+    profiler = Profiler()
+    measure(results, num_rows, 'train_epoch',
+            lambda: autoencoder.train_model(num_epochs=1, batch_size=args.batch_size, patience=1, train_loader=train_loader,
+                                            val_loader=val_loader, device=device, wlc=(1,5), layout=layout,
+                                            precision=args.precision, profiler=profiler),
+            device, rows=num_train)
+    phases = profiler.records[-1]['phases']
+    results[-1]['train_rows_per_sec'] = num_train / sum(phases[name]['total_s'] for name in TRAIN_PHASES if name in phases)
+    results[-1]['phases'] = {name: stats['total_s'] for name, stats in phases.items()}
+
+    full_loader = create_dataloader(dataset, args.batch_size)
+    measure(results, num_rows, 'clean',
+            lambda: autoencoder.clean(dirty_loader=full_loader, df=X, batch_size=args.batch_size, scaler=preprocessor.scaler,
+                                      device=device, layout=layout, progress=False, precision=args.precision),
+            device)
+    measure(results, num_rows, 'anonymize',
+            lambda: autoencoder.anonymize(df=X, data_loader=full_loader, batch_size=args.batch_size, device=device,
+                                          precision=args.precision),
+            device)
+    return results
+
+def compare(results, baseline_path):
+    """
+     @brief Prints the throughput of every (rows, phase) next to the one of a previous run of the suite
+    """
+    with open(baseline_path) as file:
+        baseline = {(result['rows'], result['phase']): result for result in json.load(file)['results']}
+    rows = []
+    for result in results:
+        previous = baseline.get((result['rows'], result['phase']))
+        if (previous is None or 'rows_per_sec' not in result):
+            continue
+        rows.append({'rows': result['rows'],
+                     'phase': result['phase'],
+                     'baseline_rows_s': previous['rows_per_sec'],
+                     'rows_s': result['rows_per_sec'],
+                     'speedup': result['rows_per_sec'] / previous['rows_per_sec'],
+                     'peak_delta_mb': result['peak_delta_mb'] - previous['peak_delta_mb']})
+    if (rows):
+        print(f"\nCompared with {baseline_path}")
+        print_results(rows)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=str, default='10000,100000,1000000,10000000', help='Comma separated table sizes')
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--layers', type=str, default='1024,128', help='Hidden layer sizes')
+    parser.add_argument('--precision', type=str, default='float32', choices=['float32', 'bfloat16'])
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', type=str, default='benchmark_suite.json', help='json file for the results')
+    parser.add_argument('--compare', type=str, default=None, help='json file of a previous run to compare with')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    report = {
+        'meta': {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                 'git': git_commit(),
+                 'python': platform.python_version(),
+                 'torch': torch.__version__,
+                 'platform': platform.platform(),
+                 'cpu_count': os.cpu_count(),
+                 'torch_threads': torch.get_num_threads(),
+                 'args': vars(args)},
+        'results': [],
+    }
+    for num_rows in [int(size) for size in args.rows.split(',')]:
+        try:
+            report['results'] += run_size(num_rows, args, device)
+        except MemoryError as e:
+            print(f"Out of memory at {num_rows} rows, skipping the larger sizes")
+            report['results'].append({'rows': num_rows, 'phase': 'error', 'error': repr(e)})
+            break
+        # Rewritten after every size, so a run killed at a large size keeps the smaller ones
+        write_results(report, args.output)
+
+    print_results([{key: result.get(key) for key in ('rows', 'phase', 'seconds', 'rows_per_sec', 'peak_delta_mb')}
+                   for result in report['results']])
+    write_results(report, args.output)
+    if (args.compare is not None):
+        compare(report['results'], args.compare)
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+from AutoCleanse.benchmark.common import load_adult, CONTINOUS_COLUMNS, CATEGORICAL_COLUMNS
+
+def synthetic_adult(num_rows, seed=42, nan_ratio=0.0):
+    """
+     @brief Builds a table shaped like the adult dataset at any size: rows are drawn with replacement from
+            adult.csv, so the columns, dtypes, category sets and their joint frequencies match, and the continous
+            columns get a small integer jitter within their observed range
+     @param num_rows: Number of rows of the table
+     @param seed: Seed of the sampling
+     @param nan_ratio: Share of the cells of every column set to NaN, like dirty data
+     @return DataFrame with CONTINOUS_COLUMNS followed by CATEGORICAL_COLUMNS and a RangeIndex
+    """
+    adult = load_adult()
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(adult), size=num_rows)
+    columns = {}
+    for column in CONTINOUS_COLUMNS:
+        values = adult[column].to_numpy()
+        jittered = values[rows] + rng.integers(-2, 3, size=num_rows)
+        columns[column] = np.clip(jittered, values.min(), values.max()).astype(values.dtype)
+    for column in CATEGORICAL_COLUMNS:
+        # Object columns index the same string objects, so large tables do not copy the strings
+        columns[column] = adult[column].to_numpy()[rows]
+    df = pd.DataFrame(columns)
+    if (nan_ratio > 0):
+        for column in df.columns:
+            mask = rng.random(num_rows) < nan_ratio
+            if (mask.any()):
+                df[column] = df[column].astype(float if column in CONTINOUS_COLUMNS else object)
+                df.loc[mask, column] = np.nan
+    return df
@@ -0,0 +1,125 @@
+import io
+import os
+import random
+import threading
+import numpy as np
+import torch
+from AutoCleanse.bucketfs_client import bucketfs_client
+
+def snapshot_state_dict(state, device="cpu"):
+    """
+     @brief Copies every tensor of a (nested) state dict, so later in-place updates of the model or optimizer
+            do not change the snapshot
+     @param state: A state dict, or any nesting of dicts, lists and tuples holding tensors
+     @param device: The device the copies are placed on
+    """
+    if (isinstance(state, torch.Tensor)):
+        return state.detach().to(device, copy=True)
+    if (isinstance(state, dict)):
+        return type(state)((key, snapshot_state_dict(value, device)) for key, value in state.items())
+    if (isinstance(state, (list, tuple))):
+        return type(state)(snapshot_state_dict(value, device) for value in state)
+    return state
+
+def get_rng_state(generator=None):
+    """
+     @brief Collects the state of every random number generator used during training
+     @param generator: Optional torch.Generator of the training loader
+    """
+    state = {
+        'torch': torch.get_rng_state(),
+        'numpy': np.random.get_state(),
+        'random': random.getstate(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+        'generator': generator.get_state() if generator is not None else None,
+    }
+    return state
+
+def set_rng_state(state, generator=None):
+    """
+     @brief Restores the random number generators from get_rng_state
+     @param state: The state returned by get_rng_state
+     @param generator: Optional torch.Generator of the training loader
+    """
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['random'])
+    if (state['cuda'] is not None and torch.cuda.is_available()):
+        torch.cuda.set_rng_state_all(state['cuda'])
+    if (state['generator'] is not None and generator is not None):
+        generator.set_state(state['generator'])
+
+class Checkpointer():
+    """
+        @brief Writes training checkpoints on a background thread, so training continues while the previous
+               checkpoint is serialized and uploaded. At most one write is in flight, a new save waits for it.
+        @param location: "local" or "bucketfs"
+        @param name: The checkpoint file name, stored under autoencoder/ in BucketFS
+    """
+    def __init__(self, location, name):
+        if (location not in ("local", "bucketfs")):
+            raise ValueError(f"Unsupported checkpoint location {location}, expected 'local' or 'bucketfs'")
+        self.location = location
+        self.name = name
+        self._thread = None
+        self._error = None
+
+    def save(self, checkpoint):
+        """
+         @brief Writes a checkpoint in the background. The checkpoint must already be a snapshot
+                (see snapshot_state_dict), it is not copied again
+         @param checkpoint: dict to save with torch.save
+        """
+        self.wait()
+        self._thread = threading.Thread(target=self._write, args=(checkpoint,))
+        self._thread.start()
+
+    def _write(self, checkpoint):
+        try:
+            buffer = io.BytesIO()
+            torch.save(checkpoint, buffer)
+            if (self.location=="bucketfs"):
+                bucketfs_client().upload(f'autoencoder/{self.name}', buffer)
+            else:
+                # Write next to the target and rename, so a crash mid-write keeps the previous checkpoint
+                temp_name = f'{self.name}.tmp'
+                with open(temp_name, 'wb') as file:
+                    file.write(buffer.getbuffer())
+                os.replace(temp_name, self.name)
+        except Exception as e:
+            self._error = e
+
+    def wait(self):
+        """
+         @brief Blocks until the pending write is done and raises its error, if any
+        """
+        if (self._thread is not None):
+            self._thread.join()
+            self._thread = None
+        if (self._error is not None):
+            error, self._error = self._error, None
+            raise RuntimeError(f"Failed saving checkpoint {self.name} to {self.location}") from error
+
+    def exists(self):
+        if (self.location=="bucketfs"):
+            return bucketfs_client().check(f'autoencoder/{self.name}')
+        return os.path.exists(self.name)
+
+    def load(self):
+        """
+         @brief Loads the checkpoint, waiting for a pending write first
+         @return The checkpoint dict, or None if there is no checkpoint yet
+        """
+        self.wait()
+        if (not self.exists()):
+            return None
+        try:
+            if (self.location=="bucketfs"):
+                buffer = bucketfs_client().download(f'autoencoder/{self.name}')
+            else:
+                with open(self.name, 'rb') as file:
+                    buffer = io.BytesIO(file.read())
+        except Exception as e:
+            raise RuntimeError(f"Failed loading checkpoint {self.name} from {self.location}") from e
+        # The checkpoint holds numpy and python RNG states besides tensors
+        return torch.load(buffer, weights_only=False)
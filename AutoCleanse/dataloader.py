@@ -1,33 +1,279 @@
 from torch.utils.data import Dataset
 from torch.utils.data import DataLoader
+from torch.utils.data import Sampler
 from torch.nn.utils.rnn import pad_sequence
+import json
+import numpy as np
+import pandas as pd
 import torch
 
+def to_tensor(data):
+    """
+     @brief Converts a preprocessed dataframe or array into one contiguous float32 tensor
+     @param data: A DataFrame, Series, numpy array or tensor
+    """
+    if torch.is_tensor(data):
+        return data.to(torch.float32).contiguous()
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        data = data.to_numpy(dtype=np.float32)
+    return torch.from_numpy(np.ascontiguousarray(data, dtype=np.float32))
+
 class PlainDataset(Dataset):
+    """
+     @brief Dataset backed by a single float32 tensor. Indexing with an int returns one row,
+            indexing with a slice or an index tensor returns a whole batch at once.
+     @param data: The preprocessed DataFrame
+    """
     def __init__(self, data):
-        self.data = data
+        self.columns = getattr(data, 'columns', None)
+        self.index = getattr(data, 'index', None)
+        self.data = to_tensor(data)
 
     def __len__(self):
         return len(self.data)
 
+    @property
+    def shape(self):
+        return tuple(self.data.shape)
+
     def __getitem__(self, idx):
-        data = self.data.iloc[idx].values
-        tensor_data = torch.stack([torch.tensor(item, dtype=torch.float32) for item in data])
-        return tensor_data, idx
+        if isinstance(idx, slice):
+            return self.data[idx], torch.arange(*idx.indices(len(self)))
+        return self.data[idx], idx
+
+def write_memmap(data, path, metadata=None):
+    """
+     @brief Writes a preprocessed matrix to a raw float32 file that MemmapDataset can map without loading it.
+            Column names and row index are stored next to it in <path>.json and <path>.index.npy
+     @param data: A preprocessed DataFrame, or an iterable of DataFrame chunks with identical columns,
+                  e.g. (preprocessor.transform(chunk, ...) for chunk in pd.read_csv(..., chunksize=...))
+     @param path: Path of the data file
+     @param metadata: Optional dict of extra layout information stored in the json, e.g. the continous
+                      and categorical column lists
+    """
+    if isinstance(data, pd.DataFrame):
+        data = [data]
+    columns = None
+    index_parts = []
+    num_rows = 0
+    with open(path, 'wb') as file:
+        for chunk in data:
+            if (columns is None):
+                columns = chunk.columns.to_list()
+            elif (chunk.columns.to_list() != columns):
+                raise ValueError(f"Chunk columns {chunk.columns.to_list()} do not match {columns}")
+            chunk.to_numpy(dtype=np.float32).tofile(file)
+            index_parts.append(chunk.index.to_numpy())
+            num_rows += len(chunk)
+    if (columns is None):
+        raise ValueError("No data to write")
+
+    np.save(f'{path}.index.npy', np.concatenate(index_parts), allow_pickle=True)
+    with open(f'{path}.json', 'w') as file:
+        json.dump({'shape': [num_rows, len(columns)],
+                   'dtype': 'float32',
+                   'columns': [str(column) for column in columns],
+                   'metadata': metadata or {}}, file)
+
+class MemmapDataset(PlainDataset):
+    """
+     @brief PlainDataset over a file written by write_memmap. The file is mapped copy-on-write, so batches
+            are read from disk on demand and sequential slices are zero-copy views of the mapping. Only the inputs
+            stay on disk, Autoencoder.clean and anonymize still build their outputs for all rows in memory
+     @param path: Path of the data file
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(f'{path}.json', 'r') as file:
+            info = json.load(file)
+        self.columns = pd.Index(info['columns'])
+        self.metadata = info['metadata']
+        self.index = pd.Index(np.load(f'{path}.index.npy', allow_pickle=True))
+        self._open(tuple(info['shape']))
+
+    def _open(self, shape):
+        if (shape[0] == 0):
+            self.data = torch.empty(shape, dtype=torch.float32)
+        else:
+            self.data = torch.from_numpy(np.memmap(self.path, dtype=np.float32, mode='c', shape=shape))
+
+    def __getstate__(self):
+        # Re-map the file in worker processes instead of pickling its content
+        state = self.__dict__.copy()
+        state['data'] = tuple(self.data.shape)
+        return state
+
+    def __setstate__(self, state):
+        shape = state.pop('data')
+        self.__dict__.update(state)
+        self._open(shape)
 
 class ClfDataset(Dataset):
+    """
+     @brief Dataset backed by float32 tensors for classifier inputs and targets
+     @param data: The preprocessed DataFrame
+     @param targets: The target DataFrame or Series
+    """
     def __init__(self, data, targets):
-        self.data = data
-        self.targets = targets
+        self.columns = getattr(data, 'columns', None)
+        self.index = getattr(data, 'index', None)
+        self.data = to_tensor(data)
+        self.targets = to_tensor(targets)
 
     def __len__(self):
         return len(self.data)
 
     def __getitem__(self, idx):
-        data = self.data.iloc[idx].values
-        target = self.targets.iloc[idx]
-        
-        tensor_data = torch.stack([torch.tensor(item, dtype=torch.float32) for item in data])
-        tensor_target = torch.tensor(target, dtype=torch.float32) 
-        
-        return tensor_data, tensor_target, idx
+        if isinstance(idx, slice):
+            return self.data[idx], self.targets[idx], torch.arange(*idx.indices(len(self)))
+        return self.data[idx], self.targets[idx], idx
+
+class TensorBatchSampler(Sampler):
+    """
+     @brief Yields whole batches instead of single indices: contiguous slices when not shuffling,
+            index tensors of a random permutation when shuffling. With num_replicas > 1 every rank gets
+            its own equally sized shard of the rows, like torch.utils.data.DistributedSampler
+     @param data_source: The dataset to sample from
+     @param batch_size: Number of rows per batch
+     @param shuffle: Whether to draw a new permutation every epoch
+     @param drop_last: Whether to drop the last incomplete batch
+     @param generator: Optional torch.Generator used for the permutation
+     @param num_replicas: Number of processes sharing the dataset
+     @param rank: Rank of this process among num_replicas
+     @param seed: Seed of the permutation shared by all ranks, combined with the epoch set by set_epoch
+    """
+    def __init__(self, data_source, batch_size, shuffle=False, drop_last=False, generator=None, num_replicas=1, rank=0, seed=0):
+        if (rank < 0 or rank >= num_replicas):
+            raise ValueError(f"Invalid rank {rank}, expected a value in [0, {num_replicas - 1}]")
+        self.data_source = data_source
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.generator = generator
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        """
+         @brief Sets the epoch used to seed the shared permutation when num_replicas > 1
+        """
+        self.epoch = epoch
+
+    def _num_shard_rows(self):
+        # Every rank gets the same number of rows, padding with repeated rows (or dropping the tail with drop_last)
+        num_rows = len(self.data_source)
+        if self.drop_last:
+            return num_rows // self.num_replicas
+        return (num_rows + self.num_replicas - 1) // self.num_replicas
+
+    def __len__(self):
+        num_rows = self._num_shard_rows() if self.num_replicas > 1 else len(self.data_source)
+        if self.drop_last:
+            return num_rows // self.batch_size
+        return (num_rows + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        if self.num_replicas > 1:
+            yield from self._iter_shard()
+            return
+        num_rows = len(self.data_source)
+        end = (num_rows // self.batch_size) * self.batch_size if self.drop_last else num_rows
+        if self.shuffle:
+            order = torch.randperm(num_rows, generator=self.generator)
+            for start in range(0, end, self.batch_size):
+                yield order[start:start + self.batch_size]
+        else:
+            for start in range(0, end, self.batch_size):
+                yield slice(start, min(start + self.batch_size, num_rows))
+
+    def _iter_shard(self):
+        num_rows = len(self.data_source)
+        shard_rows = self._num_shard_rows()
+        if self.shuffle:
+            order = torch.randperm(num_rows, generator=torch.Generator().manual_seed(self.seed + self.epoch))
+        else:
+            order = torch.arange(num_rows)
+        total_rows = shard_rows * self.num_replicas
+        if total_rows > num_rows:
+            order = torch.cat([order, order[:total_rows - num_rows]])
+        # Contiguous shards keep the rows of a rank in order when not shuffling
+        shard = order[self.rank * shard_rows:(self.rank + 1) * shard_rows]
+        end = (shard_rows // self.batch_size) * self.batch_size if self.drop_last else shard_rows
+        for start in range(0, end, self.batch_size):
+            yield shard[start:start + self.batch_size]
+
+def stratified_subsample(strata, size, generator=None):
+    """
+     @brief Draws a random subsample of rows that keeps the share of every stratum: the rows are shuffled,
+            sorted by stratum and every (rows / size)-th row is taken
+     @param strata: Integer tensor of shape [rows] or [rows, keys], rows are sorted by the key columns in order
+     @param size: Number of rows to draw
+     @param generator: Optional torch.Generator used for the shuffling
+     @return Sorted tensor of the drawn row indices
+    """
+    num_rows = strata.shape[0]
+    size = min(size, num_rows)
+    order = torch.randperm(num_rows, generator=generator)
+    keys = strata[order].reshape(num_rows, -1).cpu().numpy()
+    # np.lexsort is stable and sorts by its last key first
+    order = order[torch.from_numpy(np.lexsort(keys.T[::-1]))]
+    positions = torch.arange(size) * num_rows // size
+    return order[positions].sort().values
+
+def create_dataloader(dataset, batch_size, shuffle=False, drop_last=False, generator=None, **kwargs):
+    """
+     @brief Creates a DataLoader that fetches whole batches from a tensor-backed dataset,
+            skipping per-row __getitem__ calls and collation
+     @param dataset: A PlainDataset or ClfDataset
+     @param batch_size: Number of rows per batch
+     @param shuffle: Whether to shuffle every epoch
+     @param drop_last: Whether to drop the last incomplete batch
+     @param generator: Optional torch.Generator used for shuffling
+     @param kwargs: Additional DataLoader arguments, e.g. num_workers
+    """
+    sampler = TensorBatchSampler(dataset, batch_size, shuffle=shuffle, drop_last=drop_last, generator=generator)
+    return DataLoader(dataset, sampler=sampler, batch_size=None, **kwargs)
+
+def rebatch_dataloader(loader, batch_size):
+    """
+     @brief Creates a loader like one from create_dataloader, with the same dataset, shuffling, generator
+            and worker settings but another batch size
+     @param loader: A DataLoader created by create_dataloader
+     @param batch_size: Number of rows per batch of the new loader
+    """
+    sampler = loader.sampler
+    if (not isinstance(sampler, TensorBatchSampler)):
+        raise ValueError("Changing the batch size needs a loader created by create_dataloader")
+    return create_dataloader(loader.dataset, batch_size, shuffle=sampler.shuffle, drop_last=sampler.drop_last,
+                             generator=sampler.generator, num_workers=loader.num_workers, pin_memory=loader.pin_memory)
+
+def iterate_full(loader, *datasets):
+    """
+     @brief Iterates a data loader, then yields the rows it skipped (e.g. the tail dropped by drop_last), so every
+            row of its dataset is visited exactly once. The same rows of further datasets are fetched by index,
+            so they stay aligned with the loader's rows however it shuffles
+     @param loader: The data loader to iterate
+     @param datasets: Datasets of the same length as the loader's, e.g. the clean version of dirty data
+     @return Tuples of (list with the input batch of the loader and of every dataset, index tensor of the batch rows)
+    """
+    num_rows = len(loader.dataset)
+    visited = torch.zeros(num_rows, dtype=torch.bool)
+    batch_size = 1
+    for batch in loader:
+        indices = torch.as_tensor(batch[-1], dtype=torch.long).reshape(-1)
+        visited[indices] = True
+        batch_size = max(batch_size, len(indices))
+        yield [batch[0]] + _dataset_rows(datasets, indices), indices
+
+    missing = torch.nonzero(~visited).squeeze(1)
+    for start in range(0, len(missing), batch_size):
+        indices = missing[start:start + batch_size]
+        yield [loader.dataset[indices][0]] + _dataset_rows(datasets, indices), indices
+
+def _dataset_rows(datasets, indices):
+    # Contiguous rows are fetched as a slice, which is a view of tensor-backed datasets
+    if (len(datasets) != 0 and len(indices) > 0 and bool((indices[1:] - indices[:-1] == 1).all())):
+        indices = slice(int(indices[0]), int(indices[-1]) + 1)
+    return [dataset[indices][0] for dataset in datasets]
@@ -0,0 +1,167 @@
+import os
+import socket
+import tempfile
+import warnings
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from tqdm import tqdm
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+from AutoCleanse.dataloader import MemmapDataset, TensorBatchSampler, create_dataloader
+from AutoCleanse.checkpoint import snapshot_state_dict
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _worker(rank, world_size, port, autoencoder, train_dataset, val_dataset, config, result_path):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    torch.set_num_threads(config['threads_per_process'])
+    # The scheduler's marker on optimizer.step does not survive pickling, which only triggers a false order warning
+    warnings.filterwarnings("ignore", message="Seems like `optimizer.step\\(\\)` has been overridden")
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    try:
+        _train(rank, world_size, autoencoder, train_dataset, val_dataset, config, result_path)
+    finally:
+        dist.destroy_process_group()
+
+def _train(rank, world_size, autoencoder, train_dataset, val_dataset, config, result_path):
+    num_epochs, patience, wlc, precision = config['num_epochs'], config['patience'], config['wlc'], config['precision']
+    # Dropout differs per rank, the parameters are broadcast from rank 0 by DistributedDataParallel
+    torch.manual_seed(config['seed'] + rank)
+    device = torch.device("cpu")
+    autoencoder.wlc = wlc
+    autoencoder.layout = config['layout'].to(device)
+    autoencoder.train()
+    model = DistributedDataParallel(autoencoder)
+
+    sampler = TensorBatchSampler(train_dataset, config['batch_size'] // world_size, shuffle=True, drop_last=True,
+                                 num_replicas=world_size, rank=rank, seed=config['seed'])
+    train_loader = DataLoader(train_dataset, sampler=sampler, batch_size=None)
+    val_loader = create_dataloader(val_dataset, config['batch_size']) if rank == 0 else None
+
+    best_loss = float('inf')
+    counter = 0
+    stop = torch.zeros(1)
+    for epoch in range(num_epochs):
+        sampler.set_epoch(epoch)
+        train_progress = tqdm(train_loader, desc=f'Epoch [{epoch+1}/{num_epochs}], Training Progress',
+                              position=0, leave=True, disable=rank != 0)
+        running_metrics, running_sample_count = autoencoder._train_epoch(model, train_progress, device, wlc, precision)
+        running_metrics = torch.cat([running_metrics, torch.tensor([running_sample_count], dtype=running_metrics.dtype)])
+        dist.all_reduce(running_metrics)
+        train_progress.close()
+
+        if (rank == 0):
+            train_metrics = (running_metrics[:4] / running_metrics[4]).tolist()
+            val_progress = tqdm(val_loader, desc=f'Epoch [{epoch+1}/{num_epochs}], Validation Progress', position=0, leave=True)
+            val_running_metrics, val_running_sample_count = autoencoder._validate(val_progress, device, wlc, precision)
+            val_metrics = (val_running_metrics / val_running_sample_count).tolist()
+            val_progress.close()
+
+            # Check if validation loss has improved
+            if val_metrics[0] < best_loss - 0.001:
+                best_loss = val_metrics[0]
+                autoencoder.best_state_dict = snapshot_state_dict(autoencoder.state_dict())
+                counter = 0
+            else:
+                counter += 1
+            autoencoder._print_epoch(epoch, num_epochs, train_metrics, val_metrics)
+            stop[0] = float(counter >= patience)
+
+        # Update the learning rate
+        autoencoder.scheduler.step()
+        if (rank == 0):
+            print(f"Epoch [{epoch+1}/{num_epochs}]: Learning Rate = {autoencoder.scheduler.get_last_lr()}\n")
+
+        # Early stopping condition, decided by rank 0
+        dist.broadcast(stop, src=0)
+        if (stop.item()):
+            if (rank == 0):
+                print("Early stopping triggered. Stopping training.")
+            break
+
+    if (rank == 0):
+        # Written before Autoencoder.save, which loads best_state_dict into the model
+        torch.save({
+            'model': autoencoder.state_dict(),
+            'best_state_dict': autoencoder.best_state_dict,
+            'optimizer': autoencoder.optimizer.state_dict(),
+            'scheduler': autoencoder.scheduler.state_dict(),
+        }, result_path)
+        if (config['save_location'] is not None):
+            autoencoder.save(config['save_location'], config['save_name'])
+
+def train_distributed(autoencoder, num_processes, train_dataset, val_dataset, num_epochs, batch_size, patience, layout,
+                      wlc=(1,1), precision="float32", seed=42, threads_per_process=None, save_location=None, save_name=None):
+    """
+    Train an autoencoder with data parallelism over local CPU processes. Every process trains a replica on its
+    shard of the training set with batch_size // num_processes rows per step, and DistributedDataParallel all-reduces
+    (averages) the gradients over the gloo backend, so one optimizer step sees batch_size rows like train_model.
+    Rank 0 runs validation, early stopping and the optional save.
+
+    BatchNorm layers normalize every rank's batch_size // num_processes rows with that rank's own statistics, and
+    the running statistics of rank 0 are kept. nn.SyncBatchNorm only runs on GPU modules, so models with
+    batch_norm=True train like train_model with the smaller per-process batch, not exactly like the global batch.
+
+    Args:
+        autoencoder (Autoencoder): The model to train, updated in place with the trained weights, best_state_dict,
+                                   optimizer and scheduler state.
+        num_processes (int): The number of training processes.
+        train_dataset (PlainDataset): The training set. Its tensor is moved to shared memory instead of being copied
+                                      to every process.
+        val_dataset (PlainDataset): The validation set, only used by rank 0.
+        num_epochs (int): The number of epochs for training.
+        batch_size (int): The global batch size, split evenly over the processes. Must be a multiple of num_processes.
+        patience (int): The number of epochs to wait for improvement before stopping training.
+        layout (ColumnLayout): The column layout of the data, e.g. preprocessor.layout.
+        wlc (tuple, optional): The weighted loss coefficients for CE and MSE losses. Defaults to (1, 1).
+        precision (str, optional): "float32" or "bfloat16", see Autoencoder.train_model. Defaults to "float32".
+        seed (int, optional): Seed of the shared shuffling and of the per-rank dropout. Defaults to 42.
+        threads_per_process (int, optional): Intra-op threads of every process. Defaults to the cpu count divided by
+                                             num_processes.
+        save_location (str, optional): If given, rank 0 calls Autoencoder.save with this location at the end.
+        save_name (str, optional): The name passed to Autoencoder.save.
+
+    Returns:
+        None
+    """
+    if (batch_size < num_processes or batch_size % num_processes != 0):
+        raise ValueError(f"batch_size {batch_size} must be a positive multiple of num_processes {num_processes}, "
+                         f"so every optimizer step sees exactly batch_size rows")
+    if (threads_per_process is None):
+        threads_per_process = max(1, (os.cpu_count() or 1) // num_processes)
+    for dataset in (train_dataset, val_dataset):
+        if (not isinstance(dataset, MemmapDataset)):
+            dataset.data.share_memory_()
+
+    config = {
+        'num_epochs': num_epochs,
+        'batch_size': batch_size,
+        'patience': patience,
+        'layout': layout,
+        'wlc': wlc,
+        'precision': precision,
+        'seed': seed,
+        'threads_per_process': threads_per_process,
+        'save_location': save_location,
+        'save_name': save_name,
+    }
+    autoencoder.to("cpu")
+    # Compiled inference graphs are not picklable and are stale after training anyway
+    autoencoder._inference_graphs = {}
+    with tempfile.TemporaryDirectory() as directory:
+        result_path = os.path.join(directory, 'result.pth')
+        mp.spawn(_worker, args=(num_processes, _free_port(), autoencoder, train_dataset, val_dataset, config, result_path),
+                 nprocs=num_processes, join=True)
+        result = torch.load(result_path)
+
+    autoencoder.load_state_dict(result['model'])
+    autoencoder.optimizer.load_state_dict(result['optimizer'])
+    autoencoder.scheduler.load_state_dict(result['scheduler'])
+    autoencoder.best_state_dict = result['best_state_dict']
+    autoencoder.wlc = wlc
+    autoencoder.layout = layout
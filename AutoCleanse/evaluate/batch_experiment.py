@@ -1,28 +1,56 @@
-import subprocess
-import concurrent.futures
-from multiprocessing import Process
+import os
+import random
+import numpy as np
+import pandas as pd
+import torch
 
-def run_main(args):
-    formatted_args = [f"-l {args[0]}", f"-w {args[1]}"]
-    command = ["python", "AutoEncoder/main.py"] + formatted_args
-    with open(f"{args[0]}_{args[1]}.txt", "w") as log_file:
-        process = subprocess.Popen(command, stdout=log_file, stderr=subprocess.PIPE, text=True)
-        _, stderr = process.communicate()
-        if stderr:
-            print(f"Error occurred for args {args}: {stderr}")
+from AutoCleanse.preprocessor import *
+from AutoCleanse.dataloader import PlainDataset
+from AutoCleanse.sweep import sweep
+
+from sklearn.preprocessing import *
 
 if __name__ == "__main__":
-    # Define the list of argument sets
-    argument_sets = [
-        ["1024,128", "1,1"], 
-        ["1024,128", "1,5"],
-        ["1024,128", "1,20"],
-        ["1024,128", "1,40"],
-    ]
+    random_seed = 42
+    random.seed(random_seed)
+    np.random.seed(random_seed)
+    torch.manual_seed(random_seed)
+
+    df = pd.read_csv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dataset', 'adult.csv'))
+    continous_columns = ['age','hours.per.week']
+    categorical_columns = ['workclass','education','education.num','marital.status','occupation','relationship','race','sex','native.country']
+    X = df[continous_columns+categorical_columns]
 
-    # Create a list to hold the processes
-    processes = []
+    # Preprocess once, the sweep shares the resulting tensors with its workers
+    preprocessor = Preprocessor(MinMaxScaler(), OneHotEncoder(sparse_output=False, handle_unknown='ignore'))
+    X_train,X_val,X_test = preprocessor.split(df=X,
+                                              train_ratio=0.7,
+                                              val_ratio=0.15,
+                                              test_ratio=0.15,
+                                              random_seed=random_seed)
+    X_train = preprocessor.fit_transform(input_df=X_train,
+                                         continous_columns=continous_columns,
+                                         categorical_columns=categorical_columns)
+    X_val = preprocessor.transform(input_df=X_val,
+                                   continous_columns=continous_columns,
+                                   categorical_columns=categorical_columns)
+
+    # Define the list of configurations, (layers, wlc) like the former command line arguments
+    configs = [
+        {'layers': [1024,128], 'wlc': (1,1), 'dropout_dec': [(0,0.1)], 'learning_rate': 1e-3, 'weight_decay': 1e-5},
+        {'layers': [1024,128], 'wlc': (1,5), 'dropout_dec': [(0,0.1)], 'learning_rate': 1e-3, 'weight_decay': 1e-5},
+        {'layers': [1024,128], 'wlc': (1,20), 'dropout_dec': [(0,0.1)], 'learning_rate': 1e-3, 'weight_decay': 1e-5},
+        {'layers': [1024,128], 'wlc': (1,40), 'dropout_dec': [(0,0.1)], 'learning_rate': 1e-3, 'weight_decay': 1e-5},
+    ]
 
-    # Start a separate process for each set of arguments
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        executor.map(run_main, argument_sets)
\ No newline at end of file
+    results = sweep(configs,
+                    train_dataset=PlainDataset(X_train),
+                    val_dataset=PlainDataset(X_val),
+                    layout=preprocessor.layout,
+                    num_epochs=20,
+                    batch_size=256,
+                    min_epochs=5,
+                    reduction_factor=2,
+                    seed=random_seed)
+    print(results.to_string(index=False))
+    results.to_csv("batch_experiment.csv", index=False)
@@ -8,6 +8,7 @@ from exasol.bucketfs import Service
 from tqdm import tqdm
 from AutoCleanse.loss_model import loss_CEMSE
 from AutoCleanse.bucketfs_client import bucketfs_client
+from AutoCleanse.checkpoint import snapshot_state_dict
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
 from sklearn.dummy import DummyClassifier
 from sklearn.model_selection import cross_val_score, RepeatedStratifiedKFold
@@ -49,20 +50,48 @@ class ClsNNBase(nn.Module):
         self.scheduler = StepLR(self.optimizer, step_size=4, gamma=0.1)
         self.to(device)
 
-    def add_regularization_hook(self, module, input, output):
-        l1_reg = self.l1_strength * F.l1_loss(output, torch.zeros_like(output))
-        l2_reg = self.l2_strength * F.mse_loss(output, torch.zeros_like(output))
-        module.register_forward_hook(None)  
-        module._forward_hooks.clear()
-        return output + l1_reg + l2_reg 
+    def forward(self, x, return_penalty=False):
+        # The L1/L2 activation penalty of the hidden ReLUs is returned for the training loss, not kept on the module
+        if (not return_penalty):
+            return self.network(x)
+        if (self.training and (self.l1_strength != 0 or self.l2_strength != 0)):
+            return activation_penalty_forward(self.network, x, self.l1_strength, self.l2_strength)
+        return self.network(x), 0.0
+
+    def _evaluate(self,progress,device):
+        """
+         @brief Runs the model over a loader in eval and inference mode, keeping loss and predictions on the device
+         @param progress: The (tqdm wrapped) loader yielding inputs, targets and indices
+         @param device: can be "cpu" or "cuda"
+         @return Summed loss, predictions, targets and sample count
+        """
+        running_loss = torch.zeros((), device=device)
+        running_sample_count = 0
+        predictions = []
+        targets = []
+        was_training = self.training
+        self.eval()
+        with torch.inference_mode():
+            for inputs, target, _  in progress:
+                inputs = inputs.to(device)
+                outputs = self(inputs)
+                target = target.to(device)
 
-    def forward(self, x):
-        x = self.network(x)
-        return x
+                loss = nn.CrossEntropyLoss()(outputs,target)
+
+                # Metrics calculation
+                predictions.append((outputs >= 0.5).float())
+                targets.append(target)
+
+                running_loss += loss*inputs.shape[0]
+                running_sample_count += inputs.shape[0]
+        self.train(was_training)
+        return running_loss.item(), torch.cat(predictions).cpu().numpy(), torch.cat(targets).cpu().numpy(), running_sample_count
 
     def train_model(self,num_epochs,batch_size,patience,layers,train_loader,val_loader, \
                     continous_columns,categorical_columns,device):    
         best_loss = float('inf')        
+        self.train()
         optimizer = self.optimizer
         scheduler = self.scheduler
         counter = 0
@@ -70,33 +99,34 @@ class ClsNNBase(nn.Module):
         for epoch in range(num_epochs):
             train_progress = tqdm(train_loader, desc=f'Epoch [{epoch+1}/{num_epochs}], Training Progress', position=0, leave=True)
 
-            running_loss = 0.0
-            running_sample_count = 0.0
+            # Loss and predictions stay on the device and are read once per epoch
+            running_loss = torch.zeros((), device=device)
+            running_sample_count = 0
             train_predictions = []
             train_targets = []
             for inputs,target,_  in train_progress:
                 # Forward pass
                 inputs = inputs.to(device)
-                outputs = self(inputs)
+                outputs, penalty = self(inputs, return_penalty=True)
                 target = target.to(device)
 
                 loss = nn.CrossEntropyLoss()(outputs,target)
 
-                # Backward pass and optimization
+                # Backward pass and optimization, with the activation penalty of this forward pass
                 optimizer.zero_grad()
-                loss.backward()
+                (loss + penalty).backward()
                 optimizer.step()
 
                 # Metrics calculation
-                predictions = (outputs >= 0.5).float().cpu().numpy()
-                targets = target.cpu().numpy()
-                train_predictions.extend(predictions)
-                train_targets.extend(targets)
+                train_predictions.append((outputs.detach() >= 0.5).float())
+                train_targets.append(target)
 
-                running_loss += loss.item()*batch_size
+                running_loss += loss.detach()*inputs.shape[0]
                 running_sample_count += inputs.shape[0]
-            
-            average_loss = running_loss / running_sample_count      # Final loss: multiply by batch size then averaged over all samples
+
+            average_loss = running_loss.item() / running_sample_count
+            train_predictions = torch.cat(train_predictions).cpu().numpy()
+            train_targets = torch.cat(train_targets).cpu().numpy()
             train_accuracy = accuracy_score(train_targets, train_predictions)
             train_precision = precision_score(train_targets, train_predictions,average="macro")
             train_recall = recall_score(train_targets, train_predictions,average="macro")
@@ -109,26 +139,7 @@ class ClsNNBase(nn.Module):
             # Calculate validation loss
             val_progress = tqdm(val_loader, desc=f'Epoch [{epoch+1}/{num_epochs}], Validation Progress', position=0, leave=True)
 
-            val_running_loss = 0.0
-            val_running_sample_count = 0.0
-            val_predictions = []
-            val_targets = []
-            for val_inputs, val_target, _  in val_progress:
-                val_inputs = val_inputs.to(device)
-                val_outputs = self(val_inputs)
-                val_target = val_target.to(device)
-
-                val_loss = nn.CrossEntropyLoss()(val_outputs,val_target)
-
-                # Metrics calculation
-                predictions = (val_outputs >= 0.5).float().cpu().numpy()
-                targets = val_target.cpu().numpy()
-                val_predictions.extend(predictions)
-                val_targets.extend(targets)
-
-                val_running_loss += val_loss.item()*batch_size
-                val_running_sample_count += val_inputs.shape[0]
-
+            val_running_loss, val_predictions, val_targets, val_running_sample_count = self._evaluate(val_progress, device)
             val_avg_loss = val_running_loss / val_running_sample_count
             val_accuracy = accuracy_score(val_targets, val_predictions)
             val_precision = precision_score(val_targets, val_predictions,average="macro")
@@ -149,7 +160,7 @@ class ClsNNBase(nn.Module):
             # Check if validation loss has improved
             if val_avg_loss < best_loss - 0.001:
                 best_loss = val_avg_loss
-                self.best_state_dict = self.state_dict()
+                self.best_state_dict = snapshot_state_dict(self.state_dict(), device)
                 counter = 0
             else:
                 counter += 1
@@ -203,26 +214,7 @@ class ClsNNBase(nn.Module):
         self.eval()
         test_progress = tqdm(test_loader, desc=f'Test Progress', position=0, leave=True)
 
-        test_running_loss = 0.0
-        test_running_sample_count = 0.0
-        test_predictions = []
-        test_targets = []
-        for test_inputs, test_target, _  in test_progress:
-            test_inputs = test_inputs.to(device)
-            test_outputs = self(test_inputs)
-            test_target = test_target.to(device)
-
-            test_loss = nn.CrossEntropyLoss()(test_outputs,test_target)
-
-            # Metrics calculation
-            predictions = (test_outputs >= 0.5).float().cpu().numpy()
-            targets = test_target.cpu().numpy()
-            test_predictions.extend(predictions)
-            test_targets.extend(targets)
-
-            test_running_loss += test_loss.item()*batch_size
-            test_running_sample_count += test_inputs.shape[0]
-
+        test_running_loss, test_predictions, test_targets, test_running_sample_count = self._evaluate(test_progress, device)
         test_avg_loss = test_running_loss / test_running_sample_count
         test_accuracy = accuracy_score(test_targets, test_predictions)
         test_precision = precision_score(test_targets, test_predictions,average="macro")
@@ -6,7 +6,7 @@ from torchsummary import summary
 
 from AutoCleanse.preprocessor import *
 from AutoCleanse.utils import *
-from AutoCleanse.dataloader import ClfDataset, DataLoader
+from AutoCleanse.dataloader import ClfDataset, create_dataloader
 from AutoCleanse.evaluate.classifier import *
 
 from sklearn.preprocessing import *
@@ -87,22 +87,12 @@ test_dataset = ClfDataset(X_test,y_test)
 dirty_dataset = ClfDataset(X_dirty,y_dirty)
 cleaned_dataset = ClfDataset(X_cleaned,y_test)
 
-def custom_collate_fn(batch):
-    tensor_data = torch.stack([item[0] for item in batch])
-    # Check if tensor_targets are scalars or tensors
-    if torch.is_tensor(batch[0][1]):  
-        tensor_targets = torch.stack([item[1] for item in batch])
-    else:
-        tensor_targets = torch.tensor([item[1] for item in batch], dtype=torch.float32) 
-    indices = [item[2] for item in batch]
-    return tensor_data, tensor_targets, indices
-
 batch_size = 256
-train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, drop_last=True,collate_fn=custom_collate_fn)
-val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, drop_last=True, collate_fn=custom_collate_fn)
-test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False, drop_last=True, collate_fn=custom_collate_fn)
-dirty_loader = DataLoader(dirty_dataset, batch_size=batch_size, shuffle=False, drop_last=True, collate_fn=custom_collate_fn)
-cleaned_loader = DataLoader(cleaned_dataset, batch_size=batch_size, shuffle=False, drop_last=True, collate_fn=custom_collate_fn)                        
+train_loader = create_dataloader(train_dataset, batch_size=batch_size, shuffle=True, drop_last=True)
+val_loader = create_dataloader(val_dataset, batch_size=batch_size, shuffle=False, drop_last=True)
+test_loader = create_dataloader(test_dataset, batch_size=batch_size, shuffle=False, drop_last=True)
+dirty_loader = create_dataloader(dirty_dataset, batch_size=batch_size, shuffle=False, drop_last=True)
+cleaned_loader = create_dataloader(cleaned_dataset, batch_size=batch_size, shuffle=False, drop_last=True)
 
 layers = [X_train.shape[1],150,200,200,100,50]
         
@@ -0,0 +1,112 @@
+import copy
+import warnings
+from collections import OrderedDict
+import torch
+import torch.nn as nn
+from AutoCleanse.utils import group_argmax
+
+BACKENDS = ("auto", "compile", "torchscript", "eager")
+
+def _copy_without_hooks(module):
+    """
+     @brief Deep copies a module without the forward hooks of it and its submodules, which may reference the parent model
+    """
+    stashed = {}
+    for submodule in module.modules():
+        stashed[submodule] = (submodule._forward_hooks, submodule._forward_pre_hooks)
+        submodule._forward_hooks = OrderedDict()
+        submodule._forward_pre_hooks = OrderedDict()
+    try:
+        return copy.deepcopy(module)
+    finally:
+        for submodule, (hooks, pre_hooks) in stashed.items():
+            submodule._forward_hooks = hooks
+            submodule._forward_pre_hooks = pre_hooks
+
+class InferenceGraph(nn.Module):
+    """
+        @brief Frozen, hook-free, eval-mode copy of a trained Autoencoder for inference. With output="clean" it maps
+               a batch to cleaned rows: continous columns as decoded, categorical groups as onehot of their argmax.
+               With output="encode" it maps a batch to its latent representation.
+        @param autoencoder: The trained Autoencoder
+        @param layout: The ColumnLayout of the data, on the device of the autoencoder
+        @param output: "clean" or "encode"
+        @param precision: "float32", or "bfloat16" to run the layers under autocast
+    """
+    def __init__(self, autoencoder, layout, output="clean", precision="float32"):
+        super(InferenceGraph, self).__init__()
+        if (output not in ("clean", "encode")):
+            raise ValueError(f"Unsupported output {output}, expected 'clean' or 'encode'")
+        self.output = output
+        self.bfloat16 = precision == "bfloat16"
+        self.embeddings = _copy_without_hooks(autoencoder.embeddings) if autoencoder.embeddings is not None else None
+        self.encoder = _copy_without_hooks(autoencoder.encoder)
+        self.decoder = _copy_without_hooks(autoencoder.decoder) if output == "clean" else None
+        self.num_continous = layout.num_continous
+        self.num_categorical = layout.num_categorical
+        self.max_size = layout.max_size
+        self.padded = layout.pad_index is not None
+
+        device = layout.device
+        layout = layout.to("cpu")
+        self.register_buffer('group_ids', layout.group_ids.clone())
+        self.register_buffer('group_offsets', layout.group_offsets.clone())
+        self.register_buffer('pad_index', layout.pad_index.clone() if self.padded else torch.zeros(0, dtype=torch.long))
+        self.register_buffer('pad_rank', layout.pad_rank.clone() if self.padded else torch.zeros(0))
+        self.to(device)
+        self.eval()
+        self.requires_grad_(False)
+
+    def _embed(self, x):
+        codes = x[:, self.num_continous:].long()
+        embedded = [embedding(codes[:, i]) for i, embedding in enumerate(self.embeddings)]
+        return torch.cat([x[:, :self.num_continous]] + embedded, dim=1)
+
+    def _decode_categorical(self, logits):
+        first = group_argmax(logits, self.group_ids, self.group_offsets, self.num_categorical, self.max_size,
+                             self.pad_index if self.padded else None, self.pad_rank if self.padded else None)
+        return torch.zeros_like(logits).scatter_(1, first, 1)
+
+    def forward(self, x):
+        with torch.autocast(device_type=x.device.type, dtype=torch.bfloat16, enabled=self.bfloat16):
+            if (self.embeddings is not None):
+                x = self._embed(x)
+            x = self.encoder(x)
+            if (self.decoder is not None):
+                x = self.decoder(x)
+        x = x.float()
+        if (self.output == "encode" or self.num_categorical == 0):
+            return x
+        return torch.cat([x[:, :self.num_continous], self._decode_categorical(x[:, self.num_continous:])], dim=1)
+
+def compile_graph(graph, example_inputs, backend="auto"):
+    """
+     @brief Compiles an InferenceGraph. "compile" uses torch.compile with dynamic batch sizes and runs it once to
+            trigger compilation, "torchscript" traces and freezes the graph, "eager" keeps it as is. "auto" tries
+            torch.compile, then TorchScript, then eager.
+     @param graph: The InferenceGraph
+     @param example_inputs: An example input batch
+     @param backend: One of BACKENDS
+     @return The compiled graph and the name of the backend used
+    """
+    if (backend not in BACKENDS):
+        raise ValueError(f"Unsupported backend {backend}, expected one of {BACKENDS}")
+    candidates = ("compile", "torchscript", "eager") if backend == "auto" else (backend,)
+    for candidate in candidates:
+        try:
+            with torch.inference_mode():
+                if (candidate == "compile"):
+                    compiled = torch.compile(graph, dynamic=True)
+                elif (candidate == "torchscript"):
+                    with warnings.catch_warnings():
+                        warnings.simplefilter("ignore", FutureWarning)
+                        compiled = torch.jit.freeze(torch.jit.trace(graph, example_inputs, check_trace=False))
+                else:
+                    compiled = graph
+                # Warm up, this is where torch.compile actually compiles
+                compiled(example_inputs)
+            return compiled, candidate
+        except Exception as e:
+            if (backend != "auto"):
+                raise RuntimeError(f"Failed compiling the inference graph with {candidate}") from e
+            print(f"Warning: compiling the inference graph with {candidate} failed ({type(e).__name__}), trying the next backend")
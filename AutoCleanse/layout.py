@@ -0,0 +1,184 @@
+import json
+import numpy as np
+import pandas as pd
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+# Padded views of the categorical groups are used while they are at most this many times wider than the groups
+PAD_RATIO = 4
+_TENSOR_ATTRIBUTES = ('device', 'group_ids', 'group_offsets', 'sizes_tensor', 'max_size', 'pad_index', 'pad_rank')
+
+class ColumnLayout():
+    """
+        @brief Immutable description of a preprocessed row: continous columns first, followed by the onehot subcolumns
+               of every categorical column. It is built once from a fitted Preprocessor and shared by the loss, the
+               softmax/argmax decode and Autoencoder.clean, so the hot paths do not recompute group sizes per batch.
+        @param continous_columns: A list of continous column names
+        @param categorical_columns: A list of categorical column names
+        @param categories: The categories of every categorical column, one per onehot subcolumn
+        @param device: The device the index tensors are created on
+    """
+    def __init__(self, continous_columns=None, categorical_columns=None, categories=None, device="cpu"):
+        continous_columns = tuple(continous_columns) if continous_columns is not None else ()
+        categorical_columns = tuple(categorical_columns) if categorical_columns is not None else ()
+        categories = tuple(np.asarray(categories[i]) for i in range(len(categorical_columns)))
+        sizes = tuple(len(category) for category in categories)
+
+        state = {
+            'continous_columns': continous_columns,
+            'categorical_columns': categorical_columns,
+            'categories': categories,
+            'num_continous': len(continous_columns),
+            'num_categorical': len(categorical_columns),
+            'sizes': sizes,
+            'num_features': len(continous_columns) + sum(sizes),
+            # Start of every categorical group relative to the whole row
+            'offsets': tuple(len(continous_columns) + int(offset) for offset in np.cumsum((0,) + sizes[:-1])) if sizes else (),
+        }
+        self.__dict__.update(state)
+        self._build_tensors(device)
+
+    @classmethod
+    def from_preprocessor(cls, preprocessor, continous_columns=None, categorical_columns=None, device="cpu"):
+        """
+         @brief Builds the layout of the output of a fitted preprocessor. Onehot subcolumns the preprocessor drops
+                (NaN categories, categories dropped by the encoder) are left out of the groups.
+         @param preprocessor: The fitted Preprocessor
+         @param continous_columns: A list of continous column names
+         @param categorical_columns: A list of categorical column names
+         @param device: The device the index tensors are created on
+        """
+        categories = []
+        if (categorical_columns is not None and len(categorical_columns) != 0):
+            feature_names = set(preprocessor.encoder.get_feature_names_out(categorical_columns))
+            for column, column_categories in zip(categorical_columns, preprocessor.encoder.categories_):
+                kept = [f"{column}_{category}" in feature_names and '_nan' not in f"{column}_{category}"
+                        for category in column_categories]
+                categories.append(column_categories[np.array(kept, dtype=bool)])
+        return cls(continous_columns, categorical_columns, categories, device)
+
+    def _build_tensors(self, device):
+        if (torch is None):
+            self.__dict__.update({name: None for name in _TENSOR_ATTRIBUTES})
+            return
+        sizes = torch.tensor(self.sizes, dtype=torch.long)
+        group_offsets = torch.cumsum(sizes, dim=0) - sizes
+        max_size = max(self.sizes, default=0)
+
+        # Column index of a padded [max_size, groups] view of the categorical part, only kept when the padding
+        # costs at most PAD_RATIO times the real width
+        pad_index = None
+        pad_rank = None
+        if (self.sizes and max_size * len(self.sizes) <= PAD_RATIO * sum(self.sizes)):
+            position = torch.arange(max_size)
+            valid = position[:, None] < sizes[None, :]
+            pad_index = torch.where(valid, group_offsets[None, :] + position[:, None], group_offsets[None, :]).reshape(-1).to(device)
+            pad_rank = (max_size - position).to(torch.float32).view(1, max_size, 1).to(device)
+
+        self.__dict__.update({
+            'device': torch.device(device),
+            # Group id of every onehot subcolumn and start of every group, relative to the categorical part of a row
+            'group_ids': torch.repeat_interleave(torch.arange(len(self.sizes)), sizes).to(device),
+            'group_offsets': group_offsets.to(device),
+            'sizes_tensor': sizes.to(device),
+            'max_size': max_size,
+            'pad_index': pad_index,
+            'pad_rank': pad_rank,
+        })
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"ColumnLayout is immutable, cannot set {name}")
+
+    def __getstate__(self):
+        # Index tensors are rebuilt on load, so the layout can be unpickled without torch
+        state = self.__dict__.copy()
+        for name in _TENSOR_ATTRIBUTES:
+            state.pop(name)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_tensors("cpu")
+
+    def __eq__(self, other):
+        return (isinstance(other, ColumnLayout)
+                and self.continous_columns == other.continous_columns
+                and self.categorical_columns == other.categorical_columns
+                and all(np.array_equal(a, b) for a, b in zip(self.categories, other.categories))
+                and self.sizes == other.sizes)
+
+    def __hash__(self):
+        return hash((self.continous_columns, self.categorical_columns, self.sizes))
+
+    def __repr__(self):
+        return (f"ColumnLayout(continous={self.num_continous}, categorical={self.num_categorical}, "
+                f"features={self.num_features}, device={self.device})")
+
+    def to_json(self):
+        """
+         @brief Serializes the layout to a JSON string, keeping the dtype of the categories
+        """
+        return json.dumps({
+            'continous_columns': list(self.continous_columns),
+            'categorical_columns': list(self.categorical_columns),
+            'categories': [{'values': category.tolist(), 'dtype': category.dtype.str if category.dtype != object else 'object'}
+                           for category in self.categories],
+        })
+
+    @classmethod
+    def from_json(cls, text, device="cpu"):
+        """
+         @brief Builds a layout from the JSON string of to_json
+        """
+        state = json.loads(text)
+        categories = [np.array(category['values'], dtype=category['dtype']) for category in state['categories']]
+        return cls(state['continous_columns'], state['categorical_columns'], categories, device)
+
+    def to(self, device):
+        """
+         @brief Returns this layout with its index tensors on the given device
+         @param device: can be "cpu" or "cuda"
+        """
+        device = torch.device(device)
+        if (self.device is not None and device.type == self.device.type
+                and (device.index is None or self.device.index is None or device.index == self.device.index)):
+            return self
+        layout = object.__new__(ColumnLayout)
+        layout.__dict__.update(self.__getstate__())
+        layout._build_tensors(device)
+        return layout
+
+    def decode_categorical(self, values):
+        """
+         @brief Maps the onehot (or logit) part of preprocessed rows back to category values, without the sklearn encoder
+         @param values: numpy array of the full rows or only of their categorical part
+         @return DataFrame with one column per categorical column
+        """
+        start = self.num_continous if values.shape[1] == self.num_features else 0
+        decoded = {}
+        for column, category, offset, size in zip(self.categorical_columns, self.categories, self.offsets, self.sizes):
+            begin = offset - self.num_continous + start
+            decoded[column] = category[np.argmax(values[:, begin:begin + size], axis=1)]
+        return pd.DataFrame(decoded)
+
+    def decode(self, values, scaler=None, index=None, columns=None):
+        """
+         @brief Maps preprocessed rows back to the original columns: continous columns through the inverse of the
+                scaler (rounded like Autoencoder.clean), categorical columns through decode_categorical
+         @param values: numpy array of preprocessed rows
+         @param scaler: The fitted scaler of the continous columns
+         @param index: The index of the returned DataFrame
+         @param columns: The column order of the returned DataFrame, defaults to continous columns then categorical columns
+         @return DataFrame with the decoded rows
+        """
+        index = index if index is not None else pd.RangeIndex(values.shape[0])
+        columns = list(columns) if columns is not None else list(self.continous_columns) + list(self.categorical_columns)
+        parts = []
+        if (self.num_continous!=0):
+            parts.append(pd.DataFrame(scaler.inverse_transform(values[:,:self.num_continous]),index=index,columns=list(self.continous_columns)).round(0))
+        if (self.num_categorical!=0):
+            parts.append(self.decode_categorical(values).set_axis(index))
+        return pd.concat(parts,axis=1).reindex(columns=columns)
@@ -1,65 +1,50 @@
 import torch
 import torch.nn as nn
+from AutoCleanse.utils import segment_logsumexp, segment_argmax
+from AutoCleanse.layout import ColumnLayout
 
-def loss_CEMSE(input, outputs, categories, continous_columns=[], categorical_columns=[]):
+def loss_CEMSE(input, outputs, categories=None, continous_columns=[], categorical_columns=[], categorical_codes=False, layout=None):
     """
-     @brief Calculates cross entropy loss and mean square error loss of a dataframe correspondingly to continous and categorical columns
+     @brief Calculates cross entropy loss and mean square error loss of a dataframe correspondingly to continous and categorical columns.
+            The cross entropy of all onehot subcolumn groups is computed at once with segment operations over the group layout.
      @param input: The input tensor which is a batch of dataframe rows
      @param outputs: The output which is the autoencoded input
      @param continous_columns: A list of continous column names
      @param categorical_columns: A list of categorical column names
      @param categories: The categories created by one-hot encoder
-     @return The combined CE loss and MSE loss
-    """  
-    output_categorical = None
-    output_continous = None
-    column_map = None
-    slice_list = []
-    
-    if (len(categorical_columns)!=0 and len(continous_columns)!=0):
-        column_map = {column: categories[i] for i, column in enumerate(categorical_columns)} # Map categorical columns with onehot subcolumns
-        output_categorical = outputs[:,len(continous_columns):]
-        output_continous = outputs[:,:len(continous_columns)]
-        for i in list(column_map):
-            slice_list.append(column_map[i].shape[0])
-    elif (len(continous_columns)!=0):
-        column_map = {column: categories[i] for i, column in enumerate(categorical_columns)} # Map categorical columns with onehot subcolumns
-        output_categorical = outputs
-        for i in list(column_map):
-            slice_list.append(column_map[i].shape[0])
-    elif (len(categorical_columns)!=0):
-        output_continous = outputs 
+     @param categorical_codes: Whether the input holds one integer category code per categorical column (embedding
+                               input mode) instead of one-hot subcolumns
+     @param layout: The ColumnLayout of the input, replaces categories and the column lists. Pass it in loops to
+                    avoid rebuilding the layout on every call
+     @return The CE loss summed over categorical columns and the MSE loss, each averaged over the minibatch
+    """
+    if (layout is None):
+        layout = ColumnLayout(continous_columns, categorical_columns, categories, outputs.device)
+    layout = layout.to(outputs.device)
+    num_continous = layout.num_continous
+    num_categorical = layout.num_categorical
+
+    CEloss = torch.zeros((), device=outputs.device)
+    if (num_categorical!=0):
+        group_ids, offsets = layout.group_ids, layout.group_offsets
+        output_categorical = outputs[:,num_continous:]
 
-    CEloss = 0
-    if (len(categorical_columns)!=0):
-        # CE loss for each subcolumn group
-        Catcols = {}
-        CElosses = {}
-        val_CElosses = {}
-        for i in range(len(categorical_columns)):
-            Catcols[f"_{i}"] = None
-            CElosses[f"_{i}"] = None
-            val_CElosses[f"_{i}"] = None
+        # Target column of every group, relative to the onehot subcolumns range
+        if (categorical_codes):
+            # Unknown categories (code == size) count as the first category, like an all-zero one-hot row
+            codes = input[:,num_continous:num_continous+num_categorical].long()
+            codes = torch.where(codes < layout.sizes_tensor, codes, torch.zeros_like(codes))
+            target = codes + offsets
+        else:
+            target = segment_argmax(input[:,num_continous:], group_ids, num_categorical)
 
-        start_index_1h = 0                            # Start index relatives to onehot subcolumns range
-        start_index = len(continous_columns)          # Start index relatives to entire dataframe
-        for i,size in enumerate(slice_list):
-            end_index_1h = start_index_1h + size
-            end_index = start_index + size
-            Catcols[f"_{i}"] = output_categorical[:,start_index_1h:end_index_1h]
-            CElosses[f"_{i}"] = nn.CrossEntropyLoss()(Catcols[f"_{i}"],torch.argmax(input[:,start_index:end_index],dim=1)) # Averaged over minibatch
-            start_index_1h = end_index_1h
-            start_index = end_index
-        
-        for value in CElosses.values():
-            CEloss += value            
-    else:
-        pass        
+        # Cross entropy of every group is logsumexp(group) - logit(target), averaged over minibatch and summed over groups
+        logsumexp = segment_logsumexp(output_categorical, group_ids, num_categorical)
+        target_logit = torch.gather(output_categorical, 1, target)
+        CEloss = (logsumexp - target_logit).mean(dim=0).sum()
 
-    MSEloss = 0
-    if (len(continous_columns)!=0):
-        MSEloss = nn.MSELoss()(output_continous, input[:,:len(continous_columns)])
-    else:
-        pass        
+    MSEloss = torch.zeros((), device=outputs.device)
+    if (num_continous!=0):
+        MSEloss = nn.MSELoss()(outputs[:,:num_continous], input[:,:num_continous])
 
-    return CEloss,MSEloss
\ No newline at end of file
+    return CEloss,MSEloss
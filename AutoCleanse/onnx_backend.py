@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from AutoCleanse.layout import ColumnLayout
+
+class OnnxCleaner():
+    """
+        @brief Runs a model exported with Autoencoder.export_onnx with onnxruntime on CPU. Only needs numpy, pandas
+               and onnxruntime, so scoring workers do not have to install PyTorch.
+        @param path: Path of the exported .onnx file
+        @param num_threads: Number of intra-op threads of onnxruntime, None for its default
+    """
+    def __init__(self, path, num_threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("Running ONNX models requires onnxruntime, install it with 'pip install onnxruntime'") from e
+        options = ort.SessionOptions()
+        if (num_threads is not None):
+            options.intra_op_num_threads = num_threads
+        try:
+            self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        except Exception as e:
+            raise RuntimeError(f"Failed loading {path} into onnxruntime") from e
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.output = metadata['autocleanse_output']
+        self.input_width = int(metadata['autocleanse_input_width'])
+        self.layout = ColumnLayout.from_json(metadata['autocleanse_layout'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def run(self, data, batch_size=1024, progress=False):
+        """
+         @brief Runs the model over preprocessed rows in batches
+         @param data: DataFrame or numpy array of preprocessed rows, as given to Autoencoder.clean
+         @param batch_size: Number of rows per run
+         @param progress: Whether to show the progress bar
+         @return numpy float32 array with one output row per input row
+        """
+        values = np.ascontiguousarray(data.values if isinstance(data, pd.DataFrame) else data, dtype=np.float32)
+        if (values.shape[1] != self.input_width):
+            raise ValueError(f"Expected {self.input_width} input columns, got {values.shape[1]}")
+        if (values.shape[0] == 0):
+            return self.session.run(None, {self.input_name: values})[0]
+        outputs = None
+        for start in tqdm(range(0, values.shape[0], batch_size), desc=f'ONNX {self.output} progress', position=0, leave=True, disable=not progress):
+            batch_outputs = self.session.run(None, {self.input_name: values[start:start + batch_size]})[0]
+            if (outputs is None):
+                outputs = np.empty((values.shape[0], batch_outputs.shape[1]), dtype=np.float32)
+            outputs[start:start + batch_size] = batch_outputs
+        return outputs
+
+    def clean(self, df, scaler, batch_size=1024, og_columns=None, progress=True):
+        """
+         @brief Cleans preprocessed rows like Autoencoder.clean
+         @param df: DataFrame of preprocessed rows
+         @param scaler: The fitted scaler of the continous columns
+         @param batch_size: Number of rows per run
+         @param og_columns: The column order of the result, defaults to continous columns then categorical columns
+         @param progress: Whether to show the progress bar
+         @return DataFrame of cleaned rows with the index of df
+        """
+        if (self.output != "clean"):
+            raise ValueError(f"The model was exported with output={self.output}, clean needs output='clean'")
+        clean_data = self.run(df, batch_size, progress)
+        index = df.index if isinstance(df, pd.DataFrame) else None
+        return self.layout.decode(clean_data, scaler, index, og_columns)
+
+    def anonymize(self, df, batch_size=1024, progress=True):
+        """
+         @brief Encodes preprocessed rows like Autoencoder.anonymize
+         @param df: DataFrame of preprocessed rows
+         @param batch_size: Number of rows per run
+         @param progress: Whether to show the progress bar
+         @return DataFrame of latent vectors with the index of df
+        """
+        if (self.output != "encode"):
+            raise ValueError(f"The model was exported with output={self.output}, anonymize needs output='encode'")
+        anonymized_data = self.run(df, batch_size, progress)
+        index = df.index if isinstance(df, pd.DataFrame) else None
+        return pd.DataFrame(anonymized_data, index=index)
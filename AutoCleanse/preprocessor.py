@@ -1,16 +1,50 @@
 import pandas as pd
+import numpy as np
 import io
 import joblib
 import time
+from scipy import sparse
 from sklearn.model_selection import train_test_split
 from sklearn.base import clone
+from sklearn.preprocessing import OneHotEncoder
 from AutoCleanse.bucketfs_client import bucketfs_client
-from AutoCleanse.utils import *
+from AutoCleanse.layout import ColumnLayout
+
+NAN_FILLS = ("spike", "zero", "mean", "sentinel")
 
 class Preprocessor():
-  def __init__(self, scaler, encoder):
+  def __init__(self, scaler, encoder, seed=None, nan_fill="spike", nan_sentinel=-1.0):
+    """
+     @brief Scales continous columns and onehot encodes categorical columns
+     @param scaler: The sklearn scaler of the continous columns, cloned
+     @param encoder: The sklearn onehot encoder of the categorical columns, cloned
+     @param seed: Seed of the random generator of the spike fill, None for a random seed
+     @param nan_fill: How transform fills NaN in continous columns after scaling: "spike" (a random value in
+                      [-100, -0] or [0, 100], far outside the scaled range), "zero", "mean" (the scaled column mean
+                      of the data seen by fit_transform) or "sentinel" (nan_sentinel)
+     @param nan_sentinel: The fill value of nan_fill="sentinel"
+    """
+    if (nan_fill not in NAN_FILLS):
+      raise ValueError(f"Unsupported nan_fill {nan_fill}, expected one of {NAN_FILLS}")
     self.scaler = clone(scaler)
     self.encoder = clone(encoder)
+    self.layout = None
+    self.nan_fill = nan_fill
+    self.nan_sentinel = nan_sentinel
+    self.rng = np.random.default_rng(seed)
+    # Scaled means of the continous columns seen by fit_transform, for nan_fill="mean"
+    self.fill_means = None
+    # Running statistics of partial_fit until finalize
+    self._partial = None
+
+  def __setstate__(self, state):
+    # Preprocessors pickled before the NaN fill options fill with unseeded spikes, like before
+    state.setdefault('nan_fill', "spike")
+    state.setdefault('nan_sentinel', -1.0)
+    state.setdefault('rng', np.random.default_rng())
+    state.setdefault('fill_means', None)
+    state.setdefault('_partial', None)
+    self.__dict__.update(state)
 
   def split(self,df,train_ratio: float,val_ratio: float,test_ratio: float,random_seed: float):
       # Calculate the sizes of train, validation, and test sets
@@ -31,15 +65,35 @@ class Preprocessor():
       df_val, df_test = train_test_split(temp, test_size=test_size, random_state=random_seed)
       return df_train,df_val,df_test
 
-  def fit_transform(self,input_df,continous_columns=None,categorical_columns=None):
+  def fit_transform(self,input_df,continous_columns=None,categorical_columns=None,n_jobs=None,block_size=8,chunk_size=100000):
+    """
+     @brief Fits the preprocessor and transforms input_df. With n_jobs the encoder is fitted on blocks of
+            block_size categorical columns and the rows are encoded in chunks of chunk_size rows in parallel threads,
+            see fit and transform; the output is the same for any n_jobs
+     @param input_df: The dataframe to fit on and transform, its continous columns are scaled in place
+     @param continous_columns: A list of continous column names
+     @param categorical_columns: A list of categorical column names
+     @param n_jobs: Number of joblib workers, None or 1 fits and encodes in one pass
+     @param block_size: Number of categorical columns per fitted block
+     @param chunk_size: Number of rows per encoded chunk
+     @return The transformed dataframe
+    """
+    # A full fit abandons an unfinished partial_fit pass
+    self._partial = None
+
     # Preprocess continous columns
     if (continous_columns is not None):      
       input_df_scaled = self.scaler.fit_transform(input_df[continous_columns])
       input_df[continous_columns] = input_df_scaled
+      self.fill_means = dict(zip(continous_columns, np.nanmean(np.asarray(input_df_scaled, dtype=float), axis=0)))
         
     # Preprocess categorical columns
     if (categorical_columns is not None):
-      input_df_encoded = self.encoder.fit_transform(input_df[categorical_columns])  
+      if (n_jobs in (None, 1)):
+        input_df_encoded = self.encoder.fit_transform(input_df[categorical_columns])
+      else:
+        self._fit_encoder(input_df,categorical_columns,n_jobs,block_size)
+        input_df_encoded = self._encode(input_df[categorical_columns],n_jobs,chunk_size)
       input_df_encoded_part = pd.DataFrame(input_df_encoded, columns=self.encoder.get_feature_names_out(categorical_columns),index=input_df.index)
       input_df = pd.concat([input_df,input_df_encoded_part],axis=1)
       input_df.drop(columns=categorical_columns, inplace=True)
@@ -48,33 +102,283 @@ class Preprocessor():
     input_df.drop(columns=nan_columns, inplace=True)
     input_df.fillna(0.0, inplace=True)
 
+    # Column layout of the output, shared with the model for loss and decoding
+    self.layout = ColumnLayout.from_preprocessor(self,continous_columns,categorical_columns)
+
     return input_df
 
-  def transform(self,input_df,continous_columns=None,categorical_columns=None):
+  def transform(self,input_df,continous_columns=None,categorical_columns=None,n_jobs=None,chunk_size=100000):
+    """
+     @brief Scales, encodes and NaN fills input_df with the fitted preprocessor. With n_jobs the rows are encoded
+            in chunks of chunk_size rows in parallel threads; the output is the same for any n_jobs
+     @param input_df: The dataframe to transform, its continous columns are scaled in place
+     @param continous_columns: A list of continous column names
+     @param categorical_columns: A list of categorical column names
+     @param n_jobs: Number of joblib workers, None or 1 encodes all rows at once
+     @param chunk_size: Number of rows per encoded chunk
+     @return The transformed dataframe
+    """
     # Preprocess continous columns
     if (continous_columns is not None):      
       input_df_scaled = self.scaler.transform(input_df[continous_columns])
       input_df[continous_columns] = input_df_scaled
 
       # Handle NaN in continous columns
-      # input_df.fillna(generate_random_spike(1000, 10000), inplace=True)
       for col in continous_columns:
-        nan_indices = input_df[col].index[input_df[col].isna()]
-        input_df.loc[nan_indices, col] = [generate_random_spike(0,100) for _ in range(len(nan_indices))]
+        values = input_df[col].to_numpy(dtype=float, copy=True)
+        nan_mask = np.isnan(values)
+        if (nan_mask.any()):
+          values[nan_mask] = self._nan_fill_values(col, int(nan_mask.sum()))
+          input_df[col] = values
         
     # Preprocess categorical columns
     if (categorical_columns is not None):
-      input_df_encoded = self.encoder.transform(input_df[categorical_columns])
+      input_df_encoded = self._encode(input_df[categorical_columns],n_jobs,chunk_size)
       input_df_encoded_part = pd.DataFrame(input_df_encoded, columns=self.encoder.get_feature_names_out(categorical_columns),index=input_df.index)
       input_df = pd.concat([input_df,input_df_encoded_part],axis=1)
       input_df.drop(columns=categorical_columns, inplace=True)
 
       # Handle NaN in categorical columns
-      nan_columns = [col for col in categorical_columns if '_nan' in col]
+      nan_columns = [col for col in input_df_encoded_part.columns if '_nan' in col]
       input_df.drop(columns=nan_columns, inplace=True)
 
     return input_df
 
+  def fit(self,input_df,continous_columns=None,categorical_columns=None,n_jobs=None,block_size=8):
+    """
+     @brief Fits the scaler, the encoder and the column layout like fit_transform, without transforming or
+            modifying input_df. With n_jobs the categorical columns are split into blocks of block_size columns, a
+            clone of the encoder is fitted on every block in parallel and their categories are merged into the
+            encoder, which ends up equal to one fitted on all columns at once
+     @param input_df: The dataframe to fit on
+     @param continous_columns: A list of continous column names
+     @param categorical_columns: A list of categorical column names
+     @param n_jobs: Number of joblib workers for the categorical blocks, None or 1 fits in one pass. Threads by
+                    default, which share the data instead of pickling it to worker processes; a process backend can
+                    be chosen with joblib.parallel_config
+     @param block_size: Number of categorical columns per block
+     @return self
+    """
+    # A full fit abandons an unfinished partial_fit pass
+    self._partial = None
+    if (continous_columns is not None):
+      self.scaler.fit(input_df[continous_columns])
+      scaled = np.asarray(self.scaler.transform(input_df[continous_columns]), dtype=float)
+      self.fill_means = dict(zip(continous_columns, np.nanmean(scaled, axis=0)))
+    if (categorical_columns is not None):
+      self._fit_encoder(input_df,categorical_columns,n_jobs,block_size)
+    self.layout = ColumnLayout.from_preprocessor(self,continous_columns,categorical_columns)
+    return self
+
+  def _fit_encoder(self,input_df,categorical_columns,n_jobs,block_size):
+    # Fits the encoder on all categorical columns, or on blocks of columns in threads merged afterwards
+    if (n_jobs in (None, 1) or not self._blockwise_fit_supported()):
+      self.encoder.fit(input_df[categorical_columns])
+      return
+    blocks = [list(categorical_columns[start:start + block_size]) for start in range(0, len(categorical_columns), block_size)]
+    fitted = joblib.Parallel(n_jobs=n_jobs, prefer="threads")(
+      joblib.delayed(clone(self.encoder).fit)(input_df[block]) for block in blocks)
+    self._fit_encoder_categories([categories for encoder in fitted for categories in encoder.categories_], categorical_columns)
+
+  def _encode(self,categorical_df,n_jobs,chunk_size):
+    # encoder.transform of the rows, in chunks in threads with n_jobs, stacked in row order
+    if (n_jobs in (None, 1) or len(categorical_df) <= chunk_size):
+      return self.encoder.transform(categorical_df)
+    encoded = joblib.Parallel(n_jobs=n_jobs, prefer="threads")(
+      joblib.delayed(self.encoder.transform)(categorical_df.iloc[start:start + chunk_size])
+      for start in range(0, len(categorical_df), chunk_size))
+    return sparse.vstack(encoded, format="csr") if sparse.issparse(encoded[0]) else np.concatenate(encoded)
+
+  def _blockwise_fit_supported(self):
+    # Blocks only merge exactly when the categories are all values seen, not given or grouped by frequency
+    return (isinstance(self.encoder, OneHotEncoder) and isinstance(self.encoder.categories, str)
+            and self.encoder.categories == 'auto' and self.encoder.min_frequency is None
+            and self.encoder.max_categories is None)
+
+  def _fit_encoder_categories(self,categories,categorical_columns):
+    # Fits the encoder on a small frame holding every category of every column once, which gives it the same
+    # categories_, drop_idx_ and feature names as a fit on the full data
+    length = int(np.max([len(values) for values in categories]))
+    frame = pd.DataFrame({column: pd.Series(values, dtype=values.dtype).iloc[np.arange(length) % len(values)].reset_index(drop=True)
+                          for column, values in zip(categorical_columns, categories)})
+    self.encoder.fit(frame)
+
+  def partial_fit(self,chunk,continous_columns=None,categorical_columns=None):
+    """
+     @brief Updates the fit with one chunk of the training data, e.g. from pd.read_csv(..., chunksize=...), so tables
+            larger than memory can be fitted. The scaler is updated with its partial_fit, the categories seen and the
+            sums of the continous columns are kept per column. Call finalize after the last chunk to fit the encoder,
+            the fill means and the layout, which then equal those of fit on all chunks at once
+     @param chunk: The dataframe chunk, not modified
+     @param continous_columns: A list of continous column names, the same for every chunk
+     @param categorical_columns: A list of categorical column names, the same for every chunk
+     @return self
+    """
+    if (self._partial is None):
+      if (continous_columns is not None and not hasattr(self.scaler, 'partial_fit')):
+        raise ValueError(f"partial_fit needs a scaler with partial_fit, {type(self.scaler).__name__} has none")
+      if (categorical_columns is not None and (getattr(self.encoder, 'min_frequency', None) is not None
+                                               or getattr(self.encoder, 'max_categories', None) is not None)):
+        raise ValueError("partial_fit does not support encoders grouping infrequent categories, use fit")
+      # A new pass starts from an unfitted scaler
+      self.scaler = clone(self.scaler)
+      self._partial = {'continous_columns': continous_columns,
+                       'categorical_columns': categorical_columns,
+                       'sums': np.zeros(len(continous_columns or [])),
+                       'counts': np.zeros(len(continous_columns or [])),
+                       'categories': {column: None for column in categorical_columns or []}}
+    elif (continous_columns != self._partial['continous_columns']
+          or categorical_columns != self._partial['categorical_columns']):
+      raise ValueError("partial_fit got different columns than in the previous chunks")
+
+    if (continous_columns is not None):
+      self.scaler.partial_fit(chunk[continous_columns])
+      values = chunk[continous_columns].to_numpy(dtype=float)
+      self._partial['sums'] += np.nansum(values, axis=0)
+      self._partial['counts'] += np.count_nonzero(~np.isnan(values), axis=0)
+    if (categorical_columns is not None):
+      categories = self._partial['categories']
+      for column in categorical_columns:
+        seen = pd.Series(pd.unique(chunk[column]))
+        if (categories[column] is not None):
+          seen = pd.Series(pd.unique(pd.concat([categories[column], seen], ignore_index=True)))
+        categories[column] = seen
+    return self
+
+  def finalize(self):
+    """
+     @brief Ends a partial_fit pass: fits the encoder on the categories seen, computes the fill means and the layout
+     @return self
+    """
+    if (self._partial is None):
+      raise ValueError("finalize needs at least one call of partial_fit")
+    partial, self._partial = self._partial, None
+    continous_columns = partial['continous_columns']
+    categorical_columns = partial['categorical_columns']
+    if (continous_columns is not None):
+      # The scalers with partial_fit are affine per column, the mean of the scaled column is the scaled mean
+      with np.errstate(invalid='ignore', divide='ignore'):
+        means = partial['sums'] / partial['counts']
+      scaled = self.scaler.transform(pd.DataFrame([means], columns=continous_columns))
+      self.fill_means = dict(zip(continous_columns, np.asarray(scaled, dtype=float)[0]))
+    if (categorical_columns is not None):
+      self._fit_encoder_categories([partial['categories'][column] for column in categorical_columns], categorical_columns)
+    self.layout = ColumnLayout.from_preprocessor(self,continous_columns,categorical_columns)
+    return self
+
+  def transform_array(self,input_df,continous_columns=None,categorical_columns=None,out=None,n_jobs=None,chunk_size=100000):
+    """
+     @brief Transforms a dataframe like transform, but writes the continous and onehot columns straight into one
+            float32 array instead of building, concatenating and dropping float64 frames. input_df is not modified.
+            Onehot columns are set from category codes, encoders with dropped or infrequent categories fall back to
+            encoder.transform for the categorical block. Only the given columns are in the output, in layout order.
+            With n_jobs, chunks of chunk_size rows are transformed in parallel threads writing into the same array.
+            The NaN fill runs after them over whole columns, so the output is the same for any n_jobs
+     @param input_df: The dataframe to transform
+     @param continous_columns: A list of continous column names
+     @param categorical_columns: A list of categorical column names
+     @param out: Optional preallocated float32 array of shape [rows, layout.num_features] to write into,
+                 e.g. a numpy memmap
+     @param n_jobs: Number of threads, None or 1 transforms all rows at once
+     @param chunk_size: Number of rows per chunk when n_jobs is set
+     @return The float32 array and the list of its column names
+    """
+    if (self.layout is None):
+      raise ValueError("transform_array needs a fitted preprocessor, call fit or fit_transform first")
+    continous_columns = list(continous_columns or [])
+    categorical_columns = list(categorical_columns or [])
+    num_rows = len(input_df)
+    num_continous = len(continous_columns)
+    feature_names = np.array([], dtype=object)
+    if (len(categorical_columns) != 0):
+      # NaN columns are dropped like in transform
+      feature_names = self.encoder.get_feature_names_out(categorical_columns)
+      feature_names = feature_names[np.array(['_nan' not in name for name in feature_names], dtype=bool)]
+    num_features = num_continous + len(feature_names)
+    if (out is None):
+      out = np.zeros((num_rows, num_features), dtype=np.float32)
+    elif (out.shape != (num_rows, num_features) or out.dtype != np.float32):
+      raise ValueError(f"out must be a float32 array of shape {(num_rows, num_features)}, got {out.dtype} {out.shape}")
+
+    if (n_jobs in (None, 1) or num_rows <= chunk_size):
+      self._transform_rows(input_df,continous_columns,categorical_columns,out)
+    else:
+      # Threads share out, every chunk writes its own rows
+      joblib.Parallel(n_jobs=n_jobs, require="sharedmem")(
+        joblib.delayed(self._transform_rows)(input_df.iloc[start:start + chunk_size],continous_columns,
+                                             categorical_columns,out[start:start + chunk_size])
+        for start in range(0, num_rows, chunk_size))
+
+    # One draw per column in column order, like transform
+    for i, col in enumerate(continous_columns):
+      nan_mask = np.isnan(out[:, i])
+      if (nan_mask.any()):
+        out[nan_mask, i] = self._nan_fill_values(col, int(nan_mask.sum()))
+    return out, continous_columns + list(feature_names)
+
+  def _transform_rows(self,input_df,continous_columns,categorical_columns,out):
+    # Scales and onehot encodes the rows of input_df into out, leaving NaN in the continous columns
+    num_continous = len(continous_columns)
+    if (num_continous != 0):
+      out[:, :num_continous] = self.scaler.transform(input_df[continous_columns])
+
+    if (len(categorical_columns) != 0):
+      categorical = out[:, num_continous:]
+      if (not isinstance(self.encoder, OneHotEncoder) or self.encoder.drop is not None
+          or getattr(self.encoder, '_infrequent_enabled', False)):
+        encoded = self.encoder.transform(input_df[categorical_columns])
+        encoded = encoded.toarray() if hasattr(encoded, 'toarray') else np.asarray(encoded)
+        all_names = self.encoder.get_feature_names_out(categorical_columns)
+        categorical[:] = encoded[:, np.array(['_nan' not in name for name in all_names], dtype=bool)]
+      else:
+        categorical[:] = 0
+        offset = 0
+        for i, column in enumerate(categorical_columns):
+          size = len(self.layout.categories[i])
+          codes = self._category_codes(input_df[column], i)
+          rows = np.flatnonzero(codes < size)
+          categorical[rows, offset + codes[rows]] = 1
+          offset += size
+
+  def _nan_fill_values(self,column,count):
+    # One vectorized draw per column, spike draws the same distribution as utils.generate_random_spike(0, 100)
+    if (self.nan_fill == "spike"):
+      return self.rng.uniform(0, 100, size=count) * self.rng.choice([-1.0, 1.0], size=count)
+    if (self.nan_fill == "mean"):
+      if (self.fill_means is None or column not in self.fill_means):
+        raise ValueError(f"nan_fill='mean' needs the mean of column {column}, fit the preprocessor on it first")
+      return self.fill_means[column]
+    return 0.0 if self.nan_fill == "zero" else self.nan_sentinel
+
+  def transform_codes(self,input_df,continous_columns=None,categorical_columns=None):
+    """
+     @brief Transforms a dataframe for the categorical embedding input mode of Autoencoder: continous columns are scaled
+            like in transform, each categorical column is replaced by one integer code indexing layout.categories.
+            NaN and unknown categories get the code len(categories), which the embedding maps to a zero vector.
+     @param input_df: The dataframe to transform
+     @param continous_columns: A list of continous column names
+     @param categorical_columns: A list of categorical column names
+     @return Dataframe of continous columns followed by categorical codes
+    """
+    input_df = self.transform(input_df,continous_columns=continous_columns)
+    if (categorical_columns is not None):
+      for i, column in enumerate(categorical_columns):
+        input_df[column] = self._category_codes(input_df[column],i)
+    return input_df[list(continous_columns or []) + list(categorical_columns or [])]
+
+  def _category_codes(self,values,i):
+    # Codes index the categories kept in the output layout, NaN and unknown categories get the padding code
+    categories = self.layout.categories[i] if self.layout is not None else self.encoder.categories_[i]
+    categories = categories[~pd.isna(categories)]
+    codes = pd.Index(categories).get_indexer(values).astype(np.int64)
+    missing = codes < 0
+    if (pd.isna(self.encoder.categories_[i]).any()):
+      missing &= ~pd.isna(values).to_numpy()
+    if (missing.any() and self.encoder.handle_unknown == 'error'):
+      raise ValueError(f"Found unknown categories {list(pd.unique(values[missing]))} in column {i} during transform")
+    codes[codes < 0] = len(categories)
+    return codes
+
   def save(self,name,location):
     if (location=="local"):
       try:
@@ -102,6 +406,8 @@ class Preprocessor():
         loaded_preprocessor = joblib.load(f'preprocessor_{name}.pkl')
         self.scaler = loaded_preprocessor.scaler
         self.encoder = loaded_preprocessor.encoder
+        self.layout = getattr(loaded_preprocessor,'layout',None)
+        self.fill_means = getattr(loaded_preprocessor,'fill_means',None)
       except Exception as e:
         raise RuntimeError(f"Failed loading preprocessor_{name}.pkl from local") from e
     elif (location=="bucketfs"):
@@ -110,5 +416,7 @@ class Preprocessor():
         loaded_preprocessor = joblib.load(data)
         self.scaler = loaded_preprocessor.scaler
         self.encoder = loaded_preprocessor.encoder
+        self.layout = getattr(loaded_preprocessor,'layout',None)
+        self.fill_means = getattr(loaded_preprocessor,'fill_means',None)
       except Exception as e:
         raise RuntimeError(f"Failed loading preprocessor_{name}.pkl from BucketFS") from e
\ No newline at end of file
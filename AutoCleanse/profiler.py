@@ -0,0 +1,190 @@
+import csv
+import json
+import time
+from contextlib import nullcontext
+import torch
+
+# Shared no-op context of disabled profilers, so a disabled phase costs one attribute check and no allocation
+_NULL_CONTEXT = nullcontext()
+
+class _Phase():
+    __slots__ = ('profiler', 'name', 'start', 'record')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.record = None
+
+    def __enter__(self):
+        if (self.profiler.synchronize):
+            torch.cuda.synchronize()
+        if (self.profiler._torch_profile is not None):
+            self.record = torch.profiler.record_function(self.name)
+            self.record.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if (self.profiler.synchronize):
+            torch.cuda.synchronize()
+        self.profiler._add(self.name, time.perf_counter() - self.start)
+        if (self.record is not None):
+            self.record.__exit__(*exc_info)
+        return False
+
+class Profiler():
+    """
+        @brief Collects wall-clock time per phase (data loading, forward, loss, backward, optimizer step, decoding, ...)
+               and counters (rows, batches, optimizer steps) of train_model, clean and anonymize. Timings are grouped
+               into records, one per epoch of train_model and one per call of clean or anonymize, and can be dumped
+               as JSON or CSV. A disabled profiler returns a shared no-op context for every phase.
+               Used as a context manager with torch_profiler=True it also captures a torch.profiler trace in which
+               every phase is a labelled range.
+        @param enabled: Whether to collect anything
+        @param path: Optional .json or .csv file, rewritten with all records after every record
+        @param torch_profiler: Whether to capture a torch.profiler trace inside the with block
+        @param trace_path: Optional file for the Chrome trace of torch.profiler
+        @param synchronize: Whether to synchronize CUDA at phase boundaries, so GPU time is attributed to its phase
+    """
+    def __init__(self, enabled=True, path=None, torch_profiler=False, trace_path=None, synchronize=False):
+        self.enabled = enabled
+        self.path = path
+        self.torch_profiler = torch_profiler
+        self.trace_path = trace_path
+        self.synchronize = synchronize and enabled and torch.cuda.is_available()
+        self.records = []
+        # The torch.profiler.profile of the last with block, for key_averages() and the like
+        self.torch_trace = None
+        self._torch_profile = None
+        self._reset()
+
+    def _reset(self):
+        self._times = {}
+        self._calls = {}
+        self._counters = {}
+        self._start = time.perf_counter()
+
+    def _add(self, name, elapsed):
+        self._times[name] = self._times.get(name, 0.0) + elapsed
+        self._calls[name] = self._calls.get(name, 0) + 1
+
+    def phase(self, name):
+        """
+         @brief Returns a context that adds its duration to the phase name
+         @param name: The phase name
+        """
+        if (not self.enabled):
+            return _NULL_CONTEXT
+        return _Phase(self, name)
+
+    def count(self, name, value=1):
+        """
+         @brief Adds value to the counter name
+         @param name: The counter name
+         @param value: The amount to add
+        """
+        if (self.enabled):
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def iterate(self, iterable, name="data"):
+        """
+         @brief Wraps an iterable (e.g. a DataLoader), adding the time spent fetching every item to the phase name
+         @param iterable: The iterable to wrap
+         @param name: The phase name
+        """
+        if (not self.enabled):
+            return iterable
+        return self._iterate(iterable, name)
+
+    def _iterate(self, iterable, name):
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def end_record(self, label):
+        """
+         @brief Closes the current record, e.g. an epoch, and starts a new one. Rewrites path if it is set
+         @param label: The name of the record, e.g. "epoch_1" or "clean"
+         @return The closed record, or None when disabled
+        """
+        if (not self.enabled):
+            return None
+        record = {
+            'label': label,
+            'wall_s': time.perf_counter() - self._start,
+            'phases': {name: {'calls': self._calls[name], 'total_s': total, 'mean_s': total / self._calls[name]}
+                       for name, total in self._times.items()},
+            'counters': dict(self._counters),
+        }
+        self.records.append(record)
+        self._reset()
+        if (self.path is not None):
+            self.dump(self.path)
+        return record
+
+    def summary(self):
+        """
+         @brief Sums all records per phase and counter
+         @return dict with 'wall_s', 'phases' and 'counters' like a record
+        """
+        phases = {}
+        counters = {}
+        for record in self.records:
+            for name, stats in record['phases'].items():
+                total = phases.setdefault(name, {'calls': 0, 'total_s': 0.0})
+                total['calls'] += stats['calls']
+                total['total_s'] += stats['total_s']
+            for name, value in record['counters'].items():
+                counters[name] = counters.get(name, 0) + value
+        for stats in phases.values():
+            stats['mean_s'] = stats['total_s'] / stats['calls']
+        return {'wall_s': sum(record['wall_s'] for record in self.records), 'phases': phases, 'counters': counters}
+
+    def dump(self, path):
+        """
+         @brief Writes all records and their summary. A .csv path gets one row per record and phase or counter,
+                any other path gets JSON
+         @param path: The output file
+        """
+        try:
+            if (str(path).endswith('.csv')):
+                with open(path, 'w', newline='') as file:
+                    writer = csv.writer(file)
+                    writer.writerow(['record', 'kind', 'name', 'calls', 'total_s', 'mean_s', 'value'])
+                    for record in self.records + [dict(self.summary(), label='total')]:
+                        writer.writerow([record['label'], 'wall', 'wall', '', record['wall_s'], '', ''])
+                        for name, stats in record['phases'].items():
+                            writer.writerow([record['label'], 'phase', name, stats['calls'], stats['total_s'], stats['mean_s'], ''])
+                        for name, value in record['counters'].items():
+                            writer.writerow([record['label'], 'counter', name, '', '', '', value])
+            else:
+                with open(path, 'w') as file:
+                    json.dump({'records': self.records, 'total': self.summary()}, file, indent=2)
+        except Exception as e:
+            raise RuntimeError(f"Failed writing profile {path}") from e
+
+    def __enter__(self):
+        if (self.enabled and self.torch_profiler):
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if (torch.cuda.is_available()):
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._torch_profile = torch.profiler.profile(activities=activities)
+            self._torch_profile.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        if (self._torch_profile is not None):
+            profile, self._torch_profile = self._torch_profile, None
+            profile.__exit__(*exc_info)
+            if (self.trace_path is not None):
+                profile.export_chrome_trace(self.trace_path)
+            self.torch_trace = profile
+        return False
+
+# Default of train_model, clean and anonymize
+NULL_PROFILER = Profiler(enabled=False)
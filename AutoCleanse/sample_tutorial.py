@@ -12,7 +12,7 @@ from tabulate import tabulate
 from sklearn.preprocessing import *
 
 from AutoCleanse.utils import *
-from AutoCleanse.dataloader import PlainDataset, DataLoader
+from AutoCleanse.dataloader import PlainDataset, DataLoader, create_dataloader
 from AutoCleanse.autoencoder import *
 from AutoCleanse.loss_model import loss_CEMSE
 from AutoCleanse.preprocessor import Preprocessor
@@ -75,17 +75,12 @@ val_dataset = PlainDataset(X_val)
 test_dataset = PlainDataset(X_test)
 dirty_dataset = PlainDataset(X_dirty)
 
-def custom_collate_fn(batch):
-    tensor_data = torch.stack([item[0] for item in batch])
-    indices = [item[1] for item in batch]
-    return tensor_data, indices
-
 torch.manual_seed(42) #@TODO: random seed 
 batch_size = 64
-train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, drop_last=True,collate_fn=custom_collate_fn)
-val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, drop_last=True, collate_fn=custom_collate_fn)
-test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False, drop_last=True, collate_fn=custom_collate_fn)
-dirty_loader = DataLoader(dirty_dataset, batch_size=batch_size, shuffle=False, drop_last=True, collate_fn=custom_collate_fn)
+train_loader = create_dataloader(train_dataset, batch_size=batch_size, shuffle=True, drop_last=True)
+val_loader = create_dataloader(val_dataset, batch_size=batch_size, shuffle=False, drop_last=True)
+test_loader = create_dataloader(test_dataset, batch_size=batch_size, shuffle=False, drop_last=True)
+dirty_loader = create_dataloader(dirty_dataset, batch_size=batch_size, shuffle=False, drop_last=True)
 
 # Declaring model
 layers = [X_train.shape[1],1024,128]   
@@ -0,0 +1,147 @@
+import os
+import time
+import pandas as pd
+from tqdm import tqdm
+from AutoCleanse.dataloader import PlainDataset, create_dataloader
+from AutoCleanse.profiler import NULL_PROFILER
+
+class _ParquetChunkWriter():
+    """
+        @brief Appends DataFrame chunks to one parquet file, using the schema of the first chunk
+    """
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Writing parquet output requires pyarrow, install it with 'pip install pyarrow'") from e
+        self.pa = pa
+        self.pq = pq
+        self.path = path
+        self.writer = None
+
+    def write(self, df):
+        if (self.writer is None):
+            table = self.pa.Table.from_pandas(df, preserve_index=False)
+            self.writer = self.pq.ParquetWriter(self.path, table.schema)
+        else:
+            table = self.pa.Table.from_pandas(df, schema=self.writer.schema, preserve_index=False)
+        self.writer.write_table(table)
+
+    def close(self):
+        if (self.writer is not None):
+            self.writer.close()
+
+class _CSVChunkWriter():
+    """
+        @brief Appends DataFrame chunks to one csv file, writing the header only once
+    """
+    def __init__(self, path):
+        self.path = path
+        self.header = True
+
+    def write(self, df):
+        df.to_csv(self.path, mode='w' if self.header else 'a', header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        pass
+
+def fit_csv(preprocessor, input_path, continous_columns, categorical_columns, chunksize=100000, **read_csv_kwargs):
+    """
+    Fit a preprocessor on a csv file chunk by chunk with Preprocessor.partial_fit, so peak memory is bounded by the
+    chunk size instead of the table size.
+
+    Args:
+        preprocessor (Preprocessor): The preprocessor to fit, its scaler needs partial_fit (e.g. MinMaxScaler).
+        input_path (str): Path of the csv file to fit on.
+        continous_columns (list): The list of names of the continuous columns.
+        categorical_columns (list): The list of names of the categorical columns.
+        chunksize (int, optional): Number of rows read at a time. Defaults to 100000.
+        **read_csv_kwargs: Additional arguments passed to pd.read_csv.
+
+    Returns:
+        Preprocessor: The fitted preprocessor.
+    """
+    progress = tqdm(desc='Stream fit progress', unit='rows', position=0, leave=True)
+    try:
+        for chunk in pd.read_csv(input_path, chunksize=chunksize, **read_csv_kwargs):
+            preprocessor.partial_fit(chunk,
+                                     continous_columns=continous_columns or None,
+                                     categorical_columns=categorical_columns or None)
+            progress.update(len(chunk))
+    finally:
+        progress.close()
+    return preprocessor.finalize()
+
+def clean_csv(autoencoder, preprocessor, input_path, output_path, continous_columns, categorical_columns,
+              chunksize=100000, batch_size=1024, device="cpu", precision="float32", profiler=None, **read_csv_kwargs):
+    """
+    Clean a csv file chunk by chunk and write every cleaned chunk to the output before reading the next one,
+    so peak memory is bounded by the chunk size instead of the table size.
+
+    Args:
+        autoencoder (Autoencoder): The trained autoencoder.
+        preprocessor (Preprocessor): The fitted preprocessor.
+        input_path (str): Path of the csv file to clean.
+        output_path (str): Path of the output file. Files ending in .parquet or .pq are written as parquet
+                           (requires pyarrow), anything else as csv.
+        continous_columns (list): The list of names of the continuous columns.
+        categorical_columns (list): The list of names of the categorical columns.
+        chunksize (int, optional): Number of rows read, cleaned and written at a time. Defaults to 100000.
+        batch_size (int, optional): The batch size used by Autoencoder.clean. Defaults to 1024.
+        device (str, optional): The device to be used for processing. Defaults to "cpu".
+        precision (str, optional): "float32", or "bfloat16" to run the forward pass under autocast. Defaults to "float32".
+        profiler (Profiler, optional): Times reading, preprocessing and writing every chunk besides the phases of
+                                       Autoencoder.clean. clean closes one "clean" record per chunk, so the write of a
+                                       chunk is counted in the next record and the last one in a final "clean_csv"
+                                       record. Defaults to None, no profiling.
+        **read_csv_kwargs: Additional arguments passed to pd.read_csv.
+
+    Returns:
+        dict: Number of rows cleaned, elapsed seconds and rows per second.
+    """
+    profiler = profiler if profiler is not None else NULL_PROFILER
+    if (os.path.splitext(output_path)[1].lower() in (".parquet", ".pq")):
+        writer = _ParquetChunkWriter(output_path)
+    else:
+        writer = _CSVChunkWriter(output_path)
+
+    columns = continous_columns + categorical_columns
+    stream_progress = tqdm(desc='Stream clean progress', unit='rows', position=0, leave=True)
+    total_rows = 0
+    start_time = time.time()
+    try:
+        for chunk in profiler.iterate(pd.read_csv(input_path, chunksize=chunksize, **read_csv_kwargs), "read_csv"):
+            og_columns = [column for column in chunk.columns if column in columns]
+            with profiler.phase("preprocess"):
+                chunk = preprocessor.transform(input_df=chunk[og_columns].copy(),
+                                               continous_columns=continous_columns or None,
+                                               categorical_columns=categorical_columns or None)
+            chunk_loader = create_dataloader(PlainDataset(chunk), batch_size=batch_size)
+            cleaned_chunk = autoencoder.clean(dirty_loader=chunk_loader,
+                                              df=chunk,
+                                              batch_size=batch_size,
+                                              onehotencoder=preprocessor.encoder,
+                                              scaler=preprocessor.scaler,
+                                              device=device,
+                                              og_columns=og_columns,
+                                              continous_columns=continous_columns,
+                                              categorical_columns=categorical_columns,
+                                              progress=False,
+                                              layout=preprocessor.layout,
+                                              precision=precision,
+                                              profiler=profiler)
+            with profiler.phase("write"):
+                writer.write(cleaned_chunk)
+            total_rows += len(cleaned_chunk)
+            stream_progress.update(len(cleaned_chunk))
+    finally:
+        writer.close()
+        stream_progress.close()
+    profiler.end_record("clean_csv")
+
+    elapsed = time.time() - start_time
+    rows_per_sec = total_rows / elapsed if elapsed > 0 else float('inf')
+    print(f"Cleaned {total_rows} rows in {elapsed:.2f} seconds ({rows_per_sec:.0f} rows/s)")
+    return {"rows": total_rows, "seconds": elapsed, "rows_per_sec": rows_per_sec}
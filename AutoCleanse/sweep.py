@@ -0,0 +1,162 @@
+import os
+import math
+import torch
+import pandas as pd
+import torch.multiprocessing as mp
+from tqdm import tqdm
+from AutoCleanse.autoencoder import Autoencoder
+from AutoCleanse.dataloader import MemmapDataset, create_dataloader
+from AutoCleanse.checkpoint import snapshot_state_dict
+
+# Datasets and settings shared by all trials of a worker, set once by the pool initializer
+_worker_context = {}
+
+def _init_worker(train_dataset, val_dataset, layout, batch_size, precision, metric, threads_per_worker):
+    torch.set_num_threads(threads_per_worker)
+    _worker_context.update({
+        'train_dataset': train_dataset,
+        'val_loader': create_dataloader(val_dataset, batch_size),
+        'layout': layout,
+        'batch_size': batch_size,
+        'precision': precision,
+        # Position of the ranking metric in the (loss, loss comp, CE, MSE) validation metrics
+        'metric_index': 0 if metric == "loss" else 1,
+    })
+
+def _build_autoencoder(config, layout):
+    kwargs = {key: value for key, value in config.items() if key not in ('layers', 'wlc')}
+    kwargs.setdefault('batch_norm', True)
+    return Autoencoder(layers=[layout.num_features] + list(config['layers']), **kwargs)
+
+def _run_trial(trial, config, state, num_epochs, seed):
+    """
+     @brief Trains one configuration for num_epochs more epochs, continuing from the state of the previous rung
+     @return The updated trial state
+    """
+    context = _worker_context
+    device = torch.device("cpu")
+    wlc = config.get('wlc', (1,1))
+    torch.manual_seed(seed + trial)
+    autoencoder = _build_autoencoder(config, context['layout'])
+    autoencoder.layout = context['layout']
+    autoencoder.wlc = wlc
+    if (state is not None):
+        autoencoder.load_state_dict(state['model'])
+        autoencoder.optimizer.load_state_dict(state['optimizer'])
+        autoencoder.scheduler.load_state_dict(state['scheduler'])
+        torch.set_rng_state(state['rng_state'])
+    else:
+        state = {'epochs': 0, 'best_loss': float('inf'), 'best_state_dict': None, 'val_metrics': None}
+
+    autoencoder.train()
+    for epoch in range(state['epochs'], state['epochs'] + num_epochs):
+        train_loader = create_dataloader(context['train_dataset'], context['batch_size'], shuffle=True, drop_last=True,
+                                         generator=torch.Generator().manual_seed(seed + trial + epoch))
+        autoencoder._train_epoch(autoencoder, train_loader, device, wlc, context['precision'])
+        val_running_metrics, val_running_sample_count = autoencoder._validate(context['val_loader'], device, wlc, context['precision'])
+        val_metrics = (val_running_metrics / val_running_sample_count).tolist()
+        if (val_metrics[context['metric_index']] < state['best_loss']):
+            state['best_loss'] = val_metrics[context['metric_index']]
+            state['best_state_dict'] = snapshot_state_dict(autoencoder.state_dict())
+        state['val_metrics'] = val_metrics
+        autoencoder.scheduler.step()
+
+    state.update({
+        'epochs': state['epochs'] + num_epochs,
+        'model': snapshot_state_dict(autoencoder.state_dict()),
+        'optimizer': snapshot_state_dict(autoencoder.optimizer.state_dict()),
+        'scheduler': autoencoder.scheduler.state_dict(),
+        'rng_state': torch.get_rng_state(),
+    })
+    return trial, state
+
+def sweep(configs, train_dataset, val_dataset, layout, num_epochs, batch_size=256, min_epochs=1, reduction_factor=2,
+          metric="loss_comp", num_workers=None, threads_per_worker=1, precision="float32", seed=42, return_states=False):
+    """
+    Train many Autoencoder configurations concurrently on already preprocessed data and prune weak ones early with
+    successive halving. Every rung trains the surviving trials to a larger epoch budget (multiplied by
+    reduction_factor, starting at min_epochs) and keeps the best 1/reduction_factor of them by best validation
+    metric, until one trial is left or num_epochs is reached. Trials continue from their model, optimizer and scheduler state
+    of the previous rung.
+
+    Args:
+        configs (list): One dict per trial. 'layers' holds the hidden layer sizes (the input width is taken from the
+                        layout), 'wlc' the weighted loss coefficients (defaults to (1, 1)), every other key is passed
+                        to Autoencoder (batch_norm defaults to True).
+        train_dataset (PlainDataset): The preprocessed training set. Its tensor is moved to shared memory and
+                                      shared with the workers instead of being copied.
+        val_dataset (PlainDataset): The preprocessed validation set, shared the same way.
+        layout (ColumnLayout): The column layout of the data, e.g. preprocessor.layout.
+        num_epochs (int): The maximum number of epochs of a trial.
+        batch_size (int, optional): The batch size. Defaults to 256.
+        min_epochs (int, optional): The epoch budget of the first rung. Defaults to 1.
+        reduction_factor (int, optional): The budget growth and pruning factor between rungs. Defaults to 2.
+        metric (str, optional): The validation metric trials are ranked by: "loss_comp" (CE + MSE, comparable across
+                                different wlc) or "loss" (weighted by wlc). Defaults to "loss_comp".
+        num_workers (int, optional): The number of worker processes. Defaults to min(len(configs), cpu count).
+        threads_per_worker (int, optional): Intra-op threads of every worker. Defaults to 1.
+        precision (str, optional): "float32" or "bfloat16", see Autoencoder.train_model. Defaults to "float32".
+        seed (int, optional): Seed of the model initialization and shuffling of every trial. Defaults to 42.
+        return_states (bool, optional): Also return the best state dict of every trial. Defaults to False.
+
+    Returns:
+        DataFrame: One row per trial ranked by rung reached and best validation metric, with its configuration,
+                   trained epochs and the validation loss, loss comp, CE loss and MSE loss of its last epoch.
+                   If return_states is True, also a dict mapping the trial number to its best state dict.
+    """
+    if (reduction_factor < 2):
+        raise ValueError(f"reduction_factor must be at least 2, got {reduction_factor}")
+    if (metric not in ("loss", "loss_comp")):
+        raise ValueError(f"Unsupported metric {metric}, expected 'loss' or 'loss_comp'")
+    if (num_workers is None):
+        num_workers = max(1, min(len(configs), os.cpu_count() or 1))
+    for dataset in (train_dataset, val_dataset):
+        if (not isinstance(dataset, MemmapDataset)):
+            dataset.data.share_memory_()
+
+    states = {trial: None for trial in range(len(configs))}
+    active = list(states)
+    budget = min(min_epochs, num_epochs)
+    rung = 0
+    rungs = {}
+    context = mp.get_context("spawn")
+    with context.Pool(num_workers, initializer=_init_worker,
+                      initargs=(train_dataset, val_dataset, layout, batch_size, precision, metric, threads_per_worker)) as pool:
+        while True:
+            jobs = [(trial, configs[trial], states[trial], budget - (states[trial]['epochs'] if states[trial] else 0), seed)
+                    for trial in active]
+            rung_progress = tqdm(pool.imap_unordered(_star_run_trial, jobs), total=len(jobs),
+                                 desc=f'Sweep rung {rung}, {budget} epochs', position=0, leave=True)
+            for trial, state in rung_progress:
+                states[trial] = state
+                rungs[trial] = rung
+            rung_progress.close()
+
+            if (len(active) <= 1 or budget >= num_epochs):
+                break
+            active = sorted(active, key=lambda trial: states[trial]['best_loss'])
+            active = active[:max(1, math.ceil(len(active) / reduction_factor))]
+            budget = min(budget * reduction_factor, num_epochs)
+            rung += 1
+
+    rows = []
+    for trial, config in enumerate(configs):
+        state = states[trial]
+        val_loss, val_loss_comp, val_CEloss, val_MSEloss = state['val_metrics']
+        rows.append({'trial': trial,
+                     **{key: value for key, value in config.items()},
+                     'rung': rungs[trial],
+                     'epochs': state['epochs'],
+                     f'best_val_{metric}': state['best_loss'],
+                     'val_loss': val_loss,
+                     'val_loss_comp': val_loss_comp,
+                     'val_CE_loss': val_CEloss,
+                     'val_MSE_loss': val_MSEloss})
+    results = pd.DataFrame(rows).sort_values(['rung', f'best_val_{metric}'], ascending=[False, True]).reset_index(drop=True)
+    results.insert(0, 'rank', range(1, len(results) + 1))
+    if (return_states):
+        return results, {trial: state['best_state_dict'] for trial, state in states.items()}
+    return results
+
+def _star_run_trial(args):
+    return _run_trial(*args)
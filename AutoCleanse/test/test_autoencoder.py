@@ -2,11 +2,13 @@ import pandas as pd
 import numpy as np
 import pytest
 import os
+import copy
 import torchsummary
 from AutoCleanse.autoencoder import *
 from AutoCleanse.bucketfs_client import *
 from AutoCleanse.dataloader import *
 from AutoCleanse.preprocessor import *
+from AutoCleanse.stream import clean_csv
 from sklearn.preprocessing import *
 from torch.optim.lr_scheduler import StepLR
 
@@ -99,4 +101,549 @@ def test_save_bucketfs(autoencoder_fixture):
 @pytest.mark.run(order=6)
 @pytest.mark.bucketfs
 def test_load_bucketfs(autoencoder_fixture):
-    autoencoder_fixture['autoencoder'].load("bucketfs","test")
\ No newline at end of file
+    autoencoder_fixture['autoencoder'].load("bucketfs","test")
+
+@pytest.mark.autoencoder
+def test_clean_memmap(autoencoder_fixture, tmp_path):
+    path = str(tmp_path / 'test.dat')
+    write_memmap(autoencoder_fixture['X_test'], path)
+    dataset = MemmapDataset(path)
+    cleaned_data = autoencoder_fixture['autoencoder'].clean(dirty_loader=create_dataloader(dataset, batch_size=1),
+                                                            df=dataset,
+                                                            batch_size=1,
+                                                            continous_columns=['Numerical'],
+                                                            categorical_columns=['Categorical'],
+                                                            og_columns=['Numerical','Categorical'],
+                                                            scaler=autoencoder_fixture['preprocessor'].scaler,
+                                                            onehotencoder=autoencoder_fixture['preprocessor'].encoder,
+                                                            device=autoencoder_fixture['device'])
+    assert cleaned_data.index.equals(autoencoder_fixture['X_test'].index)
+
+@pytest.mark.autoencoder
+def test_clean_csv(autoencoder_fixture, tmp_path):
+    input_path = str(tmp_path / 'dirty.csv')
+    output_path = str(tmp_path / 'cleaned.csv')
+    pd.DataFrame({'Numerical': [11,22,33,44,55,66,77], 'Categorical': ['A','C','B','A','D','C','B']}).to_csv(input_path, index=False)
+    stats = clean_csv(autoencoder=autoencoder_fixture['autoencoder'],
+                      preprocessor=autoencoder_fixture['preprocessor'],
+                      input_path=input_path,
+                      output_path=output_path,
+                      continous_columns=['Numerical'],
+                      categorical_columns=['Categorical'],
+                      chunksize=3,
+                      batch_size=2,
+                      device=autoencoder_fixture['device'])
+    cleaned_data = pd.read_csv(output_path)
+    assert stats['rows'] == len(cleaned_data) == 7
+    assert cleaned_data.columns.to_list() == ['Numerical','Categorical']
+
+@pytest.mark.autoencoder
+def test_full_coverage(autoencoder_fixture):
+    dataset = PlainDataset(autoencoder_fixture['X_test'])
+    loader = create_dataloader(dataset, batch_size=3, shuffle=True, drop_last=True)
+    autoencoder = autoencoder_fixture['autoencoder']
+    anonymized_data = autoencoder.anonymize(df=autoencoder_fixture['X_test'],
+                                            data_loader=loader,
+                                            batch_size=3,
+                                            device=autoencoder_fixture['device'])
+    assert anonymized_data.index.equals(autoencoder_fixture['X_test'].index)
+    with torch.no_grad():
+        expected = autoencoder.encoder(dataset.data.to(autoencoder_fixture['device'])).cpu().numpy()
+    assert np.allclose(anonymized_data.values, expected, atol=1e-6)
+
+    cleaned_data = autoencoder.clean(dirty_loader=loader,
+                                     test_loader=create_dataloader(dataset, batch_size=3, drop_last=True),
+                                     df=autoencoder_fixture['X_test'],
+                                     batch_size=3,
+                                     continous_columns=['Numerical'],
+                                     categorical_columns=['Categorical'],
+                                     og_columns=['Numerical','Categorical'],
+                                     scaler=autoencoder_fixture['preprocessor'].scaler,
+                                     onehotencoder=autoencoder_fixture['preprocessor'].encoder,
+                                     device=autoencoder_fixture['device'])
+    assert cleaned_data.index.equals(autoencoder_fixture['X_test'].index)
+
+@pytest.mark.autoencoder
+def test_clean_metrics(autoencoder_fixture, capsys):
+    autoencoder = autoencoder_fixture['autoencoder']
+    rng = np.random.default_rng(0)
+    X_test = autoencoder_fixture['X_test']
+    clean = pd.concat([X_test] * 6, ignore_index=True)
+    clean['Numerical'] = rng.uniform(0, 1, len(clean))
+    dirty = clean.copy()
+    dirty['Numerical'] += rng.normal(0, 0.3, len(clean))
+    clean_dataset = PlainDataset(clean)
+    dirty_dataset = PlainDataset(dirty)
+
+    # A shuffled dirty loader next to an unshuffled clean one, the rows must still be compared pairwise
+    autoencoder.clean(dirty_loader=create_dataloader(dirty_dataset, batch_size=5, shuffle=True, drop_last=True,
+                                                     generator=torch.Generator().manual_seed(0)),
+                      test_loader=create_dataloader(clean_dataset, batch_size=5),
+                      df=dirty,
+                      batch_size=5,
+                      scaler=autoencoder_fixture['preprocessor'].scaler,
+                      device=autoencoder_fixture['device'])
+    printed = capsys.readouterr().out
+    MAE = float(printed.split('MAE: ')[1].split()[0])
+    MSE = float(printed.split('MSE: ')[1].split()[0])
+
+    layout = autoencoder.layout
+    with torch.no_grad():
+        outputs = autoencoder(dirty_dataset.data.to(autoencoder_fixture['device'])).cpu()
+    cleaned = outputs.clone()
+    cleaned[:, layout.num_continous:] = argmax(outputs[:, layout.num_continous:], layout=layout)
+    assert MAE == pytest.approx((cleaned - clean_dataset.data).abs().mean().item(), abs=1e-7)
+    assert MSE == pytest.approx(((cleaned - clean_dataset.data) ** 2).mean().item(), abs=1e-7)
+
+@pytest.mark.autoencoder
+def test_embedding_mode():
+    df = pd.DataFrame({'Numerical': [11,22,33,44,55,66,77,88,99,00], 'Categorical': ['A','C','B','A','D','C','B','D','D','C']})
+    preprocessor = Preprocessor(scaler=MinMaxScaler(), encoder=OneHotEncoder(sparse_output=False, handle_unknown='ignore'))
+    train_set, val_set, test_set = preprocessor.split(df, 0.6, 0.2, 0.2, 42)
+    X_onehot = preprocessor.fit_transform(input_df=train_set.copy(), continous_columns=['Numerical'], categorical_columns=['Categorical'])
+    X_train = preprocessor.transform_codes(input_df=train_set, continous_columns=['Numerical'], categorical_columns=['Categorical'])
+    X_val = preprocessor.transform_codes(input_df=val_set, continous_columns=['Numerical'], categorical_columns=['Categorical'])
+    X_test = preprocessor.transform_codes(input_df=test_set, continous_columns=['Numerical'], categorical_columns=['Categorical'])
+    categories = preprocessor.encoder.categories_
+
+    autoencoder = Autoencoder(layers=[X_onehot.shape[1], 8, 2], batch_norm=False, cardinalities=preprocessor.layout.sizes, embedding_dims=2)
+    assert autoencoder.encoder[0].in_features == 1 + 2
+    device = torch.device("cpu")
+    autoencoder.train_model(patience=10,
+                            num_epochs=1,
+                            batch_size=2,
+                            categories=categories,
+                            train_loader=create_dataloader(PlainDataset(X_train), batch_size=2, shuffle=True),
+                            val_loader=create_dataloader(PlainDataset(X_val), batch_size=2),
+                            continous_columns=['Numerical'],
+                            categorical_columns=['Categorical'],
+                            device=device)
+
+    onehot = autoencoder.expand_codes(PlainDataset(X_train).data)
+    assert torch.equal(onehot, PlainDataset(X_onehot).data)
+
+    test_loader = create_dataloader(PlainDataset(X_test), batch_size=2)
+    cleaned_data = autoencoder.clean(dirty_loader=test_loader,
+                                     test_loader=test_loader,
+                                     df=X_test,
+                                     batch_size=2,
+                                     continous_columns=['Numerical'],
+                                     categorical_columns=['Categorical'],
+                                     og_columns=['Numerical','Categorical'],
+                                     scaler=preprocessor.scaler,
+                                     onehotencoder=preprocessor.encoder,
+                                     device=device)
+    assert cleaned_data.shape == (2, 2)
+    anonymized_data = autoencoder.anonymize(df=X_test, data_loader=test_loader, batch_size=2, device=device)
+    assert anonymized_data.shape == (2, 2)
+
+    # Cardinalities counting a NaN category the onehot output drops do not match the layout
+    mismatched = Autoencoder(layers=[X_onehot.shape[1], 8, 2], batch_norm=False,
+                             cardinalities=[size + 1 for size in preprocessor.layout.sizes], embedding_dims=2)
+    with pytest.raises(ValueError, match="cardinalities"):
+        mismatched.train_model(patience=10,
+                               num_epochs=1,
+                               batch_size=2,
+                               train_loader=create_dataloader(PlainDataset(X_train), batch_size=2),
+                               val_loader=create_dataloader(PlainDataset(X_val), batch_size=2),
+                               layout=preprocessor.layout,
+                               device=device)
+
+@pytest.mark.autoencoder
+def test_clean_layout(autoencoder_fixture):
+    cleaned_data = autoencoder_fixture['autoencoder'].clean(dirty_loader=autoencoder_fixture['test_loader'],
+                                                            df=autoencoder_fixture['X_test'],
+                                                            batch_size=1,
+                                                            scaler=autoencoder_fixture['preprocessor'].scaler,
+                                                            device=autoencoder_fixture['device'],
+                                                            layout=autoencoder_fixture['preprocessor'].layout)
+    assert cleaned_data.columns.to_list() == ['Numerical','Categorical']
+    assert set(cleaned_data['Categorical']) <= {'A','B','C','D'}
+
+@pytest.mark.autoencoder
+def test_bfloat16(autoencoder_fixture):
+    autoencoder = autoencoder_fixture['autoencoder']
+    autoencoder.train_model(patience=10,
+                            num_epochs=1,
+                            batch_size=1,
+                            train_loader=autoencoder_fixture['train_loader'],
+                            val_loader=autoencoder_fixture['val_loader'],
+                            device=autoencoder_fixture['device'],
+                            layout=autoencoder_fixture['preprocessor'].layout,
+                            precision="bfloat16")
+    assert all(parameter.dtype == torch.float32 for parameter in autoencoder.parameters())
+    cleaned_data = autoencoder.clean(dirty_loader=autoencoder_fixture['test_loader'],
+                                     df=autoencoder_fixture['X_test'],
+                                     batch_size=1,
+                                     scaler=autoencoder_fixture['preprocessor'].scaler,
+                                     device=autoencoder_fixture['device'],
+                                     precision="bfloat16")
+    assert cleaned_data.columns.to_list() == ['Numerical','Categorical']
+    with pytest.raises(ValueError):
+        autoencoder.anonymize(df=autoencoder_fixture['X_test'], data_loader=autoencoder_fixture['test_loader'],
+                              batch_size=1, device=autoencoder_fixture['device'], precision="float16")
+
+@pytest.mark.autoencoder
+def test_checkpoint_resume(autoencoder_fixture, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    layout = autoencoder_fixture['preprocessor'].layout
+    train_loader = create_dataloader(autoencoder_fixture['train_loader'].dataset, batch_size=2, shuffle=True, generator=torch.Generator().manual_seed(0))
+
+    def train(num_epochs, name, resume=False, seed=42, **kwargs):
+        torch.manual_seed(seed)
+        autoencoder = Autoencoder(layers=[layout.num_features, 8, 2], dropout_dec=[(0, 0.5)], batch_norm=False)
+        train_loader.sampler.generator.manual_seed(0)
+        autoencoder.train_model(patience=10, num_epochs=num_epochs, batch_size=2, train_loader=train_loader,
+                                val_loader=autoencoder_fixture['val_loader'], layout=layout,
+                                checkpoint_every=1, checkpoint_name=name, resume=resume, **kwargs)
+        return autoencoder
+
+    # The val_subsample screen resumes from the subsample loss of the best model: a negative tolerance screens out
+    # every full pass after the first, which a resume without it would run
+    for name, kwargs in (('', {}), ('subsampled_', {'val_subsample': 1.0, 'val_subsample_tolerance': -0.5})):
+        full = train(3, f'{name}full', **kwargs)
+        train(2, f'{name}resumed', **kwargs)
+        resumed = train(3, f'{name}resumed', resume=True, seed=0, **kwargs)
+        assert os.path.exists(f'autoencoder_{name}resumed_checkpoint.pth')
+        # '_extra_state' holds the training settings, every other entry is a tensor
+        for key, value in full.state_dict().items():
+            assert value == resumed.state_dict()[key] if key == '_extra_state' else torch.equal(value, resumed.state_dict()[key])
+        for key, value in full.best_state_dict.items():
+            assert value == resumed.best_state_dict[key] if key == '_extra_state' else torch.equal(value, resumed.best_state_dict[key])
+        assert full.optimizer.state_dict()['state'][0]['step'] == resumed.optimizer.state_dict()['state'][0]['step']
+
+@pytest.mark.autoencoder
+def test_train_distributed(autoencoder_fixture, tmp_path, monkeypatch):
+    from AutoCleanse.distributed import train_distributed
+    monkeypatch.chdir(tmp_path)
+    layout = autoencoder_fixture['preprocessor'].layout
+    autoencoder = Autoencoder(layers=[layout.num_features, 8, 2], batch_norm=False)
+    initial = snapshot_state_dict(autoencoder.state_dict())
+    train_distributed(autoencoder, 2, autoencoder_fixture['train_loader'].dataset, autoencoder_fixture['val_loader'].dataset,
+                      num_epochs=2, batch_size=2, patience=10, layout=layout, threads_per_process=1)
+    assert autoencoder.best_state_dict is not None
+    assert autoencoder.layout == layout
+    # The unseeded encoder can have a dead latent ReLU on the few rows, the output layer always trains
+    assert any(not torch.equal(initial[key], value) for key, value in autoencoder.state_dict().items() if key != '_extra_state')
+    assert autoencoder.scheduler.last_epoch == 2
+
+    # Saving the best weights does not replace the final weights in the trained model. One process, since the
+    # gloo all-reduce of several processes is not bitwise reproducible between runs. The large learning rate makes
+    # the final weights differ from the best ones
+    trained = []
+    for save_location in (None, "local"):
+        torch.manual_seed(0)
+        model = Autoencoder(layers=[layout.num_features, 8, 2], batch_norm=False, learning_rate=3.0)
+        train_distributed(model, 1, autoencoder_fixture['train_loader'].dataset, autoencoder_fixture['val_loader'].dataset,
+                          num_epochs=4, batch_size=2, patience=10, layout=layout, threads_per_process=1,
+                          save_location=save_location, save_name="distributed")
+        trained.append(model.state_dict())
+    assert os.path.exists('autoencoder_distributed.pth')
+    assert any(not torch.equal(value, model.best_state_dict[key]) for key, value in trained[0].items() if key != '_extra_state')
+    for key, value in trained[0].items():
+        assert value == trained[1][key] if key == '_extra_state' else torch.equal(value, trained[1][key])
+
+    for batch_size in (1, 3):
+        with pytest.raises(ValueError, match="multiple of num_processes"):
+            train_distributed(autoencoder, 2, autoencoder_fixture['train_loader'].dataset, autoencoder_fixture['val_loader'].dataset,
+                              num_epochs=1, batch_size=batch_size, patience=10, layout=layout)
+
+@pytest.mark.autoencoder
+def test_sweep(autoencoder_fixture):
+    from AutoCleanse.sweep import sweep
+    configs = [{'layers': [8, 2], 'wlc': (1,1), 'batch_norm': False},
+               {'layers': [16, 4], 'wlc': (1,5), 'batch_norm': False},
+               {'layers': [4], 'wlc': (1,1), 'batch_norm': False, 'learning_rate': 1e-2}]
+    results, states = sweep(configs, autoencoder_fixture['train_loader'].dataset, autoencoder_fixture['val_loader'].dataset,
+                            autoencoder_fixture['preprocessor'].layout, num_epochs=4, batch_size=2, min_epochs=1,
+                            num_workers=2, return_states=True)
+    assert results['rank'].tolist() == [1, 2, 3]
+    assert sorted(results['trial']) == [0, 1, 2]
+    # 3 trials at 1 epoch, the best 2 at 2 epochs, the best one at 4 epochs
+    assert sorted(results['epochs']) == [1, 2, 4]
+    assert results.loc[0, 'epochs'] == 4
+    best = Autoencoder(layers=[autoencoder_fixture['preprocessor'].layout.num_features] + configs[results.loc[0, 'trial']]['layers'], batch_norm=False)
+    best.load_state_dict(states[results.loc[0, 'trial']])
+
+@pytest.mark.autoencoder
+@pytest.mark.parametrize("backend", ["eager", "torchscript", "compile"])
+def test_compile_inference(autoencoder_fixture, backend):
+    autoencoder = autoencoder_fixture['autoencoder']
+    layout = autoencoder_fixture['preprocessor'].layout
+    kwargs = dict(dirty_loader=autoencoder_fixture['test_loader'], df=autoencoder_fixture['X_test'], batch_size=1,
+                  scaler=autoencoder_fixture['preprocessor'].scaler, device=autoencoder_fixture['device'], layout=layout)
+    expected = autoencoder.clean(**kwargs)
+    autoencoder.compile_inference(layout=layout, backend=backend, device=autoencoder_fixture['device'], example_batch_size=4)
+    autoencoder.compile_inference(layout=layout, output="encode", backend=backend, device=autoencoder_fixture['device'], example_batch_size=4)
+    assert autoencoder._inference_graphs['clean']['backend'] == backend
+    pd.testing.assert_frame_equal(autoencoder.clean(compiled=True, **kwargs), expected)
+
+    anonymize_kwargs = dict(df=autoencoder_fixture['X_test'], data_loader=autoencoder_fixture['test_loader'], batch_size=1,
+                            device=autoencoder_fixture['device'], layout=layout)
+    expected = autoencoder.anonymize(**anonymize_kwargs)
+    pd.testing.assert_frame_equal(autoencoder.anonymize(compiled=True, **anonymize_kwargs), expected, atol=1e-6)
+
+@pytest.mark.autoencoder
+def test_onnx(autoencoder_fixture, tmp_path):
+    pytest.importorskip("onnx")
+    pytest.importorskip("onnxruntime")
+    from AutoCleanse.onnx_backend import OnnxCleaner
+    autoencoder = autoencoder_fixture['autoencoder']
+    layout = autoencoder_fixture['preprocessor'].layout
+    X_test = autoencoder_fixture['X_test']
+    autoencoder.export_onnx(str(tmp_path / 'clean.onnx'), layout=layout)
+    autoencoder.export_onnx(str(tmp_path / 'encode.onnx'), layout=layout, output="encode")
+
+    cleaner = OnnxCleaner(str(tmp_path / 'clean.onnx'))
+    assert cleaner.layout == layout
+    expected = autoencoder.clean(dirty_loader=autoencoder_fixture['test_loader'], df=X_test, batch_size=1,
+                                 scaler=autoencoder_fixture['preprocessor'].scaler, device=autoencoder_fixture['device'], layout=layout)
+    pd.testing.assert_frame_equal(cleaner.clean(X_test, autoencoder_fixture['preprocessor'].scaler, batch_size=1), expected)
+
+    expected = autoencoder.anonymize(df=X_test, data_loader=autoencoder_fixture['test_loader'], batch_size=1, device=autoencoder_fixture['device'])
+    anonymized = OnnxCleaner(str(tmp_path / 'encode.onnx')).anonymize(X_test, batch_size=1)
+    pd.testing.assert_frame_equal(anonymized, expected, atol=1e-5)
+    with pytest.raises(ValueError):
+        cleaner.anonymize(X_test)
+
+    # Group sizes too uneven for the padded argmax export the segment reductions
+    sizes = (2, 2, 2, 2, 100)
+    uneven = ColumnLayout(['x'], [f"c{i}" for i in range(len(sizes))], [np.arange(size) for size in sizes])
+    assert uneven.pad_index is None
+    model = Autoencoder(layers=[uneven.num_features, 4], batch_norm=False)
+    model.export_onnx(str(tmp_path / 'uneven.onnx'), layout=uneven)
+    inputs = torch.randn(5, uneven.num_features)
+    with torch.no_grad():
+        expected = InferenceGraph(model, uneven)(inputs).numpy()
+    assert np.array_equal(OnnxCleaner(str(tmp_path / 'uneven.onnx')).run(inputs.numpy()), expected)
+
+@pytest.mark.autoencoder
+def test_quantize(autoencoder_fixture, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    layout = autoencoder_fixture['preprocessor'].layout
+    autoencoder = Autoencoder(layers=[layout.num_features, 16, 4], batch_norm=True)
+    autoencoder.train_model(patience=10, num_epochs=2, batch_size=2,
+                            train_loader=create_dataloader(autoencoder_fixture['train_loader'].dataset, batch_size=2, shuffle=True),
+                            val_loader=autoencoder_fixture['val_loader'], layout=layout)
+    autoencoder.load_state_dict(autoencoder.best_state_dict)
+    quantized = autoencoder.quantize()
+    assert quantized.quantized and not autoencoder.quantized
+    assert not any(isinstance(module, nn.BatchNorm1d) for module in quantized.modules())
+    assert not any(type(module) is nn.Linear for module in quantized.modules())
+
+    inputs = PlainDataset(autoencoder_fixture['X_test']).data
+    with torch.no_grad():
+        assert torch.allclose(quantized(inputs), autoencoder.eval()(inputs), atol=0.1)
+    cleaned_data = quantized.clean(dirty_loader=autoencoder_fixture['test_loader'], df=autoencoder_fixture['X_test'], batch_size=1,
+                                   scaler=autoencoder_fixture['preprocessor'].scaler, layout=layout)
+    assert cleaned_data.shape == (2, 2)
+
+    quantized.save("local", "test")
+    assert os.path.exists('autoencoder_test_int8.pth')
+    loaded = Autoencoder(layers=[layout.num_features, 16, 4], batch_norm=True)
+    loaded.load("local", "test", quantized=True)
+    with torch.no_grad():
+        assert torch.equal(loaded(inputs), quantized(inputs))
+    with pytest.raises(RuntimeError):
+        quantized.train_model(patience=1, num_epochs=1, batch_size=2, train_loader=autoencoder_fixture['train_loader'],
+                              val_loader=autoencoder_fixture['val_loader'], layout=layout)
+
+@pytest.mark.autoencoder
+def test_activation_regularization(autoencoder_fixture):
+    layout = autoencoder_fixture['preprocessor'].layout
+    inputs = PlainDataset(autoencoder_fixture['X_test']).data
+    autoencoder = Autoencoder(layers=[layout.num_features, 8, 2], batch_norm=False, l1_strength=1e-2, l2_strength=1e-3)
+    assert not any(len(module._forward_hooks) for module in autoencoder.modules())
+
+    autoencoder.train()
+    outputs, penalty = autoencoder(inputs, return_penalty=True)
+    hidden = torch.relu(autoencoder.encoder[0](inputs))
+    latent = torch.relu(autoencoder.encoder[2](hidden))
+    expected = sum(1e-2 * a.abs().mean() + 1e-3 * (a ** 2).mean() for a in (hidden, latent))
+    assert torch.allclose(penalty, expected)
+    assert penalty.requires_grad
+    # Same outputs as the plain forward pass, the penalty is a loss term only
+    autoencoder.eval()
+    assert torch.allclose(outputs, autoencoder(inputs))
+    assert autoencoder(inputs, return_penalty=True)[1] == 0.0
+
+    autoencoder = Autoencoder(layers=[layout.num_features, 8, 2], batch_norm=False)
+    autoencoder.train()
+    assert autoencoder(inputs, return_penalty=True)[1] == 0.0
+
+@pytest.mark.autoencoder
+def test_regularization_deepcopy(autoencoder_fixture):
+    # No graph of a training step stays on the module, so a trained model can be copied and quantized
+    layout = autoencoder_fixture['preprocessor'].layout
+    autoencoder = Autoencoder(layers=[layout.num_features, 8, 2], batch_norm=True, l1_strength=1e-2, l2_strength=1e-3)
+    autoencoder.train_model(patience=10, num_epochs=1, batch_size=2,
+                            train_loader=create_dataloader(autoencoder_fixture['train_loader'].dataset, batch_size=2),
+                            val_loader=autoencoder_fixture['val_loader'], layout=layout)
+    copy.deepcopy(autoencoder)
+    quantized = autoencoder.quantize()
+    assert quantized.quantized
+
+@pytest.mark.autoencoder
+def test_batch_size_and_accumulation(autoencoder_fixture, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    layout = autoencoder_fixture['preprocessor'].layout
+    dataset = PlainDataset(pd.concat([autoencoder_fixture['X_test']] * 40))
+    autoencoder = Autoencoder(layers=[layout.num_features, 8, 2], batch_norm=True, learning_rate=1e-3)
+    state = {key: value.clone() for key, value in autoencoder.state_dict().items() if key != '_extra_state'}
+
+    probe = autoencoder.find_batch_size(dataset, layout=layout, candidates=[8, 16, 32], steps=1)
+    assert probe['batch_size'] in (8, 16, 32)
+    assert set(probe['probes']) == {8, 16, 32}
+    # The probe trains a copy
+    assert all(torch.equal(value, autoencoder.state_dict()[key]) for key, value in state.items())
+    budget = autoencoder.find_batch_size(dataset, layout=layout, candidates=[16], steps=1)['memory_bytes']
+    limited = autoencoder.find_batch_size(dataset, layout=layout, candidates=[8, 16, 32], steps=1, memory_budget=budget)
+    assert set(limited['probes']) == {8, 16}
+
+    # Accumulating 4 batches of 8 rows is one optimizer step over 32 rows, at 4x the learning rate of the loaders,
+    # plus a step for the last incomplete accumulation
+    train_loader = create_dataloader(dataset, 8, drop_last=True)
+    autoencoder.train_model(num_epochs=1, batch_size=8, patience=1, train_loader=train_loader,
+                            val_loader=create_dataloader(dataset, 8), layout=layout, effective_batch_size=32)
+    assert autoencoder.training_config['accumulation_steps'] == 4
+    assert autoencoder.training_config['effective_batch_size'] == 32
+    assert autoencoder.optimizer.param_groups[0]['lr'] == pytest.approx(4e-3)
+    assert autoencoder.optimizer.state[autoencoder.encoder[0].weight]['step'] == (len(train_loader) + 3) // 4
+
+    autoencoder.train_model(num_epochs=1, batch_size=8, patience=1, train_loader=train_loader,
+                            val_loader=create_dataloader(dataset, 8), layout=layout, auto_batch_size=True)
+    assert autoencoder.training_config['auto_batch_size']
+    assert autoencoder.training_config['samples_per_sec'] > 0
+    assert autoencoder.optimizer.param_groups[0]['lr'] == pytest.approx(1e-3 * autoencoder.training_config['batch_size'] / 8)
+    # Loaders of another batch size without auto_batch_size or effective_batch_size keep the learning rate
+    learning_rate = autoencoder.optimizer.param_groups[0]['lr']
+    autoencoder.train_model(num_epochs=1, batch_size=16, patience=1, train_loader=create_dataloader(dataset, 16),
+                            val_loader=create_dataloader(dataset, 16), layout=layout)
+    assert autoencoder.optimizer.param_groups[0]['lr'] == pytest.approx(learning_rate)
+
+    # The settings are saved with the weights, and files without them still load
+    autoencoder.save("local", "settings")
+    loaded = Autoencoder(layers=[layout.num_features, 8, 2], batch_norm=True)
+    loaded.load("local", "settings")
+    assert loaded.training_config == autoencoder.training_config
+    old_state = {key: value for key, value in autoencoder.state_dict().items() if key != '_extra_state'}
+    torch.save(old_state, "autoencoder_old.pth")
+    loaded = Autoencoder(layers=[layout.num_features, 8, 2], batch_norm=True)
+    loaded.load("local", "old")
+    assert loaded.training_config == {}
+
+@pytest.mark.autoencoder
+def test_incomplete_accumulation(autoencoder_fixture):
+    # The last incomplete accumulation averages the gradients of its own batches
+    layout = autoencoder_fixture['preprocessor'].layout
+    inputs = PlainDataset(pd.concat([autoencoder_fixture['X_test']] * 4)).data
+    autoencoder = Autoencoder(layers=[layout.num_features, 8, 2], batch_norm=False)
+    autoencoder.layout = layout
+    batches = [(inputs[:4], None), (inputs[4:], None)]
+    expected = copy.deepcopy(autoencoder)
+    losses = [sum(loss_CEMSE(batch, expected(batch), layout=layout)) for batch, _ in batches]
+    (sum(losses) / len(losses)).backward()
+
+    gradients = []
+    autoencoder.optimizer.step = lambda: gradients.append([parameter.grad.clone() for parameter in autoencoder.parameters()])
+    autoencoder.train()
+    autoencoder._train_epoch(autoencoder, batches, "cpu", (1,1), "float32", accumulation_steps=4)
+    assert len(gradients) == 1
+    for gradient, parameter in zip(gradients[0], expected.parameters()):
+        assert torch.allclose(gradient, parameter.grad, atol=1e-6)
+
+@pytest.mark.autoencoder
+def test_subsampled_validation(autoencoder_fixture):
+    layout = autoencoder_fixture['preprocessor'].layout
+    dataset = PlainDataset(pd.concat([autoencoder_fixture['X_test']] * 20))
+    val_dataset = PlainDataset(pd.concat([autoencoder_fixture['X_test']] * 10))
+    autoencoder = Autoencoder(layers=[layout.num_features, 8, 2], batch_norm=False)
+
+    # Record the rows of every validation pass and whether best_state_dict changed since the previous pass
+    passes = []
+    validate = autoencoder._validate
+    def recording_validate(batches, *args):
+        batches = list(batches)
+        passes.append((sum(len(inputs) for inputs, _ in batches), autoencoder.best_state_dict))
+        return validate(batches, *args)
+    autoencoder._validate = recording_validate
+    autoencoder.train_model(num_epochs=5, batch_size=8, patience=100, train_loader=create_dataloader(dataset, 8, shuffle=True),
+                            val_loader=create_dataloader(val_dataset, 8), layout=layout,
+                            validate_every=2, validate_every_steps=3, val_subsample=0.25)
+    passes.append((None, autoencoder.best_state_dict))
+
+    # 3 epoch-end validations (epochs 2, 4 and the last) and one after batch 3 of the 5 batches of every epoch
+    estimates = [rows for rows, _ in passes[:-1] if rows == len(val_dataset) // 4]
+    assert len(estimates) == 3 + 5
+    assert all(rows in (len(val_dataset) // 4, len(val_dataset)) for rows, _ in passes[:-1])
+    assert autoencoder.best_state_dict is not None
+    # best_state_dict only changes right after a full validation pass
+    for (rows, best), (_, next_best) in zip(passes, passes[1:]):
+        if (next_best is not best):
+            assert rows == len(val_dataset)
+
+@pytest.mark.autoencoder
+def test_subsampled_validation_checkpoint(autoencoder_fixture):
+    layout = autoencoder_fixture['preprocessor'].layout
+    dataset = PlainDataset(pd.concat([autoencoder_fixture['X_test']] * 20))
+    val_dataset = PlainDataset(pd.concat([autoencoder_fixture['X_test']] * 10))
+    # A whole-set subsample validates on the same rows as the full set
+    autoencoder = Autoencoder(layers=[layout.num_features, 8, 2], batch_norm=False)
+    assert len(autoencoder._validation_subsample(val_dataset, 1.0, layout)) == len(val_dataset)
+
+    # Screening on a subsample whose loss is biased above the full-set loss still selects the same checkpoint as
+    # validating every epoch on the full set
+    biased = val_dataset.data.clone()
+    biased[:, 0] += 1
+    best_state_dicts = []
+    for val_subsample in (None, 0.5):
+        torch.manual_seed(0)
+        autoencoder = Autoencoder(layers=[layout.num_features, 8, 2], batch_norm=False)
+        autoencoder._validation_subsample = lambda *args: biased
+        autoencoder.train_model(num_epochs=6, batch_size=8, patience=100, layout=layout,
+                                train_loader=create_dataloader(dataset, 8, shuffle=True, generator=torch.Generator().manual_seed(0)),
+                                val_loader=create_dataloader(val_dataset, 8), val_subsample=val_subsample)
+        best_state_dicts.append(autoencoder.best_state_dict)
+    full, subsampled = best_state_dicts
+    for name in full:
+        if (name.endswith('_extra_state')):
+            continue
+        assert torch.equal(full[name], subsampled[name])
+
+@pytest.mark.autoencoder
+def test_profiler(autoencoder_fixture, tmp_path):
+    from AutoCleanse.profiler import Profiler, NULL_PROFILER
+    import json
+    layout = autoencoder_fixture['preprocessor'].layout
+    dataset = PlainDataset(pd.concat([autoencoder_fixture['X_test']] * 10))
+    autoencoder = Autoencoder(layers=[layout.num_features, 8, 2], batch_norm=False)
+
+    profiler = Profiler(path=tmp_path / 'profile.json')
+    autoencoder.train_model(num_epochs=2, batch_size=4, patience=10, train_loader=create_dataloader(dataset, 4),
+                            val_loader=create_dataloader(dataset, 4), layout=layout, profiler=profiler)
+    autoencoder.clean(dirty_loader=create_dataloader(dataset, 4), df=autoencoder_fixture['X_test'].iloc[[0, 1] * 10],
+                      batch_size=4, scaler=autoencoder_fixture['preprocessor'].scaler, progress=False, profiler=profiler)
+    assert [record['label'] for record in profiler.records] == ['epoch_1', 'epoch_2', 'clean']
+    epoch = profiler.records[0]
+    assert {"data", "to_device", "forward", "loss", "backward", "optimizer", "validation"} <= set(epoch['phases'])
+    assert epoch['counters'] == {'batches': 5, 'rows': 20, 'optimizer_steps': 5}
+    assert epoch['phases']['forward']['calls'] == 5
+    assert {"forward", "argmax", "decode"} <= set(profiler.records[2]['phases'])
+    assert profiler.summary()['counters']['rows'] == 60
+    dumped = json.loads((tmp_path / 'profile.json').read_text())
+    assert len(dumped['records']) == 3 and dumped['total']['counters']['batches'] == 15
+    profiler.dump(tmp_path / 'profile.csv')
+    profile = pd.read_csv(tmp_path / 'profile.csv')
+    assert set(profile['record']) == {'epoch_1', 'epoch_2', 'clean', 'total'}
+
+    # torch.profiler capture labels the phases
+    profiler = Profiler(torch_profiler=True)
+    with profiler:
+        autoencoder.anonymize(df=autoencoder_fixture['X_test'].iloc[[0, 1] * 10], data_loader=create_dataloader(dataset, 4),
+                              batch_size=4, device="cpu", profiler=profiler)
+    assert "forward" in {event.key for event in profiler.torch_trace.key_averages()}
+
+    # A disabled profiler records nothing and returns the same no-op context every time
+    assert NULL_PROFILER.phase("forward") is NULL_PROFILER.phase("loss")
+    NULL_PROFILER.count("rows")
+    assert NULL_PROFILER.end_record("epoch") is None and NULL_PROFILER.records == []
@@ -0,0 +1,104 @@
+import pandas as pd
+import numpy as np
+import pytest
+import torch
+from AutoCleanse.dataloader import *
+
+@pytest.fixture
+def data_fixture():
+    data = pd.DataFrame({'A': np.arange(10, dtype=float), 'B': np.arange(10, 20, dtype=float)}, index=np.arange(100, 110))
+    targets = pd.DataFrame({'T_0': [0.0, 1.0] * 5, 'T_1': [1.0, 0.0] * 5}, index=data.index)
+    return data, targets
+
+@pytest.mark.dataloader
+def test_plain_dataset(data_fixture):
+    data, _ = data_fixture
+    dataset = PlainDataset(data)
+    assert dataset.data.dtype == torch.float32 and dataset.data.is_contiguous()
+    row, idx = dataset[3]
+    assert idx == 3
+    assert torch.equal(row, torch.tensor([3.0, 13.0]))
+    batch, indices = dataset[torch.tensor([1, 4])]
+    assert torch.equal(batch, torch.tensor(data.iloc[[1, 4]].values, dtype=torch.float32))
+    assert torch.equal(indices, torch.tensor([1, 4]))
+
+@pytest.mark.dataloader
+@pytest.mark.parametrize("idx", [slice(None, 2), slice(-2, None), slice(0, 4, 2), slice(None, None, 3), slice(8, 20)])
+def test_dataset_slices(data_fixture, idx):
+    data, targets = data_fixture
+    expected = torch.arange(10)[idx]
+    batch, indices = PlainDataset(data)[idx]
+    assert torch.equal(indices, expected)
+    assert torch.equal(batch, torch.tensor(data.values[idx], dtype=torch.float32))
+    batch, target, indices = ClfDataset(data, targets)[idx]
+    assert torch.equal(indices, expected)
+    assert torch.equal(target, torch.tensor(targets.values[idx], dtype=torch.float32))
+
+@pytest.mark.dataloader
+def test_create_dataloader(data_fixture):
+    data, _ = data_fixture
+    dataset = PlainDataset(data)
+
+    loader = create_dataloader(dataset, batch_size=4, shuffle=False, drop_last=False)
+    batches = list(loader)
+    assert len(loader) == len(batches) == 3
+    assert torch.equal(torch.cat([b[0] for b in batches]), dataset.data)
+    assert torch.equal(torch.cat([b[1] for b in batches]), torch.arange(10))
+
+    loader = create_dataloader(dataset, batch_size=4, shuffle=True, drop_last=True, generator=torch.Generator().manual_seed(0))
+    batches = list(loader)
+    assert len(loader) == len(batches) == 2
+    for inputs, indices in batches:
+        assert inputs.shape == (4, 2)
+        assert torch.equal(inputs, dataset.data[indices])
+
+@pytest.mark.dataloader
+def test_clf_dataset(data_fixture):
+    data, targets = data_fixture
+    dataset = ClfDataset(data, targets)
+    loader = create_dataloader(dataset, batch_size=5)
+    inputs, target, indices = next(iter(loader))
+    assert torch.equal(inputs, torch.tensor(data.values[:5], dtype=torch.float32))
+    assert torch.equal(target, torch.tensor(targets.values[:5], dtype=torch.float32))
+    assert torch.equal(indices, torch.arange(5))
+
+@pytest.mark.dataloader
+def test_memmap_dataset(data_fixture, tmp_path):
+    data, _ = data_fixture
+    path = str(tmp_path / 'train.dat')
+    write_memmap((data.iloc[i:i + 3] for i in range(0, len(data), 3)), path, metadata={'continous_columns': ['A', 'B']})
+
+    dataset = MemmapDataset(path)
+    assert len(dataset) == 10 and dataset.shape == (10, 2)
+    assert dataset.columns.to_list() == ['A', 'B']
+    assert dataset.index.equals(data.index)
+    assert dataset.metadata == {'continous_columns': ['A', 'B']}
+    assert torch.equal(dataset.data, PlainDataset(data).data)
+
+    inputs, indices = next(iter(create_dataloader(dataset, batch_size=4, num_workers=1)))
+    assert torch.equal(inputs, torch.tensor(data.values[:4], dtype=torch.float32))
+    assert torch.equal(indices, torch.arange(4))
+
+@pytest.mark.dataloader
+def test_sampler_shards(data_fixture):
+    data, _ = data_fixture
+    dataset = PlainDataset(data)
+    for shuffle in (False, True):
+        samplers = [TensorBatchSampler(dataset, batch_size=2, shuffle=shuffle, num_replicas=3, rank=rank, seed=7) for rank in range(3)]
+        for sampler in samplers:
+            sampler.set_epoch(1)
+        shards = [torch.cat(list(sampler)) for sampler in samplers]
+        assert all(len(sampler) == 2 for sampler in samplers)
+        assert all(len(shard) == 4 for shard in shards)
+        # 10 rows over 3 ranks: every row is seen, 2 rows are repeated as padding
+        assert set(torch.cat(shards).tolist()) == set(range(10))
+    samplers[0].set_epoch(2)
+    assert not torch.equal(torch.cat(list(samplers[0])), shards[0])
+
+@pytest.mark.dataloader
+def test_stratified_subsample():
+    strata = torch.tensor([0] * 60 + [1] * 30 + [2] * 10)
+    indices = stratified_subsample(strata, 20, generator=torch.Generator().manual_seed(0))
+    assert len(indices) == 20 and len(indices.unique()) == 20
+    assert torch.bincount(strata[indices]).tolist() == [12, 6, 2]
+    assert torch.equal(indices, stratified_subsample(strata, 20, generator=torch.Generator().manual_seed(0)))
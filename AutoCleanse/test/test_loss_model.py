@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+from AutoCleanse.loss_model import loss_CEMSE
+
+@pytest.fixture
+def loss_fixture():
+    torch.manual_seed(42)
+    categories = [np.array(['A', 'B', 'C']), np.array(['X', 'Y']), np.array(['P', 'Q', 'R', 'S'])]
+    codes = torch.stack([torch.randint(0, len(c), (16,)) for c in categories], dim=1)
+    onehot = torch.cat([nn.functional.one_hot(codes[:, i], len(c)).float() for i, c in enumerate(categories)], dim=1)
+    continous = torch.rand(16, 2)
+    input = torch.cat([continous, onehot], dim=1)
+    outputs = torch.randn(16, input.shape[1])
+    return {'categories': categories, 'codes': codes, 'input': input, 'outputs': outputs}
+
+def reference_CEMSE(input, outputs, categories, num_continous):
+    CEloss = 0
+    start_index = num_continous
+    for category in categories:
+        end_index = start_index + len(category)
+        CEloss += nn.CrossEntropyLoss()(outputs[:, start_index:end_index], torch.argmax(input[:, start_index:end_index], dim=1))
+        start_index = end_index
+    MSEloss = nn.MSELoss()(outputs[:, :num_continous], input[:, :num_continous])
+    return CEloss, MSEloss
+
+@pytest.mark.loss_model
+def test_loss_CEMSE(loss_fixture):
+    input, outputs, categories = loss_fixture['input'], loss_fixture['outputs'], loss_fixture['categories']
+    CEloss, MSEloss = loss_CEMSE(input, outputs, categories, ['a', 'b'], ['c1', 'c2', 'c3'])
+    CEloss_ref, MSEloss_ref = reference_CEMSE(input, outputs, categories, 2)
+    assert torch.allclose(CEloss, CEloss_ref, atol=1e-5)
+    assert torch.allclose(MSEloss, MSEloss_ref)
+
+@pytest.mark.loss_model
+def test_loss_CEMSE_gradient(loss_fixture):
+    input, categories = loss_fixture['input'], loss_fixture['categories']
+    outputs = loss_fixture['outputs'].clone().requires_grad_()
+    outputs_ref = loss_fixture['outputs'].clone().requires_grad_()
+    CEloss, MSEloss = loss_CEMSE(input, outputs, categories, ['a', 'b'], ['c1', 'c2', 'c3'])
+    (CEloss + 5 * MSEloss).backward()
+    CEloss_ref, MSEloss_ref = reference_CEMSE(input, outputs_ref, categories, 2)
+    (CEloss_ref + 5 * MSEloss_ref).backward()
+    assert torch.allclose(outputs.grad, outputs_ref.grad, atol=1e-6)
+
+@pytest.mark.loss_model
+def test_loss_CEMSE_codes(loss_fixture):
+    input, outputs, categories = loss_fixture['input'], loss_fixture['outputs'], loss_fixture['categories']
+    input_codes = torch.cat([input[:, :2], loss_fixture['codes'].float()], dim=1)
+    CEloss, MSEloss = loss_CEMSE(input_codes, outputs, categories, ['a', 'b'], ['c1', 'c2', 'c3'], categorical_codes=True)
+    CEloss_ref, MSEloss_ref = reference_CEMSE(input, outputs, categories, 2)
+    assert torch.allclose(CEloss, CEloss_ref, atol=1e-5)
+    assert torch.allclose(MSEloss, MSEloss_ref)
+
+@pytest.mark.loss_model
+def test_loss_CEMSE_single_type(loss_fixture):
+    input, outputs, categories = loss_fixture['input'], loss_fixture['outputs'], loss_fixture['categories']
+    CEloss, MSEloss = loss_CEMSE(input[:, 2:], outputs[:, 2:], categories, [], ['c1', 'c2', 'c3'])
+    assert torch.allclose(CEloss, reference_CEMSE(input, outputs, categories, 2)[0], atol=1e-5)
+    assert MSEloss.item() == 0
+    CEloss, MSEloss = loss_CEMSE(input[:, :2], outputs[:, :2], [], ['a', 'b'], [])
+    assert CEloss.item() == 0
+    assert torch.allclose(MSEloss, nn.MSELoss()(outputs[:, :2], input[:, :2]))
@@ -5,6 +5,7 @@ import pytest
 from AutoCleanse.preprocessor import *
 from AutoCleanse.bucketfs_client import *
 from AutoCleanse.utils import replace_with_nan
+from AutoCleanse.stream import fit_csv
 from sklearn.preprocessing import *
 
 data = {'Numerical': [11, 22, 33, 44, 55, 66, 77, 88, 99, 00], 
@@ -183,3 +184,202 @@ def test_preprocessor_cat_local(preprocessor_fixture):
         os.remove(f"preprocessor_test.pkl")
 
     print("test_preprocessor_cat_local: OK")
+
+@pytest.mark.preprocessor
+def test_transform_codes(preprocessor_fixture):
+    df = pd.DataFrame(data)
+    preprocessor_fixture.fit_transform(
+        input_df=df.copy(),
+        continous_columns=['Numerical'],
+        categorical_columns=['Categorical']
+    )
+    df_codes = preprocessor_fixture.transform_codes(
+        input_df=pd.DataFrame({'Numerical': [0, 99], 'Categorical': ['D', 'B']}),
+        continous_columns=['Numerical'],
+        categorical_columns=['Categorical']
+    )
+    assert df_codes.columns.to_list() == ['Numerical', 'Categorical']
+    assert np.allclose(df_codes.values, [[0.0, 3], [1.0, 1]])
+
+    with pytest.raises(ValueError):
+        preprocessor_fixture.transform_codes(
+            input_df=pd.DataFrame({'Numerical': [0], 'Categorical': ['E']}),
+            continous_columns=['Numerical'],
+            categorical_columns=['Categorical']
+        )
+
+@pytest.mark.preprocessor
+def test_layout(preprocessor_fixture):
+    df = pd.DataFrame(data)
+    df.loc[3, 'Categorical'] = np.nan
+    df_train = preprocessor_fixture.fit_transform(
+        input_df=df.copy(),
+        continous_columns=['Numerical'],
+        categorical_columns=['Categorical']
+    )
+    layout = preprocessor_fixture.layout
+    assert layout.num_features == df_train.shape[1] == 5
+    assert layout.sizes == (4,) and layout.offsets == (1,)
+    assert list(layout.categories[0]) == ['A', 'B', 'C', 'D']
+    assert layout.group_ids.tolist() == [0, 0, 0, 0]
+    with pytest.raises(AttributeError):
+        layout.sizes = (3,)
+
+    df_test = preprocessor_fixture.transform(
+        input_df=df.copy(),
+        continous_columns=['Numerical'],
+        categorical_columns=['Categorical']
+    )
+    assert df_test.columns.equals(df_train.columns)
+    decoded = layout.decode_categorical(df_test.values)
+    assert decoded['Categorical'].tolist()[:3] == ['A', 'C', 'B']
+
+    preprocessor_fixture.save("test", "local")
+    preprocessor2 = Preprocessor(scaler=MinMaxScaler(), encoder=OneHotEncoder(sparse_output=False))
+    preprocessor2.load("test", "local")
+    assert preprocessor2.layout == layout
+    if os.path.exists(f"preprocessor_test.pkl"):
+        os.remove(f"preprocessor_test.pkl")
+
+@pytest.mark.preprocessor
+def test_nan_fill():
+    df = pd.DataFrame(data)
+    dirty = pd.DataFrame({'Numerical': [np.nan, 11, np.nan, 99] * 250, 'Categorical': ['A'] * 1000})
+    nan_mask = dirty['Numerical'].isna().to_numpy()
+
+    def transform(**kwargs):
+        preprocessor = Preprocessor(scaler=MinMaxScaler(), encoder=OneHotEncoder(sparse_output=False), **kwargs)
+        preprocessor.fit_transform(input_df=df.copy(), continous_columns=['Numerical'], categorical_columns=['Categorical'])
+        return preprocessor.transform(input_df=dirty.copy(), continous_columns=['Numerical'],
+                                      categorical_columns=['Categorical'])['Numerical'].to_numpy()
+
+    # Seeded spikes are reproducible, lie in [-100, 100] and take both signs
+    spikes = transform(seed=0)
+    assert np.array_equal(spikes, transform(seed=0))
+    assert not np.array_equal(spikes, transform(seed=1))
+    assert np.all(np.abs(spikes[nan_mask]) <= 100)
+    assert (spikes[nan_mask] < 0).any() and (spikes[nan_mask] > 0).any()
+    assert np.allclose(spikes[~nan_mask], [11 / 99, 1.0] * 250)
+
+    assert np.all(transform(nan_fill="zero")[nan_mask] == 0.0)
+    assert np.allclose(transform(nan_fill="mean")[nan_mask], 0.5)
+    assert np.all(transform(nan_fill="sentinel", nan_sentinel=-5.0)[nan_mask] == -5.0)
+    with pytest.raises(ValueError):
+        Preprocessor(scaler=MinMaxScaler(), encoder=OneHotEncoder(sparse_output=False), nan_fill="median")
+
+@pytest.mark.preprocessor
+@pytest.mark.parametrize("encoder", [OneHotEncoder(sparse_output=False, handle_unknown='ignore'),
+                                     OneHotEncoder(sparse_output=False, drop='first', handle_unknown='ignore')])
+def test_transform_array(encoder):
+    df = pd.DataFrame(data)
+    df.loc[3, 'Categorical'] = np.nan
+    dirty = pd.DataFrame({'Numerical': [np.nan, 11, 50, np.nan, 0], 'Categorical': ['D', np.nan, 'E', 'A', 'B']})
+    dirty_before = dirty.copy()
+    columns = {'continous_columns': ['Numerical'], 'categorical_columns': ['Categorical']}
+
+    expected_preprocessor = Preprocessor(scaler=MinMaxScaler(), encoder=encoder, seed=0)
+    expected_preprocessor.fit_transform(input_df=df.copy(), **columns)
+    expected = expected_preprocessor.transform(input_df=dirty.copy(), **columns)
+
+    preprocessor = Preprocessor(scaler=MinMaxScaler(), encoder=encoder, seed=0).fit(df, **columns)
+    assert preprocessor.layout == expected_preprocessor.layout
+    values, names = preprocessor.transform_array(dirty, **columns)
+    assert values.dtype == np.float32
+    assert names == expected.columns.to_list()
+    assert np.array_equal(values, expected.to_numpy(dtype=np.float32))
+    # The input frame is left untouched
+    pd.testing.assert_frame_equal(dirty, dirty_before)
+
+    out = np.full(values.shape, 7, dtype=np.float32)
+    preprocessor.transform_array(dirty, out=out, **columns)
+    assert np.array_equal(out[:, 1:], values[:, 1:])
+    with pytest.raises(ValueError):
+        preprocessor.transform_array(dirty, out=np.zeros((1, 1), dtype=np.float32), **columns)
+
+@pytest.mark.preprocessor
+@pytest.mark.parametrize("encoder", [OneHotEncoder(sparse_output=False, handle_unknown='ignore'),
+                                     OneHotEncoder(sparse_output=False, drop='if_binary')])
+def test_parallel_fit_transform(encoder):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'Numerical': rng.uniform(0, 100, 50),
+                       'A': rng.choice(np.array(['x', 'y', np.nan], dtype=object), 50),
+                       'B': rng.choice(['p', 'q', 'r'], 50),
+                       'C': rng.integers(0, 4, 50),
+                       'D': rng.choice(['u', 'v'], 50)})
+    df.loc[rng.random(50) < 0.2, 'Numerical'] = np.nan
+    df_before = df.copy()
+    columns = {'continous_columns': ['Numerical'], 'categorical_columns': ['A', 'B', 'C', 'D']}
+
+    expected_preprocessor = Preprocessor(scaler=MinMaxScaler(), encoder=encoder, seed=0).fit(df, **columns)
+    expected, expected_names = expected_preprocessor.transform_array(df, **columns)
+
+    preprocessor = Preprocessor(scaler=MinMaxScaler(), encoder=encoder, seed=0).fit(df, n_jobs=2, block_size=3, **columns)
+    assert preprocessor.layout == expected_preprocessor.layout
+    assert list(preprocessor.encoder.get_feature_names_out()) == list(expected_preprocessor.encoder.get_feature_names_out())
+    for categories, expected_categories in zip(preprocessor.encoder.categories_, expected_preprocessor.encoder.categories_):
+        assert categories.dtype == expected_categories.dtype
+        assert pd.Series(categories).equals(pd.Series(expected_categories))
+    values, names = preprocessor.transform_array(df, n_jobs=2, chunk_size=7, **columns)
+    assert names == expected_names
+    assert np.array_equal(values, expected)
+    pd.testing.assert_frame_equal(df, df_before)
+
+    # fit_transform and transform take the same n_jobs and give the same frames
+    expected_frame = Preprocessor(scaler=MinMaxScaler(), encoder=encoder, seed=0).fit_transform(df.copy(), **columns)
+    preprocessor = Preprocessor(scaler=MinMaxScaler(), encoder=encoder, seed=0)
+    frame = preprocessor.fit_transform(df.copy(), n_jobs=2, block_size=3, chunk_size=7, **columns)
+    pd.testing.assert_frame_equal(frame, expected_frame)
+    expected_preprocessor = Preprocessor(scaler=MinMaxScaler(), encoder=encoder, seed=0).fit(df, **columns)
+    pd.testing.assert_frame_equal(preprocessor.transform(df.copy(), n_jobs=2, chunk_size=7, **columns),
+                                  expected_preprocessor.transform(df.copy(), **columns))
+
+@pytest.mark.preprocessor
+def test_partial_fit(tmp_path):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'Numerical': rng.uniform(-5, 100, 60),
+                       'A': rng.choice(np.array(['x', 'y', 'z'], dtype=object), 60),
+                       'B': rng.integers(0, 4, 60)})
+    df.loc[rng.random(60) < 0.2, 'Numerical'] = np.nan
+    # A category and a NaN that only appear in the last chunk
+    df.loc[57, 'A'] = 'w'
+    df.loc[58, 'A'] = np.nan
+    path = tmp_path / "train.csv"
+    df.to_csv(path, index=False)
+    full = pd.read_csv(path)
+    columns = {'continous_columns': ['Numerical'], 'categorical_columns': ['A', 'B']}
+
+    expected = Preprocessor(scaler=MinMaxScaler(), encoder=OneHotEncoder(sparse_output=False), nan_fill="mean").fit(full, **columns)
+    preprocessor = Preprocessor(scaler=MinMaxScaler(), encoder=OneHotEncoder(sparse_output=False), nan_fill="mean")
+    for chunk in pd.read_csv(path, chunksize=25):
+        preprocessor.partial_fit(chunk, **columns)
+    preprocessor.finalize()
+    assert preprocessor.layout == expected.layout
+    assert list(preprocessor.encoder.get_feature_names_out()) == list(expected.encoder.get_feature_names_out())
+    for categories, expected_categories in zip(preprocessor.encoder.categories_, expected.encoder.categories_):
+        assert pd.Series(categories).equals(pd.Series(expected_categories))
+    assert np.array_equal(preprocessor.scaler.data_min_, expected.scaler.data_min_)
+    assert np.array_equal(preprocessor.scaler.data_max_, expected.scaler.data_max_)
+    assert preprocessor.fill_means['Numerical'] == pytest.approx(expected.fill_means['Numerical'])
+    values, names = preprocessor.transform_array(full, **columns)
+    expected_values, expected_names = expected.transform_array(full, **columns)
+    assert names == expected_names
+    assert np.array_equal(values, expected_values)
+    streamed = fit_csv(Preprocessor(scaler=MinMaxScaler(), encoder=OneHotEncoder(sparse_output=False)), path, chunksize=25, **columns)
+    assert streamed.layout == expected.layout
+
+    with pytest.raises(ValueError):
+        preprocessor.finalize()
+    preprocessor.partial_fit(full, **columns)
+    with pytest.raises(ValueError):
+        preprocessor.partial_fit(full, continous_columns=['Numerical'])
+    with pytest.raises(ValueError):
+        Preprocessor(scaler=RobustScaler(), encoder=OneHotEncoder()).partial_fit(full, **columns)
+
+    # fit and fit_transform abandon a pass left open by a chunk that raised
+    for full_fit in (preprocessor.fit, preprocessor.fit_transform):
+        with pytest.raises(KeyError):
+            preprocessor.partial_fit(full.drop(columns=['B']), **columns)
+        full_fit(full.copy(), **columns)
+        with pytest.raises(ValueError):
+            preprocessor.finalize()
+        preprocessor.partial_fit(full, continous_columns=['Numerical']).finalize()
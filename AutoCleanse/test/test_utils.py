@@ -2,7 +2,11 @@ import pandas as pd
 import numpy as np
 import pytest
 import os
+import torch.nn.functional as F
 from AutoCleanse.utils import *
+from AutoCleanse.layout import ColumnLayout
+from AutoCleanse.autoencoder import Autoencoder
+from AutoCleanse.inference import InferenceGraph
 
 @pytest.fixture
 def data_fixture():
@@ -14,3 +18,38 @@ def test_replace_with_nan(data_fixture):
     expected_output = pd.DataFrame({'A': [1, 2, 3, 4, np.nan], 'B': [np.nan, 7, 8, 9, 10]}).astype(float)
     output = replace_with_nan(data_fixture, 0.2, 42)
     assert expected_output.equals(output)
+
+def reference_argmax(input, sizes):
+    outputs = []
+    start_index = 0
+    for size in sizes:
+        outputs.append(F.one_hot(torch.argmax(input[:, start_index:start_index + size], dim=1), size).float())
+        start_index += size
+    return torch.cat(outputs, dim=1)
+
+@pytest.mark.utils
+@pytest.mark.parametrize("sizes", [(3, 2, 4, 1), (2, 2, 2, 2, 100)])
+def test_argmax_softmax(sizes):
+    torch.manual_seed(42)
+    layout = ColumnLayout([], [f"c{i}" for i in range(len(sizes))], [np.arange(size) for size in sizes])
+    assert (layout.pad_index is None) == (sizes == (2, 2, 2, 2, 100))
+    input = torch.randn(16, sum(sizes))
+    input[0, 3:5] = 7.0  # ties resolve to the first maximum like torch.argmax
+
+    output = argmax(input, layout=layout)
+    assert torch.equal(output, reference_argmax(input, sizes))
+    out = torch.full((16, sum(sizes) + 1), -1.0)
+    argmax(input, layout=layout, out=out[:, 1:])
+    assert torch.equal(out[:, 1:], output) and bool((out[:, 0] == -1).all())
+
+    expected = torch.cat([F.softmax(part, dim=1) for part in torch.split(input, list(sizes), dim=1)], dim=1)
+    assert torch.allclose(softmax(input, layout=layout), expected, atol=1e-6)
+
+    # NaN logits never win and never move the onehot into another group, a group of only NaN takes its first column
+    input[1, 0] = float('nan')
+    input[2, :sizes[0]] = float('nan')
+    input[3, -1] = float('nan')
+    expected = reference_argmax(torch.nan_to_num(input, nan=float('-inf')), sizes)
+    assert torch.equal(argmax(input, layout=layout), expected)
+    graph = InferenceGraph(Autoencoder(layers=[sum(sizes), 2], batch_norm=False), layout)
+    assert torch.equal(graph._decode_categorical(input), expected)
@@ -8,66 +8,143 @@ import numpy as np
 from numpy import mean, max, prod, array, hstack
 from numpy.random import choice
 import torch
-import torch.nn.functional as F
 import torch.optim as optim
+from AutoCleanse.layout import ColumnLayout
 
-def softmax(input, onehotencoder, continous_columns, categorical_columns, device):
+def segment_max(input, group_ids, num_groups):
     """
-     @brief Computes softmax activations of a dataframe correspondingly to continous and categorical columns
+     @brief Computes the maximum of every column group of a batch in one pass
+     @param input: Tensor of shape [batch, columns]
+     @param group_ids: Group id of every column
+     @param num_groups: Number of groups
+     @return Tensor of shape [batch, groups]
+    """
+    index = group_ids.expand(input.shape[0], -1)
+    # -inf is the identity of the maximum, so including it keeps the result and the graph exportable to ONNX
+    output = torch.full((input.shape[0], num_groups), float('-inf'), dtype=input.dtype, device=input.device)
+    return output.scatter_reduce(1, index, input, reduce='amax', include_self=True)
+
+def segment_logsumexp(input, group_ids, num_groups):
+    """
+     @brief Computes the log-sum-exp of every column group of a batch in one pass
+     @param input: Tensor of shape [batch, columns]
+     @param group_ids: Group id of every column
+     @param num_groups: Number of groups
+     @return Tensor of shape [batch, groups]
+    """
+    group_max = segment_max(input, group_ids, num_groups).detach()
+    exp = torch.exp(input - group_max.index_select(1, group_ids))
+    group_sum = torch.zeros_like(group_max).index_add(1, group_ids, exp)
+    return group_max + torch.log(group_sum)
+
+def _mask_nan(input):
+    # NaN never wins a maximum, a group of only NaN resolves to its first column
+    return torch.nan_to_num(input, nan=float('-inf'), posinf=float('inf'), neginf=float('-inf'))
+
+def segment_argmax(input, group_ids, num_groups):
+    """
+     @brief Computes the column of the first maximum of every column group of a batch in one pass, like torch.argmax per group.
+            NaN values are ignored
+     @param input: Tensor of shape [batch, columns]
+     @param group_ids: Group id of every column
+     @param num_groups: Number of groups
+     @return Tensor of shape [batch, groups] holding column indices relative to the whole input
+    """
+    input = _mask_nan(input)
+    group_max = segment_max(input, group_ids, num_groups)
+    positions = torch.arange(input.shape[1], device=input.device).expand(input.shape[0], -1)
+    positions = torch.where(input == group_max.index_select(1, group_ids), positions, input.shape[1])
+    first = torch.full_like(group_max, input.shape[1], dtype=torch.long)
+    return first.scatter_reduce(1, group_ids.expand(input.shape[0], -1), positions, reduce='amin', include_self=True)
+
+def group_argmax(input, group_ids, group_offsets, num_groups, max_size, pad_index=None, pad_rank=None):
+    """
+     @brief Computes the column of the first maximum of every column group of a batch, over a padded
+            [batch, max_size, groups] view when pad_index is given, otherwise with segment_argmax. NaN values are ignored
+     @param input: Tensor of shape [batch, columns]
+     @param group_ids: Group id of every column
+     @param group_offsets: Start of every group
+     @param num_groups: Number of groups
+     @param max_size: Size of the largest group
+     @param pad_index: Column index of the padded view, see ColumnLayout
+     @param pad_rank: Reversed position of every slot of the padded view, see ColumnLayout
+     @return Tensor of shape [batch, groups] holding column indices relative to the whole input
+    """
+    if (pad_index is None):
+        return segment_argmax(input, group_ids, num_groups)
+    # Padding slots repeat the first column of their group, so they never win over it
+    padded = _mask_nan(input).index_select(1, pad_index).view(input.shape[0], max_size, num_groups)
+    is_max = padded == padded.amax(dim=1, keepdim=True)
+    # The first maximum has the highest reversed rank
+    first = max_size - (is_max * pad_rank).amax(dim=1)
+    return first.long() + group_offsets
+
+def softmax(input, onehotencoder=None, continous_columns=None, categorical_columns=None, device=None, layout=None, out=None):
+    """
+     @brief Computes softmax activations of a dataframe correspondingly to continous and categorical columns.
+            All onehot subcolumn groups are processed in one pass.
      @param input: The input tensor
      @param onehotencoder: The onehot encoder used to encode the categorical input
      @param continous_columns: A list of continous column names
      @param categorical_columns: A list of categorical column names
      @param device: can be "cpu" or "cuda"
+     @param layout: The ColumnLayout of the data, replaces onehotencoder and the column lists
+     @param out: Optional preallocated tensor of the same shape as input to write the result into
     """
-    # Map categorical columns with onehot subcolumns
-    encoded_columns = onehotencoder.categories_
-    column_map = {column: encoded_columns[i] for i, column in enumerate(categorical_columns)}
-
-    # Get indices of onehot subcolumns groups
-    slice_list = []
-    for i in list(column_map):
-        slice_list.append(column_map[i].shape[0])
-
-    start_index = 0
-    softmax_column = {}
-    output = torch.empty(0).to(device)
-    for i,size in enumerate(slice_list):
-        end_index = start_index + size
-        softmax_column[f"_{i}"] = F.softmax(input[:,start_index:end_index],dim=1)
-        output = torch.cat((output,softmax_column[f"_{i}"]),dim=1)
-        start_index = end_index
+    if (layout is None):
+        layout = ColumnLayout(continous_columns, categorical_columns, onehotencoder.categories_)
+    layout = layout.to(input.device)
+    group_ids = layout.group_ids
 
-    return output
+    group_max = segment_max(input, group_ids, layout.num_categorical)
+    exp = torch.exp(input - group_max.index_select(1, group_ids))
+    group_sum = torch.zeros_like(group_max).index_add(1, group_ids, exp)
+    return torch.div(exp, group_sum.index_select(1, group_ids), out=out)
 
-def argmax(input, onehotencoder, continous_columns, categorical_columns, device):
+def argmax(input, onehotencoder=None, continous_columns=None, categorical_columns=None, device=None, layout=None, out=None):
     """
-     @brief Computes argmax activations of a dataframe correspondingly to continous and categorical columns
+     @brief Computes argmax activations of a dataframe correspondingly to continous and categorical columns.
+            All onehot subcolumn groups are processed in one pass over a padded [batch, max_card, groups] view,
+            or with segment reductions when the group sizes are too uneven for padding. NaN values never win.
      @param input: The input tensor
      @param encoder: The onehot encoder used to encode the categorical input
      @param continous_columns: A list of continous column names
      @param categorical_columns: A list of categorical column names
      @param device: Can be "cpu" or "cuda"
+     @param layout: The ColumnLayout of the data, replaces onehotencoder and the column lists
+     @param out: Optional preallocated tensor of the same shape as input to write the onehot result into
     """
-    # Map categorical columns with onehot subcolumns
-    encoded_columns = onehotencoder.categories_
-    column_map = {column: encoded_columns[i] for i, column in enumerate(categorical_columns)}
-
-    # Get indices of onehot subcolumns groups
-    slice_list = []
-    for i in list(column_map):
-        slice_list.append(column_map[i].shape[0])
-
-    start_index = 0
-    output = torch.empty(0).to(device)
-    for i,size in enumerate(slice_list):
-        end_index = start_index + size
-        argmax_indices = torch.argmax(input[:,start_index:end_index],dim=1)
-        argmax_output = F.one_hot(argmax_indices,input[:,start_index:end_index].size(1))
-        output = torch.cat((output,argmax_output),dim=1)
-        start_index = end_index
-
-    return output
+    if (layout is None):
+        layout = ColumnLayout(continous_columns, categorical_columns, onehotencoder.categories_)
+    layout = layout.to(input.device)
+    first = group_argmax(input, layout.group_ids, layout.group_offsets, layout.num_categorical, layout.max_size,
+                         layout.pad_index, layout.pad_rank)
+
+    if (out is None):
+        out = torch.zeros_like(input)
+    else:
+        out.zero_()
+    return out.scatter_(1, first, 1)
+
+def activation_penalty_forward(sequential, x, l1_strength, l2_strength):
+    """
+     @brief Runs a sequential block and collects the L1/L2 activation penalty of the outputs of its ReLU layers,
+            l1_strength * mean(|a|) + l2_strength * mean(a^2) per ReLU, without allocating zero targets
+     @param sequential: The nn.Sequential to run
+     @param x: The input batch
+     @param l1_strength: Strength of the L1 activation penalty
+     @param l2_strength: Strength of the L2 activation penalty
+     @return The output of the block and the penalty as a scalar tensor
+    """
+    penalty = torch.zeros((), device=x.device)
+    for module in sequential:
+        x = module(x)
+        if (isinstance(module, torch.nn.ReLU)):
+            if (l1_strength != 0):
+                penalty = penalty + l1_strength * x.abs().mean()
+            if (l2_strength != 0):
+                penalty = penalty + l2_strength * x.square().mean()
+    return x, penalty
 
 def generate_suffix(layer_sizes,prefix,load_method=None):
     # Convert the list of layer sizes to a list of strings
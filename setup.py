@@ -12,6 +12,10 @@ setup(
     license="MIT",
     include_package_data=True,
     install_requires=[],
+    extras_require={
+        # Autoencoder.export_onnx and AutoCleanse.onnx_backend
+        "onnx": ["onnx>=1.14.0", "onnxruntime>=1.16.0"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",